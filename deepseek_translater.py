@@ -7,27 +7,48 @@
 import asyncio
 import aiohttp
 import argparse
+import hashlib
+import json
+import math
 import os
+import re
+import sqlite3
 import sys
 import time
 from collections import deque
-from dataclasses import dataclass, field
-from typing import List, Optional, Tuple
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from tqdm import tqdm
 
 # ---------------------------- 配置区域 ----------------------------
 DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
 DEFAULT_MODEL = "deepseek-chat"
-MAX_CHUNK_CHARS = 1500                # 每个文本块的最大字符数
+CHUNK_TOKEN_BUDGET = 1200              # 每个文本块的目标 token 数（连续的短段落合并到这个大小）
+RESPONSE_TOKEN_RATIO = 1.3              # 译文 token 数 / 原文 token 数的估计上限，用于保证回复不超过 MAX_TOKENS
 MAX_CONCURRENT_WORKERS = 20            # 最大并发工作协程数
 MIN_CONCURRENT_WORKERS = 1             # 最小并发工作协程数
+INITIAL_CONCURRENT_WORKERS = 5         # 初始并发数
 ADAPT_WINDOW_SIZE = 20                  # 用于自适应决策的滑动窗口大小
-FAILURE_RATE_THRESHOLD = 0.1            # 允许的最大失败率（超过则减少并发）
-SUCCESS_RATE_INCREASE_THRESHOLD = 0.98  # 成功率高于此且平均响应时间低于阈值时增加并发
-RESPONSE_TIME_THRESHOLD = 3.0           # 平均响应时间阈值（秒）
-RETRY_LIMIT = 3                         # 每个块的最大重试次数
+ADDITIVE_INCREASE = 1.0                 # 加性增：每轮（约等于当前并发数的成功请求）增加的并发数
+BACKOFF_RATIO = 0.5                     # 乘性减：收到 429、502/503/504 或超时后并发数乘以此系数
+LATENCY_BASELINE_WINDOW = 50            # 每个块大小档位保留的基准延迟样本数
+LATENCY_TOLERANCE = 2.0                 # 近期平均延迟超过基准的倍数时视为拥塞
+LATENCY_BASELINE_FLOOR = 0.5            # 基准延迟下限（秒）：毫秒级的本地调度抖动不算拥塞
+LATENCY_BACKOFF_RATIO = 0.8             # 延迟拥塞时并发数乘以此系数
+RETRY_AFTER_MAX = 60.0                  # Retry-After 等待时间上限（秒）
+RETRY_LIMIT = 3                         # 每个块的最大重试次数（429 限流除外）
+THROTTLE_RETRY_LIMIT = 10               # 每个块因 429 限流的最大重试次数
 RETRY_BACKOFF_FACTOR = 1.5              # 重试退避因子
+SYSTEM_PROMPT = ("你是一个日文翻译专家，将用户输入的日文文本翻译成流畅的中文。"
+                 "原文每行是一个段落，译文保持相同的分行，每段译文单独一行，不要合并或拆分段落，不要添加说明。")
+TEMPERATURE = 0.3                       # 采样温度
+MAX_TOKENS = 2000                       # 单次回复的最大 token 数
+TRANSLATION_MEMORY_PATH = os.path.join(os.path.expanduser("~"), ".deepseek_translation_memory.sqlite")
+TRANSLATION_MEMORY_MAX_MB = 512         # 翻译记忆库大小上限（MB），超出后淘汰最久未使用的条目
+REORDER_WINDOW = 200                    # 已读入但尚未按顺序写出的块数上限（决定内存占用）
 # -------------------------------------------------------------------
 
 @dataclass
@@ -36,6 +57,8 @@ class Chunk:
     index: int
     text: str
     retries: int = 0
+    throttles: int = 0                  # 收到 429 的次数，与 retries 分开计数
+    key: Optional[str] = None           # 内容哈希（TranslationMemory.make_key），用于翻译记忆库和任务日志
 
 @dataclass
 class TranslationResult:
@@ -44,83 +67,323 @@ class TranslationResult:
     text: Optional[str]
     success: bool
     error: Optional[str] = None
+    key: Optional[str] = None
+    from_journal: bool = False          # 从任务日志读回的结果，不再重复写入日志
 
 @dataclass
-class WorkerStats:
-    """工作协程统计信息"""
-    success_count: int = 0
-    failure_count: int = 0
-    recent_response_times: deque = field(default_factory=lambda: deque(maxlen=ADAPT_WINDOW_SIZE))
+class ApiReply:
+    """一次 API 请求的结果"""
+    index: int
+    text: Optional[str]
+    error: Optional[str]
+    response_time: float
+    status: Optional[int] = None        # HTTP 状态码，超时或连接出错时为 None
+    retry_after: Optional[float] = None # 服务器 Retry-After 头要求的等待秒数
 
     @property
-    def total_requests(self) -> int:
-        return self.success_count + self.failure_count
+    def throttled(self) -> bool:
+        return self.status == 429
 
     @property
-    def failure_rate(self) -> float:
-        if self.total_requests == 0:
-            return 0.0
-        return self.failure_count / self.total_requests
+    def congested(self) -> bool:
+        """
+        限流、网关错误、服务不可用、超时和连接错误说明服务端过载；
+        其他 4xx 和普通 500 是请求本身或偶发的问题，降低并发也无济于事，只按块重试
+        """
+        return self.text is None and self.status in (None, 429, 502, 503, 504)
+
+class TranslationMemory:
+    """
+    翻译记忆库（SQLite）：以原文、模型、系统提示词和采样参数的哈希为键保存译文，
+    命中的块不再请求 API。译文总大小超过上限时，按最近使用时间淘汰旧条目。
+    """
+    def __init__(self, path: str, max_bytes: int = TRANSLATION_MEMORY_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path)
+        # auto_vacuum 只能在建表前设置；淘汰后用 incremental_vacuum 归还磁盘空间
+        self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS memory ("
+            "key TEXT PRIMARY KEY, translation TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS memory_last_used ON memory (last_used)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM memory").fetchone()[0]
+
+    @staticmethod
+    def make_key(text: str, model: str = DEFAULT_MODEL) -> str:
+        """原文与所有影响译文的请求参数一起哈希，修改提示词或参数后旧译文自然失效"""
+        payload = json.dumps([model, SYSTEM_PROMPT, TEMPERATURE, MAX_TOKENS, text], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """批量查询，返回 {键: 译文}，并刷新命中条目的最近使用时间"""
+        found = {}
+        for start in range(0, len(keys), 500):  # 单条 SQL 的参数个数有限
+            batch = keys[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            found.update(self.conn.execute(
+                f"SELECT key, translation FROM memory WHERE key IN ({placeholders})", batch))
+        if found:
+            now = time.time()
+            self.conn.executemany("UPDATE memory SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            self.conn.commit()
+        return found
+
+    def put(self, key: str, translation: str):
+        size = len(translation.encode('utf-8'))
+        old = self.conn.execute("SELECT size FROM memory WHERE key = ?", (key,)).fetchone()
+        self.conn.execute("INSERT OR REPLACE INTO memory VALUES (?, ?, ?, ?)", (key, translation, size, time.time()))
+        self.total_bytes += size - (old[0] if old else 0)
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        """淘汰最久未使用的条目，直到总大小降到上限的 90% 以下（留出余量，避免每次写入都触发淘汰）"""
+        target = self.max_bytes * 0.9
+        victims = []
+        for key, size in self.conn.execute("SELECT key, size FROM memory ORDER BY last_used"):
+            if self.total_bytes <= target:
+                break
+            victims.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM memory WHERE key = ?", victims)
+        self.conn.commit()
+        self.conn.execute("PRAGMA incremental_vacuum")
+
+    def close(self):
+        self.conn.close()
+
+class TranslationJournal:
+    """
+    任务日志（JSON Lines）：每个块的结果一到达就追加一行 {"index", "key", "text" 或 "error"}，
+    进程崩溃或 Ctrl-C 后已完成的块都不会丢失。key 为该块的 TranslationMemory.make_key，
+    恢复时只采用与当前分块一致的记录，源文件或分块方式变化后对应的记录自动作废。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._reader = None
+
+    def index(self) -> Dict[int, Tuple[str, int]]:
+        """
+        扫描日志，返回已成功块的 {index: (key, 行偏移量)}（同一块有多条记录时以最后一条为准）。
+        只记录偏移量，译文在需要写出时再用 read 读回。
+        """
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = None  # 崩溃时最后一行可能只写了一半
+                if isinstance(entry, dict) and isinstance(entry.get('index'), int):
+                    if 'text' in entry:
+                        done[entry['index']] = (entry.get('key'), offset)
+                    else:
+                        done.pop(entry['index'], None)
+                offset += len(line)
+        return done
+
+    def read(self, offset: int) -> TranslationResult:
+        if self._reader is None:
+            self._reader = open(self.path, 'rb')
+        self._reader.seek(offset)
+        entry = json.loads(self._reader.readline())
+        return TranslationResult(entry['index'], entry['text'], success=True, key=entry['key'], from_journal=True)
+
+    def open(self, append: bool):
+        """append=False 时清空旧日志重新开始"""
+        self._file = open(self.path, 'a' if append else 'w', encoding='utf-8')
+
+    def append(self, result: TranslationResult):
+        entry = {'index': result.index, 'key': result.key}
+        if result.success:
+            entry['text'] = result.text
+        else:
+            entry['error'] = result.error
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+class OrderedWriter:
+    """
+    重排序写出：结果可能乱序到达，先放入缓冲区，序号更小的块全部完成后立即按顺序写入文件。
+    缓冲区只保存乱序窗口内的结果，与全文长度无关。一个块包含多个段落时，译文按行拆回段落，段落之间空一行。
+    """
+    def __init__(self, path: str):
+        self._file = open(path, 'w', encoding='utf-8')
+        self.next_index = 0
+        self.pending: Dict[int, TranslationResult] = {}
+        self.failed = 0
+
+    def add(self, result: TranslationResult) -> int:
+        """加入一个结果，返回本次写出的块数"""
+        self.pending[result.index] = result
+        written = 0
+        while self.next_index in self.pending:
+            res = self.pending.pop(self.next_index)
+            if res.success:
+                paragraphs = [line for line in res.text.split('\n') if line.strip()]
+                self._file.write('\n\n'.join(paragraphs) + '\n\n')
+            else:
+                self.failed += 1
+                self._file.write(f"[翻译失败: {res.error or '未知错误'}]\n\n")
+            self.next_index += 1
+            written += 1
+        return written
+
+    def close(self):
+        self._file.close()
+
+class CongestionController:
+    """
+    拥塞控制器（AIMD + 延迟梯度）：并发上限 limit 决定同时进行的请求数。
+    - 成功：第一次拥塞之前每个成功请求增加 ADDITIVE_INCREASE（慢启动，按轮翻倍），
+      之后每轮（约 limit 个成功请求）增加 ADDITIVE_INCREASE
+    - 429、502/503/504、超时：乘以 BACKOFF_RATIO；429 带 Retry-After 时所有请求暂停到指定时间
+    - 近期响应时间平均为同档位基准（第 10 百分位数）的 LATENCY_TOLERANCE 倍以上：乘以 LATENCY_BACKOFF_RATIO。
+      块按 token 数分档（每档相差约 1.4 倍），只和大小相近的块比较：
+      响应时间里有与大小无关的固定开销，按 token 平均会让小块显得很慢
+    统计只看滑动窗口，早期的失败不会一直压低并发。一次降低之前发出的请求随后失败不再重复降低，
+    同一波拥塞只降一次。clock 可替换为模拟时钟（见 deepseek_translater_sim.py）。
+    """
+    def __init__(self, initial_workers: int = INITIAL_CONCURRENT_WORKERS, verbose: bool = True,
+                 clock: Callable[[], float] = time.monotonic):
+        self.limit = float(initial_workers)
+        self.verbose = verbose
+        self.clock = clock
+        self.in_flight = 0
+        self.pause_until = 0.0
+        self.slow_start = True
+        self.last_decrease = float('-inf')
+        self.recent_latency = deque(maxlen=ADAPT_WINDOW_SIZE)   # (档位, 响应时间)
+        self.baseline_latency: Dict[int, deque] = {}           # 档位 -> 近期响应时间
+        self._changed = asyncio.Event()
 
     @property
-    def avg_response_time(self) -> Optional[float]:
-        if not self.recent_response_times:
+    def current_workers(self) -> int:
+        return int(self.limit)
+
+    def try_acquire(self) -> bool:
+        """未暂停且进行中的请求数低于上限时占用一个名额"""
+        if self.clock() < self.pause_until or self.in_flight >= self.current_workers:
+            return False
+        self.in_flight += 1
+        return True
+
+    async def acquire(self) -> float:
+        """等待一个请求名额，返回发出请求的时刻"""
+        while not self.try_acquire():
+            wait = self.pause_until - self.clock()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            else:
+                self._changed.clear()
+                await self._changed.wait()
+        return self.clock()
+
+    def release(self):
+        self.in_flight -= 1
+        self._changed.set()
+
+    def record(self, reply: ApiReply, started_at: float, tokens: int = 1):
+        """
+        根据一次请求的结果调整并发上限。started_at 为 acquire 返回的时刻，
+        tokens 为原文 token 数，用于把响应时间和大小相近的块比较。
+        """
+        if reply.text is not None:
+            size = int(2 * math.log2(max(tokens, 1)))
+            self.recent_latency.append((size, reply.response_time))
+            self.baseline_latency.setdefault(size, deque(maxlen=LATENCY_BASELINE_WINDOW)).append(reply.response_time)
+            gradient = self.latency_gradient()
+            if gradient > LATENCY_TOLERANCE:
+                self._decrease(LATENCY_BACKOFF_RATIO, started_at, f"响应时间升至基准的 {gradient:.1f} 倍")
+            else:
+                step = ADDITIVE_INCREASE if self.slow_start else ADDITIVE_INCREASE / self.limit
+                self.limit = min(MAX_CONCURRENT_WORKERS, self.limit + step)
+                self._changed.set()
+        elif reply.congested:
+            if reply.retry_after is not None:
+                self.pause_until = max(self.pause_until, self.clock() + reply.retry_after)
+            self._decrease(BACKOFF_RATIO, started_at, reply.error or "请求失败")
+
+    def latency_gradient(self) -> float:
+        """
+        近期响应时间与同档位基准之比的平均值。基准取档位内的第 10 百分位数（不低于
+        LATENCY_BASELINE_FLOOR），比最小值更不容易被个别特别快的请求拉低；
+        基准样本不足 5 个的档位不参与，可比较的样本不足半个窗口时返回 1。
+        """
+        baselines = {}
+        for size, samples in self.baseline_latency.items():
+            if len(samples) >= 5:
+                baselines[size] = max(sorted(samples)[len(samples) // 10], LATENCY_BASELINE_FLOOR)
+        ratios = [latency / baselines[size] for size, latency in self.recent_latency if size in baselines]
+        if len(ratios) < ADAPT_WINDOW_SIZE // 2:
+            return 1.0
+        return sum(ratios) / len(ratios)
+
+    def _decrease(self, ratio: float, started_at: float, reason: str):
+        if started_at < self.last_decrease:
+            return  # 上次降低之前发出的请求，反映的是降低前的负载
+        old = self.current_workers
+        self.limit = max(MIN_CONCURRENT_WORKERS, self.limit * ratio)
+        self.slow_start = False
+        self.last_decrease = self.clock()
+        self.recent_latency.clear()
+        if self.verbose and self.current_workers != old:
+            print(f"\n[自适应] {reason[:80]}，并发数降至 {self.current_workers}")
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回不超过 RETRY_AFTER_MAX 的等待秒数"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
             return None
-        return sum(self.recent_response_times) / len(self.recent_response_times)
-
-class AdaptiveController:
-    """自适应控制器：根据统计信息调整工作协程数量"""
-    def __init__(self, initial_workers: int = 5):
-        self.current_workers = initial_workers
-        self.stats = WorkerStats()
-        self._lock = asyncio.Lock()
-
-    async def record_success(self, response_time: float):
-        async with self._lock:
-            self.stats.success_count += 1
-            self.stats.recent_response_times.append(response_time)
-
-    async def record_failure(self):
-        async with self._lock:
-            self.stats.failure_count += 1
-
-    async def should_adjust(self) -> Optional[int]:
-        """根据统计信息决定是否调整并发数，返回新的 worker 数量或 None"""
-        async with self._lock:
-            if self.stats.total_requests < ADAPT_WINDOW_SIZE // 2:
-                return None  # 数据不足，暂不调整
-
-            failure_rate = self.stats.failure_rate
-            avg_rt = self.stats.avg_response_time
-
-            new_workers = self.current_workers
-
-            # 失败率过高 -> 减少并发
-            if failure_rate > FAILURE_RATE_THRESHOLD and self.current_workers > MIN_CONCURRENT_WORKERS:
-                new_workers = max(MIN_CONCURRENT_WORKERS, self.current_workers - 1)
-                print(f"\n[自适应] 失败率 {failure_rate:.2%} 过高，减少并发数至 {new_workers}")
-            # 成功率很高且平均响应时间理想 -> 增加并发
-            elif (failure_rate < 1 - SUCCESS_RATE_INCREASE_THRESHOLD and
-                  avg_rt is not None and avg_rt < RESPONSE_TIME_THRESHOLD and
-                  self.current_workers < MAX_CONCURRENT_WORKERS):
-                new_workers = min(MAX_CONCURRENT_WORKERS, self.current_workers + 1)
-                print(f"\n[自适应] 响应快速且成功率高，增加并发数至 {new_workers}")
-
-            if new_workers != self.current_workers:
-                self.current_workers = new_workers
-                return new_workers
+    return min(max(seconds, 0.0), RETRY_AFTER_MAX)
+
+def retry_delay(chunk: Chunk, reply: ApiReply) -> Optional[float]:
+    """
+    失败后的重试策略：返回重新入队前的等待秒数，None 表示放弃。
+    429 单独计数；服务器给出 Retry-After 时由控制器统一暂停，块本身不再额外等待。
+    """
+    if reply.throttled:
+        chunk.throttles += 1
+        if chunk.throttles > THROTTLE_RETRY_LIMIT:
             return None
+        return 0.0 if reply.retry_after is not None else RETRY_BACKOFF_FACTOR ** chunk.throttles
+    chunk.retries += 1
+    if chunk.retries > RETRY_LIMIT:
+        return None
+    return RETRY_BACKOFF_FACTOR ** chunk.retries
 
 async def translate_chunk(
     session: aiohttp.ClientSession,
     chunk: Chunk,
     api_key: str,
     model: str = DEFAULT_MODEL
-) -> Tuple[int, Optional[str], Optional[str], float]:
-    """
-    调用 DeepSeek API 翻译单个文本块。
-    返回 (index, translated_text, error_message, response_time)
-    """
+) -> ApiReply:
+    """调用 DeepSeek API 翻译单个文本块，返回译文或错误信息，以及 HTTP 状态码和 Retry-After"""
     start_time = time.monotonic()
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -129,11 +392,11 @@ async def translate_chunk(
     payload = {
         "model": model,
         "messages": [
-            {"role": "system", "content": "你是一个日文翻译专家，将用户输入的日文文本翻译成流畅的中文。"},
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": chunk.text}
         ],
-        "temperature": 0.3,
-        "max_tokens": 2000
+        "temperature": TEMPERATURE,
+        "max_tokens": MAX_TOKENS
     }
     try:
         async with session.post(DEEPSEEK_API_URL, headers=headers, json=payload) as resp:
@@ -141,45 +404,57 @@ async def translate_chunk(
             if resp.status == 200:
                 data = await resp.json()
                 translated = data['choices'][0]['message']['content'].strip()
-                return chunk.index, translated, None, response_time
+                return ApiReply(chunk.index, translated, None, response_time, resp.status)
             else:
                 error_text = await resp.text()
                 error_msg = f"HTTP {resp.status}: {error_text}"
-                return chunk.index, None, error_msg, response_time
+                return ApiReply(chunk.index, None, error_msg, response_time, resp.status,
+                                parse_retry_after(resp.headers.get('Retry-After')))
     except asyncio.TimeoutError:
-        return chunk.index, None, "Timeout", time.monotonic() - start_time
+        return ApiReply(chunk.index, None, "Timeout", time.monotonic() - start_time)
     except Exception as e:
-        return chunk.index, None, str(e), time.monotonic() - start_time
+        return ApiReply(chunk.index, None, str(e), time.monotonic() - start_time)
 
 async def worker(
     worker_id: int,
     task_queue: asyncio.Queue,
     result_queue: asyncio.Queue,
     api_key: str,
-    controller: AdaptiveController,
-    session: aiohttp.ClientSession
+    controller: CongestionController,
+    session: aiohttp.ClientSession,
+    memory: Optional[TranslationMemory] = None
 ):
-    """工作协程：不断从任务队列获取块并翻译，结果放入结果队列"""
+    """
+    工作协程：不断从任务队列获取块，向控制器申请请求名额后翻译，结果放入结果队列
+    （成功的译文同时写入翻译记忆库）。
+    """
     while True:
         chunk: Chunk = await task_queue.get()
         try:
-            index, translated, error, response_time = await translate_chunk(session, chunk, api_key)
-            if translated is not None:
-                await controller.record_success(response_time)
-                await result_queue.put(TranslationResult(index, translated, success=True))
+            started_at = await controller.acquire()
+            try:
+                reply = await translate_chunk(session, chunk, api_key)
+            finally:
+                controller.release()
+            controller.record(reply, started_at, estimate_tokens(chunk.text))
+            if reply.text is not None:
+                if memory is not None:
+                    memory.put(chunk.key, reply.text)
+                await result_queue.put(TranslationResult(chunk.index, reply.text, success=True, key=chunk.key))
+                continue
+            wait = retry_delay(chunk, reply)
+            if wait is None:
+                # 超过重试次数，记录失败结果
+                await result_queue.put(TranslationResult(chunk.index, None, success=False, error=reply.error, key=chunk.key))
+                continue
+            if reply.throttled:
+                print(f"\n[限流 {chunk.throttles}/{THROTTLE_RETRY_LIMIT}] 块 {chunk.index} 收到 429，"
+                      f"{max(wait, controller.pause_until - controller.clock()):.1f}秒后重试")
             else:
-                await controller.record_failure()
-                # 判断是否重试
-                if chunk.retries < RETRY_LIMIT:
-                    chunk.retries += 1
-                    # 退避重试：等待一段时间后放回队列
-                    wait = RETRY_BACKOFF_FACTOR ** chunk.retries
-                    print(f"\n[重试 {chunk.retries}/{RETRY_LIMIT}] 块 {index} 失败: {error}，{wait:.1f}秒后重试")
-                    await asyncio.sleep(wait)
-                    await task_queue.put(chunk)
-                else:
-                    # 超过重试次数，记录失败结果
-                    await result_queue.put(TranslationResult(index, None, success=False, error=error))
+                print(f"\n[重试 {chunk.retries}/{RETRY_LIMIT}] 块 {chunk.index} 失败: {reply.error}，{wait:.1f}秒后重试")
+            # 退避重试：等待一段时间后放回队列
+            await asyncio.sleep(wait)
+            await task_queue.put(chunk)
         finally:
             task_queue.task_done()
 
@@ -188,143 +463,223 @@ async def controller(
     result_queue: asyncio.Queue,
     api_key: str,
     total_chunks: int,
-    pbar: tqdm
+    pbar: tqdm,
+    journal: TranslationJournal,
+    writer: OrderedWriter,
+    window: asyncio.Semaphore,
+    memory: Optional[TranslationMemory] = None
 ):
     """
     控制器协程：
-    - 启动初始数量的 worker
-    - 定期检查自适应统计信息并调整 worker 数量
-    - 收集结果更新进度条
+    - 启动 MAX_CONCURRENT_WORKERS 个 worker，同时进行的请求数由 CongestionController 限制
+    - 收集结果写入任务日志，交给 writer 按顺序写出，每写出一块归还一个窗口名额
     - 所有任务完成后停止 worker
+    并发数通过请求名额调整，不再取消 worker，正在处理的块不会丢失。
     """
-    controller = AdaptiveController(initial_workers=5)
+    controller = CongestionController()
     workers = []
-    stats_lock = asyncio.Lock()
-    connector = aiohttp.TCPConnector(limit=0)  # 连接池无限制，由自适应控制
+    connector = aiohttp.TCPConnector(limit=0)  # 连接池无限制，由拥塞控制器限制并发
     async with aiohttp.ClientSession(connector=connector) as session:
-        # 启动初始 workers
-        for i in range(controller.current_workers):
+        for i in range(MAX_CONCURRENT_WORKERS):
             worker_task = asyncio.create_task(
-                worker(i, task_queue, result_queue, api_key, controller, session)
+                worker(i, task_queue, result_queue, api_key, controller, session, memory)
             )
             workers.append(worker_task)
 
         # 收集结果并更新进度
-        results = [None] * total_chunks
         completed = 0
         while completed < total_chunks:
-            # 等待一个结果
+            # 等待一个结果，立即追加到日志
             res = await result_queue.get()
-            results[res.index] = res
+            if isinstance(res, BaseException):  # 读取源文件的协程出错
+                raise res
+            if not res.from_journal:
+                journal.append(res)
+            for _ in range(writer.add(res)):
+                window.release()
             completed += 1
             pbar.update(1)
             pbar.set_postfix(workers=controller.current_workers)
 
-            # 自适应调整（每完成一个结果检查一次，实际可降低频率）
-            new_count = await controller.should_adjust()
-            if new_count is not None:
-                # 调整 worker 数量
-                diff = new_count - len(workers)
-                if diff > 0:
-                    for _ in range(diff):
-                        w = asyncio.create_task(
-                            worker(len(workers), task_queue, result_queue, api_key, controller, session)
-                        )
-                        workers.append(w)
-                elif diff < 0:
-                    # 减少 worker：取消多余的 worker
-                    for _ in range(-diff):
-                        w = workers.pop()
-                        w.cancel()
-                # 更新进度条显示
-                pbar.set_postfix(workers=new_count)
-
         # 所有任务完成，取消所有 worker
         for w in workers:
             w.cancel()
         await asyncio.gather(*workers, return_exceptions=True)
 
-    return results
+# 中日文字符：CJK 标点、假名、汉字、全角字符
+_CJK_CHARS = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
 
-def split_text_into_chunks(text: str, max_chars: int = MAX_CHUNK_CHARS) -> List[str]:
+def estimate_tokens(text: str) -> int:
     """
-    将文本分割成适合翻译的块。
-    按段落分割，段落过长则按句号、问号、感叹号进一步分割。
+    本地估算 token 数，不依赖分词器：按 DeepSeek 官方的换算，
+    1 个中日文字符约 0.6 token，其他字符约 0.3 token，向上取整。
     """
-    paragraphs = text.split('\n')
+    cjk = _CJK_CHARS.subn('', text)[1]
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+def chunk_token_budget(budget: int = CHUNK_TOKEN_BUDGET) -> int:
+    """每块的 token 预算，不超过 MAX_TOKENS 按 RESPONSE_TOKEN_RATIO 折算出的原文上限，保证译文不被截断"""
+    return max(1, min(budget, int(MAX_TOKENS / RESPONSE_TOKEN_RATIO)))
+
+def _split_long_paragraph(para: str, budget: int) -> List[str]:
+    """超出预算的段落按句号、问号、感叹号切开，再把句子重新组合成不超过预算的块（单句超长时单独成块）"""
     chunks = []
+    current, current_tokens = "", 0
+    for sent in re.split(r'(?<=[。！？])', para):
+        if not sent:
+            continue
+        tokens = estimate_tokens(sent)
+        if current and current_tokens + tokens > budget:
+            chunks.append(current)
+            current, current_tokens = "", 0
+        current += sent
+        current_tokens += tokens
+    if current.strip():
+        chunks.append(current)
+    return [c for c in chunks if c.strip()]
+
+def pack_paragraphs(paragraphs: Iterable[str], budget: Optional[int] = None) -> Iterator[str]:
+    """
+    把连续的段落合并成不超过 budget token 的块，段落之间用换行分隔，译文可以按行拆回段落。
+    空段落跳过；单个段落超出预算时先结束当前块，再按句子拆分。
+    """
+    budget = chunk_token_budget() if budget is None else budget
+    current, current_tokens = [], 0
     for para in paragraphs:
         if not para.strip():
             continue
-        # 如果段落本身很短，直接作为一个块
-        if len(para) <= max_chars:
-            chunks.append(para)
-        else:
-            # 按句子分割（简单正则：句号、问号、感叹号后可能跟空格或换行）
-            import re
-            sentences = re.split(r'([。！？])', para)
-            # 重组句子，使每个块不超过 max_chars
-            current_chunk = ""
-            for i in range(0, len(sentences)-1, 2):
-                sent = sentences[i] + sentences[i+1]  # 句子+标点
-                if len(current_chunk) + len(sent) <= max_chars:
-                    current_chunk += sent
-                else:
-                    if current_chunk:
-                        chunks.append(current_chunk)
-                    current_chunk = sent
-            if current_chunk:
-                chunks.append(current_chunk)
-            # 如果最后还有残余（奇数个元素的情况），添加
-            if len(sentences) % 2 == 1 and sentences[-1]:
-                if len(current_chunk) + len(sentences[-1]) <= max_chars:
-                    current_chunk += sentences[-1]
-                    # 替换最后一个块
-                    chunks[-1] = current_chunk
-                else:
-                    chunks.append(sentences[-1])
-    # 过滤空块
-    return [c for c in chunks if c.strip()]
+        tokens = estimate_tokens(para) + 1  # 段落间的换行
+        if tokens > budget:
+            if current:
+                yield '\n'.join(current)
+                current, current_tokens = [], 0
+            yield from _split_long_paragraph(para, budget)
+            continue
+        if current and current_tokens + tokens > budget:
+            yield '\n'.join(current)
+            current, current_tokens = [], 0
+        current.append(para)
+        current_tokens += tokens
+    if current:
+        yield '\n'.join(current)
+
+def split_text_into_chunks(text: str, budget: Optional[int] = None) -> List[str]:
+    """将文本按段落合并、分割成不超过 token 预算的块"""
+    return list(pack_paragraphs(text.split('\n'), budget))
+
+def iter_file_chunks(file_path: str, budget: Optional[int] = None) -> Iterator[str]:
+    """与 split_text_into_chunks 相同的分块，但逐行读取文件、逐块产出，不把全文读入内存"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        yield from pack_paragraphs((line.rstrip('\n') for line in f), budget)
+
+async def produce_chunks(
+    file_path: str,
+    task_queue: asyncio.Queue,
+    result_queue: asyncio.Queue,
+    window: asyncio.Semaphore,
+    journal: TranslationJournal,
+    done: Dict[int, Tuple[str, int]],
+    memory: Optional[TranslationMemory] = None,
+    budget: Optional[int] = None
+) -> Dict[str, int]:
+    """
+    生产者协程：逐块读取源文件并分发。任务日志中已完成的块直接读回译文，
+    翻译记忆库命中的块直接作为结果，其余放入任务队列。
+    每块先占用一个窗口名额（按顺序写出后归还），已读入未写出的块数不超过窗口大小。
+    返回 {'resumed': 从日志恢复的块数, 'cached': 记忆库命中的块数}。
+    """
+    counts = {'resumed': 0, 'cached': 0}
+    chunks = enumerate(iter_file_chunks(file_path, budget))
+    while True:
+        batch = list(islice(chunks, 64))  # 按批查询翻译记忆库
+        if not batch:
+            return counts
+        keys = [TranslationMemory.make_key(chunk_text) for _, chunk_text in batch]
+        cached = memory.get_many(keys) if memory else {}
+        for (idx, chunk_text), key in zip(batch, keys):
+            await window.acquire()
+            entry = done.get(idx)
+            if entry is not None and entry[0] == key:
+                counts['resumed'] += 1
+                result_queue.put_nowait(journal.read(entry[1]))
+            elif key in cached:
+                counts['cached'] += 1
+                result_queue.put_nowait(TranslationResult(idx, cached[key], success=True, key=key))
+            else:
+                task_queue.put_nowait(Chunk(index=idx, text=chunk_text, key=key))
 
-async def main_async(api_key: str, file_path: str):
-    """异步主函数"""
-    # 读取文件
+async def main_async(api_key: str, file_path: str, memory_path: Optional[str] = TRANSLATION_MEMORY_PATH,
+                     memory_max_mb: float = TRANSLATION_MEMORY_MAX_MB, resume: bool = False,
+                     chunk_tokens: int = CHUNK_TOKEN_BUDGET):
+    """
+    异步主函数（memory_path 为 None 时不使用翻译记忆库）。
+    源文件逐块读取，译文按顺序边翻译边写出，内存占用与文件大小无关。
+    resume=True 时读取上次的任务日志，只重新翻译尚未成功的块。
+    chunk_tokens 为每块的 token 预算（不超过 MAX_TOKENS 允许的上限）。
+    """
     if not os.path.exists(file_path):
         print(f"错误：文件 {file_path} 不存在")
         return
-    with open(file_path, 'r', encoding='utf-8') as f:
-        text = f.read()
-    print(f"已读取文件，大小：{len(text)} 字符")
+    print(f"文件大小：{os.path.getsize(file_path) / 1024 / 1024:.1f} MB")
+
+    budget = chunk_token_budget(chunk_tokens)
+    if budget < chunk_tokens:
+        print(f"每块 token 预算受 MAX_TOKENS={MAX_TOKENS} 限制，调整为 {budget}")
 
-    # 分块
-    chunks = split_text_into_chunks(text)
-    total = len(chunks)
-    print(f"已将文本分割为 {total} 个块")
+    # 先流式扫描一遍得到块数（用于进度条），不保留块内容
+    total = sum(1 for _ in iter_file_chunks(file_path, budget))
+    print(f"已将文本分割为 {total} 个块（每块约 {budget} token 以内）")
+
+    output_path = os.path.splitext(file_path)[0] + "_translated.txt"
+    journal = TranslationJournal(os.path.splitext(file_path)[0] + "_translated.journal.jsonl")
+    done = journal.index() if resume else {}
+    memory = TranslationMemory(memory_path, int(memory_max_mb * 1024 * 1024)) if memory_path else None
 
-    # 创建任务队列和结果队列
     task_queue = asyncio.Queue()
-    for idx, chunk_text in enumerate(chunks):
-        task_queue.put_nowait(Chunk(index=idx, text=chunk_text))
     result_queue = asyncio.Queue()
+    window = asyncio.Semaphore(REORDER_WINDOW)
+    writer = OrderedWriter(output_path)
+    journal.open(append=resume)
+    producer = asyncio.create_task(
+        produce_chunks(file_path, task_queue, result_queue, window, journal, done, memory, budget)
+    )
+    # 生产者出错时把异常交给控制器抛出，避免控制器一直等待结果
+    producer.add_done_callback(
+        lambda task: task.cancelled() or task.exception() is None or result_queue.put_nowait(task.exception())
+    )
 
-    # 进度条
-    with tqdm(total=total, desc="翻译进度", unit="块") as pbar:
-        results = await controller(task_queue, result_queue, api_key, total, pbar)
-
-    # 按索引排序并写入输出文件
-    output_path = os.path.splitext(file_path)[0] + "_translated.txt"
-    with open(output_path, 'w', encoding='utf-8') as f:
-        for res in results:
-            if res and res.success:
-                f.write(res.text + '\n\n')
-            else:
-                f.write(f"[翻译失败: {res.error if res else '未知错误'}]\n\n")
+    try:
+        with tqdm(total=total, desc="翻译进度", unit="块") as pbar:
+            await controller(task_queue, result_queue, api_key, total, pbar, journal, writer, window, memory)
+        counts = await producer
+    finally:
+        producer.cancel()
+        writer.close()
+        journal.close()
+        if memory:
+            memory.close()
+
+    if resume:
+        print(f"\n从任务日志恢复 {counts['resumed']} 块")
+    if memory:
+        print(f"\n翻译记忆库命中 {counts['cached']} 块")
     print(f"\n翻译完成！结果已保存至：{output_path}")
+    if writer.failed:
+        print(f"有 {writer.failed} 块翻译失败，可使用 --resume 只重试这些块")
 
 def main():
     parser = argparse.ArgumentParser(description="日文小说翻译器（使用 DeepSeek API）")
     parser.add_argument("--key", help="DeepSeek API 密钥，若不提供则交互式输入")
     parser.add_argument("--file", help="待翻译的日文小说文件路径，若不提供则交互式输入")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKEN_BUDGET,
+                        help=f"每块的 token 预算，连续的短段落合并到这个大小（默认 {CHUNK_TOKEN_BUDGET}）")
+    parser.add_argument("--resume", action="store_true",
+                        help="从上次的任务日志（<文件名>_translated.journal.jsonl）继续，只翻译未完成的块")
+    parser.add_argument("--memory", default=TRANSLATION_MEMORY_PATH,
+                        help=f"翻译记忆库文件（默认 {TRANSLATION_MEMORY_PATH}）")
+    parser.add_argument("--no-memory", action="store_true", help="不使用翻译记忆库，所有块都请求 API")
+    parser.add_argument("--memory-max-mb", type=float, default=TRANSLATION_MEMORY_MAX_MB,
+                        help=f"翻译记忆库大小上限（MB，默认 {TRANSLATION_MEMORY_MAX_MB}）")
     args = parser.parse_args()
 
     api_key = args.key
@@ -341,7 +696,12 @@ def main():
             print("错误：未提供文件路径")
             sys.exit(1)
 
-    asyncio.run(main_async(api_key, file_path))
+    memory_path = None if args.no_memory else args.memory
+    try:
+        asyncio.run(main_async(api_key, file_path, memory_path, args.memory_max_mb, args.resume, args.chunk_tokens))
+    except KeyboardInterrupt:
+        print("\n已中断。已完成的块保存在任务日志中，使用 --resume 可从中断处继续")
+        sys.exit(130)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,358 @@
+"""
+deepseek_translater.py 并发控制器的模拟器
+
+用合成的延迟/错误轨迹回放一次翻译任务（虚拟时钟，不发请求、不真正等待），比较
+旧的 AdaptiveController（累计失败率，每次增减一个 worker）与 CongestionController
+（AIMD + 延迟梯度，识别 429 和 Retry-After）完成同样多的块所用的时间。
+
+用法:
+  python deepseek_translater_sim.py                       # 运行全部内置场景
+  python deepseek_translater_sim.py burst429 ratelimit    # 只运行指定场景
+  python deepseek_translater_sim.py trace.json --chunks 1000 --seed 7
+  python deepseek_translater_sim.py --check               # 延迟信号自检（块大小混杂、响应时间恒定时不应降低并发）
+
+trace.json 是阶段列表，按顺序回放，最后一个阶段一直持续到任务结束，例如:
+  [{"duration": 60, "latency": 2.0, "knee": 16, "limit": 3, "retry_after": 5},
+   {"duration": 0, "latency": 2.0, "knee": 16}]
+"""
+import os
+import sys
+import json
+import heapq
+import random
+import argparse
+from collections import deque
+from itertools import islice
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import deepseek_translater as dt
+
+# 旧控制器（AdaptiveController）的参数
+FAILURE_RATE_THRESHOLD = 0.1            # 允许的最大失败率（超过则减少并发）
+SUCCESS_RATE_INCREASE_THRESHOLD = 0.98  # 成功率高于此且平均响应时间低于阈值时增加并发
+RESPONSE_TIME_THRESHOLD = 3.0           # 平均响应时间阈值（秒）
+
+
+@dataclass
+class WorkerStats:
+    """旧控制器的统计信息：成功、失败次数从任务开始累计，响应时间只保留最近的窗口"""
+    success_count: int = 0
+    failure_count: int = 0
+    recent_response_times: deque = field(default_factory=lambda: deque(maxlen=dt.ADAPT_WINDOW_SIZE))
+
+    @property
+    def total_requests(self) -> int:
+        return self.success_count + self.failure_count
+
+    @property
+    def failure_rate(self) -> float:
+        if self.total_requests == 0:
+            return 0.0
+        return self.failure_count / self.total_requests
+
+    @property
+    def avg_response_time(self) -> Optional[float]:
+        if not self.recent_response_times:
+            return None
+        return sum(self.recent_response_times) / len(self.recent_response_times)
+
+
+class AdaptiveController:
+    """
+    deepseek_translater 改用 CongestionController 之前的控制器，仅用于对比：
+    根据整个任务累计的失败率和近期平均响应时间，每次增减一个工作协程。
+    """
+
+    def __init__(self, initial_workers: int = dt.INITIAL_CONCURRENT_WORKERS):
+        self.current_workers = initial_workers
+        self.stats = WorkerStats()
+
+    def record_success(self, response_time: float):
+        self.stats.success_count += 1
+        self.stats.recent_response_times.append(response_time)
+
+    def record_failure(self):
+        self.stats.failure_count += 1
+
+    def should_adjust(self) -> Optional[int]:
+        """根据统计信息决定是否调整并发数，返回新的 worker 数量或 None"""
+        if self.stats.total_requests < dt.ADAPT_WINDOW_SIZE // 2:
+            return None  # 数据不足，暂不调整
+
+        failure_rate = self.stats.failure_rate
+        avg_rt = self.stats.avg_response_time
+
+        new_workers = self.current_workers
+
+        # 失败率过高 -> 减少并发
+        if failure_rate > FAILURE_RATE_THRESHOLD and self.current_workers > dt.MIN_CONCURRENT_WORKERS:
+            new_workers = max(dt.MIN_CONCURRENT_WORKERS, self.current_workers - 1)
+        # 成功率很高且平均响应时间理想 -> 增加并发
+        elif (failure_rate < 1 - SUCCESS_RATE_INCREASE_THRESHOLD and
+              avg_rt is not None and avg_rt < RESPONSE_TIME_THRESHOLD and
+              self.current_workers < dt.MAX_CONCURRENT_WORKERS):
+            new_workers = min(dt.MAX_CONCURRENT_WORKERS, self.current_workers + 1)
+
+        if new_workers != self.current_workers:
+            self.current_workers = new_workers
+            return new_workers
+        return None
+
+
+@dataclass
+class TracePhase:
+    """服务端在一段时间内的表现"""
+    duration: float                     # 持续秒数（最后一个阶段忽略）
+    latency: float                      # 无排队时一个满额块（chunk_token_budget() token）的响应时间（秒）
+    overhead: float = 0.3               # 响应时间中与块大小无关的固定部分所占比例（按满额块计）
+    knee: int = 16                      # 同时处理的请求超过此数后开始排队，响应时间按比例变长
+    limit: Optional[int] = None         # 同时处理的请求超过此数时返回 429
+    retry_after: Optional[float] = None # 429 响应附带的 Retry-After（秒）
+    error_rate: float = 0.0             # 偶发 HTTP 500 的概率
+    timeout: Optional[float] = None     # 响应时间超过此值时客户端超时
+
+
+SCENARIOS: Dict[str, List[TracePhase]] = {
+    # 服务稳定，只看增长速度
+    'steady': [TracePhase(0, latency=2.0, knee=16)],
+    # 开头一分钟限流很严，之后恢复：旧控制器的累计失败率一直偏高，并发被压在最低值
+    'burst429': [TracePhase(60, latency=2.0, knee=16, limit=3, retry_after=5),
+                 TracePhase(0, latency=2.0, knee=16, limit=16, retry_after=5)],
+    # 持续的并发限制，带 Retry-After
+    'ratelimit': [TracePhase(0, latency=2.0, knee=16, limit=8, retry_after=2)],
+    # 持续的并发限制，不带 Retry-After
+    'ratelimit-bare': [TracePhase(0, latency=2.0, knee=16, limit=8)],
+    # 偶发 500，与负载无关
+    'flaky': [TracePhase(0, latency=2.0, knee=16, error_rate=0.05)],
+    # 负载超过 knee 后排队，排队过长时超时
+    'overload': [TracePhase(0, latency=1.0, knee=6, timeout=3.0)],
+    # 中途服务变慢，处理能力下降
+    'slowdown': [TracePhase(30, latency=2.0, knee=16, timeout=15.0),
+                 TracePhase(0, latency=4.0, knee=4, timeout=15.0)],
+    # 按 token 打包后的大块：单次响应远超旧控制器的 3 秒阈值
+    'longchunks': [TracePhase(0, latency=20.0, knee=16, limit=16, retry_after=10)],
+}
+
+
+class SimServer:
+    """按阶段回放服务端表现：根据当前时刻和同时处理的请求数决定状态码与响应时间"""
+
+    def __init__(self, phases: List[TracePhase], seed: int):
+        self.phases = phases
+        self.rng = random.Random(seed)
+
+    def phase(self, now: float) -> TracePhase:
+        end = 0.0
+        for phase in self.phases[:-1]:
+            end += phase.duration
+            if now < end:
+                return phase
+        return self.phases[-1]
+
+    def request(self, now: float, in_flight: int, tokens: int):
+        """返回 (状态码或 None 表示超时, 响应时间, Retry-After)；响应时间 = 固定开销 + 与 token 数成正比的部分"""
+        p = self.phase(now)
+        if p.limit is not None and in_flight > p.limit:
+            return 429, 0.2 * self.rng.lognormvariate(0, 0.25), p.retry_after
+        size = p.overhead + (1 - p.overhead) * tokens / dt.chunk_token_budget()
+        latency = p.latency * size * max(1.0, in_flight / p.knee) * self.rng.lognormvariate(0, 0.25)
+        if p.timeout is not None and latency > p.timeout:
+            return None, p.timeout, None
+        if self.rng.random() < p.error_rate:
+            return 500, latency / 2, None
+        return 200, latency, None
+
+
+def synthetic_chunks(count: int, seed: int) -> List[str]:
+    """
+    用 deepseek_translater.pack_paragraphs 打包合成的段落（大量短对话、叙述段落和少数超长段落），
+    得到与真实任务相同的块大小分布：大部分接近满额，夹杂超长段落前结束的块和句子拆分出的小块
+    """
+    rng = random.Random(seed)
+
+    def paragraphs():
+        while True:
+            r = rng.random()
+            if r < 0.6:
+                n = rng.randint(5, 40)          # 对话
+            elif r < 0.97:
+                n = rng.randint(60, 300)        # 叙述
+            else:
+                n = rng.randint(1500, 4000)     # 超长段落，需要按句子拆分
+            yield ''.join('。' if i % 30 == 29 else 'あ' for i in range(n))
+
+    return list(islice(dt.pack_paragraphs(paragraphs()), count))
+
+
+def simulate(kind: str, phases: List[TracePhase], chunks: int = 500, seed: int = 0) -> Dict:
+    """
+    回放一次任务。kind 为 'old'（AdaptiveController）或 'new'（CongestionController）。
+    worker、重试和并发限制的逻辑与 deepseek_translater 中一致（包括把原文 token 数交给 record），
+    只是请求由 SimServer 应答。
+    """
+    now = 0.0
+    server = SimServer(phases, seed)
+    if kind == 'new':
+        ctrl = dt.CongestionController(verbose=False, clock=lambda: now)
+    else:
+        ctrl = AdaptiveController()
+    queue = deque(dt.Chunk(index=i, text=text) for i, text in enumerate(synthetic_chunks(chunks, seed)))
+    events = []                         # (时刻, 序号, 事件, 块, 发出时刻, 应答)
+    seq = 0
+    busy = 0                            # 正在请求或退避等待的 worker 数
+    in_flight = 0
+    area = 0.0                          # 并发数对时间的积分，用于求平均并发
+    tick_at = None
+    stats = {'requests': 0, 'throttled': 0, 'done': 0, 'failed': 0, 'peak': 0}
+
+    def push(at, event, chunk=None, started=None, reply=None):
+        nonlocal seq
+        seq += 1
+        heapq.heappush(events, (at, seq, event, chunk, started, reply))
+
+    def dispatch():
+        nonlocal busy, in_flight, tick_at
+        while queue:
+            if kind == 'new':
+                if busy >= dt.MAX_CONCURRENT_WORKERS or not ctrl.try_acquire():
+                    break
+            elif busy >= ctrl.current_workers:
+                break
+            chunk = queue.popleft()
+            busy += 1
+            in_flight += 1
+            stats['requests'] += 1
+            stats['peak'] = max(stats['peak'], in_flight)
+            status, latency, retry_after = server.request(now, in_flight, dt.estimate_tokens(chunk.text))
+            error = None if status == 200 else ("Timeout" if status is None else f"HTTP {status}")
+            reply = dt.ApiReply(chunk.index, 'ok' if status == 200 else None, error, latency, status, retry_after)
+            push(now + latency, 'reply', chunk, now, reply)
+        if kind == 'new' and queue and now < ctrl.pause_until and tick_at != ctrl.pause_until:
+            tick_at = ctrl.pause_until
+            push(tick_at, 'tick')  # 暂停结束时重新分发
+
+    dispatch()
+    while stats['done'] + stats['failed'] < chunks:
+        at, _, event, chunk, started, reply = heapq.heappop(events)
+        area += in_flight * (at - now)
+        now = at
+        if event == 'wake':
+            queue.append(chunk)
+            busy -= 1
+        elif event == 'reply':
+            in_flight -= 1
+            stats['throttled'] += reply.throttled
+            if kind == 'new':
+                ctrl.release()
+                ctrl.record(reply, started, dt.estimate_tokens(chunk.text))
+                wait = None if reply.text is not None else dt.retry_delay(chunk, reply)
+            else:
+                # 旧 worker 的逻辑：所有失败都计入重试次数，按次数退避
+                if reply.text is not None:
+                    ctrl.record_success(reply.response_time)
+                    wait = None
+                else:
+                    ctrl.record_failure()
+                    chunk.retries += 1
+                    wait = dt.RETRY_BACKOFF_FACTOR ** chunk.retries if chunk.retries <= dt.RETRY_LIMIT else None
+                ctrl.should_adjust()
+            if reply.text is not None:
+                stats['done'] += 1
+                busy -= 1
+            elif wait is None:
+                stats['failed'] += 1
+                busy -= 1
+            elif wait > 0:
+                push(now + wait, 'wake', chunk)
+            else:
+                queue.append(chunk)
+                busy -= 1
+        dispatch()
+
+    return {
+        'controller': kind,
+        'seconds': now,
+        'throughput': stats['done'] / now * 60 if now else 0.0,
+        'avg_concurrency': area / now if now else 0.0,
+        **stats,
+    }
+
+
+def check_latency_signal(seed: int = 0) -> List[str]:
+    """
+    延迟信号的自检，返回未通过的项目：
+    - 服务端响应时间恒定、块大小混杂（大量满额块夹杂收尾的小块）时，不能触发降低
+      （包括毫秒级的响应时间，对应本地模拟接口）
+    - 同样的块大小下响应时间整体变慢 3 倍时，必须触发降低
+    """
+    rng = random.Random(seed)
+    sizes = [rng.randint(5, 200) if rng.random() < 0.3 else rng.randint(900, 1200) for _ in range(2000)]
+    problems = []
+    for latency in (0.02, 2.0):
+        now = 0.0
+        ctrl = dt.CongestionController(verbose=False, clock=lambda: now)
+        for tokens in sizes:
+            now += latency
+            ctrl.record(dt.ApiReply(0, 'ok', None, latency, 200), now - latency, tokens)
+        if not ctrl.slow_start or ctrl.current_workers != dt.MAX_CONCURRENT_WORKERS:
+            problems.append(f"响应时间恒定为 {latency}s 时触发了降低（梯度 {ctrl.latency_gradient():.1f}）")
+    for tokens in sizes[:dt.ADAPT_WINDOW_SIZE]:
+        now += latency * 3
+        ctrl.record(dt.ApiReply(0, 'ok', None, latency * 3, 200), now - latency * 3, tokens)
+    if ctrl.slow_start:
+        problems.append(f"响应时间变慢 3 倍时没有降低（梯度 {ctrl.latency_gradient():.1f}）")
+    return problems
+
+
+def load_trace(path: str) -> List[TracePhase]:
+    with open(path, encoding='utf-8') as f:
+        return [TracePhase(**phase) for phase in json.load(f)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比新旧并发控制器在合成轨迹上的吞吐量")
+    parser.add_argument("scenarios", nargs="*",
+                        help=f"内置场景（{', '.join(SCENARIOS)}）或 JSON 轨迹文件，默认运行全部内置场景")
+    parser.add_argument("--chunks", type=int, default=500, help="每次回放的块数（默认 500）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--out", help="把结果另存为 JSON")
+    parser.add_argument("--check", action="store_true", help="只运行延迟信号自检，未通过时退出码非 0")
+    args = parser.parse_args()
+
+    if args.check:
+        problems = check_latency_signal(args.seed)
+        for problem in problems:
+            print(f"未通过：{problem}")
+        if problems:
+            sys.exit(1)
+        print("延迟信号自检通过")
+        return
+
+    names = args.scenarios or list(SCENARIOS)
+    results = []
+    print(f"{'场景':<16}{'控制器':<6}{'用时(s)':>10}{'块/分钟':>10}{'平均并发':>10}{'峰值':>6}"
+          f"{'请求':>7}{'429':>6}{'失败块':>7}{'提速':>8}")
+    for name in names:
+        if name in SCENARIOS:
+            phases = SCENARIOS[name]
+        elif os.path.exists(name):
+            phases = load_trace(name)
+        else:
+            sys.exit(f"未知场景：{name}")
+        runs = [simulate(kind, phases, args.chunks, args.seed) for kind in ('old', 'new')]
+        for r in runs:
+            speedup = runs[0]['seconds'] / r['seconds'] if r['seconds'] else 0.0
+            print(f"{name:<16}{r['controller']:<6}{r['seconds']:>10.1f}{r['throughput']:>10.1f}"
+                  f"{r['avg_concurrency']:>10.1f}{r['peak']:>6}{r['requests']:>7}{r['throttled']:>6}"
+                  f"{r['failed']:>7}{speedup:>7.2f}x")
+            results.append({'scenario': name, **r})
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存至 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
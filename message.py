@@ -1,52 +1,775 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 from collections import Counter
-import jieba
 import re
 import numpy as np
-from wordcloud import WordCloud
-from PIL import Image, ImageDraw, ImageFont
 import os
 import io
+import copy
+import sys
+import json
+import zlib
+import struct
+import sqlite3
+import argparse
+import base64
+import hashlib
+import shutil
+import threading
+import time
 import textwrap
-from contextlib import redirect_stdout
+from array import array
+from bisect import bisect_right
+from itertools import accumulate, chain, islice
+from html import escape
+from contextlib import redirect_stdout, contextmanager, nullcontext
 
 # ========== 配置区域 ==========
 # 在这里修改文件路径和年份
 FILE_PATH = "mes.xlsx"  # 修改为你的文件路径
 ANALYSIS_YEAR = 2026# 修改为你想分析的年份 (2022-2026)
+CACHE_DIR = ".chat_cache"  # 列式缓存目录，设为 None 则每次都重新解析 Excel
+SESSION_GAP_MINUTES = 30  # 两条消息间隔超过多少分钟视为新的一次对话
+TOKENIZE_WORKERS = None  # 分词进程数，None 表示使用全部 CPU 核心
+STREAM_CHUNK_ROWS = 200_000  # 流式模式每批读取的行数
+SKETCH_EPSILON = 0.001  # 近似模式：词频/表情计数的相对误差上限（相对于总次数）
+SKETCH_DELTA = 0.01  # 近似模式：超出上述误差的概率
+SKETCH_K = 200  # 近似模式：回复时间分位数草图的大小，越大越精确
+GROUP_TOP_K = None  # 群聊模式：只保留消息数最多的 K 人的明细，其余合并为“其他”；None 表示不合并
+RENDER_WORKERS = None  # 并行渲染长图/词云/图表的进程数，None 表示每个产物一个进程，1 表示在当前进程依次渲染
+HTML_PAGE_SIZE = 20  # HTML 报告中词频表、发送者表每页的行数
+HTML_WORD_ROWS = 5000  # HTML 报告词频表最多内嵌的词数（按出现次数取前 N 个），None 表示全部
+FONT_PATH = None  # 中文字体文件路径，None 表示自动查找（macOS / Linux 常见字体，再用 fontconfig 查找）
 # ==============================
 
-# 设置中文字体（Mac系统）
-plt.rcParams['font.sans-serif'] = ['Arial Unicode MS']
-plt.rcParams['axes.unicode_minus'] = False
+CACHE_VERSION = 2
+OTHERS_LABEL = '其他'  # 群聊模式下 top-K 之外发送者的合并名称
+STATE_VERSION = 2
+_REPLY_MAX_SECONDS = int(timedelta(hours=1.5).total_seconds())  # 间隔超过此秒数的换人发言不算回复
+
+# 分词停用词
+STOPWORDS = {
+    '的', '了', '是', '我', '你', '在', '有', '和', '就', '不', '人', '都', '一', '一个',
+    '上', '也', '很', '到', '说', '要', '去', '吗', '啊', '呢', '吧', '哦', '嘛',
+    '哈', '哈哈', '这', '那', '什么', '怎么', '为什么', '这样', '那样', '没有', '可以',
+    '图片', 'nan', '引用', '表情', '然后', '但是', '还是', '如果', '因为', '所以',
+    '已经', '还有', '或者', '而且', '不过', '只是', '应该', '可能', '觉得', '好像',
+    '感觉', '自己', '他们', '我们', '你们', '出来', '起来', '下来', '过来'
+}
+
+# 游戏关键词
+GAME_KEYWORDS = {
+    '原神': ['原神', '须弥', '提瓦特', '派蒙', '旅行者'],
+    '王者荣耀': ['王者', '荣耀', '峡谷', '五杀', '超神', '打野', '中路', '上路', '下路', '辅助'],
+    '英雄联盟': ['lol', 'LOL', '英雄联盟', '召唤师峡谷', '峡谷'],
+    '和平精英': ['和平精英', '吃鸡', '落地成盒', '空投'],
+    '我的世界': ['我的世界', 'mc', 'MC', '史蒂夫', '苦力怕'],
+    'GTA': ['gta', 'GTA', '圣安地列斯', '罪恶都市'],
+    '塞尔达': ['塞尔达', '旷野之息', '王国之泪'],
+    '宝可梦': ['宝可梦', '精灵宝可梦', '口袋妖怪', '皮卡丘'],
+    '明日方舟': ['明日方舟', '方舟', '博士', '刀客塔'],
+    '崩坏': ['崩坏', '星穹铁道', '崩铁']
+}
+
+# 话题关键词
+TOPIC_KEYWORDS = {
+    # 📚 学习 / 学业
+    '学习': [
+        '学习', '作业', '考试', '复习', '背书', '刷题', '题目', '错题',
+        '老师', '课程', '上课', '下课', '学校', '教室', '图书馆',
+        '作业多', '写作业', '考试周', '期中', '期末', '挂科',
+        '论文', '报告', '开题', '答辩', '实验', '数据', '文献',
+        '绩点', '成绩', '排名', '选课'
+    ],
+
+    # 🎮 游戏
+    '游戏': list(set(
+        [kw for keywords in GAME_KEYWORDS.values() for kw in keywords] + [
+            '打游戏', '玩游戏', '开黑', '上分', '掉分', '匹配', '排位',
+            '段位', '胜率', '连胜', '连败', '队友', '坑', '挂机',
+            '版本', '更新', '补丁', '服务器', '国服', '国际服'
+        ]
+    )),
+
+    # 🍜 饮食 / 吃喝
+    '饮食': [
+        '吃', '喝', '饭', '菜', '做饭', '点菜', '点外卖',
+        '早餐', '午餐', '晚餐', '宵夜', '夜宵',
+        '零食', '水果', '甜点',
+        '火锅', '烧烤', '麻辣烫', '炸鸡', '烤肉', '拉面', '面条',
+        '奶茶', '咖啡', '可乐', '饮料', '酒',
+        '外卖', '饿', '好吃', '难吃', '撑了'
+    ],
+
+    # 🎬 娱乐 / 消遣
+    '娱乐': [
+        '电影', '电视剧', '剧', '综艺', '动漫', '番', '番剧',
+        '视频', '直播', 'up主', '博主', '主播',
+        'b站', 'B站', '抖音', '快手', '微博', '小红书',
+        '音乐', '歌', '听歌', '单曲', '专辑',
+        '演唱会', '音乐会'
+    ],
+
+    # 🏃 运动 / 身体活动
+    '运动': [
+        '运动', '锻炼', '健身', '健身房',
+        '跑步', '慢跑', '夜跑',
+        '篮球', '足球', '羽毛球', '乒乓球', '排球',
+        '游泳', '骑车', '骑行', '爬山', '徒步',
+        '拉伸', '力量', '有氧',
+        '减肥', '瘦', '胖', '体重', '肌肉', '酸'
+    ],
+
+    # ❤️ 情感 / 心理状态
+    '情感': [
+        '开心', '高兴', '快乐', '幸福', '满足',
+        '难过', '伤心', '失落', '低落', 'emo',
+        '生气', '烦', '烦躁', '郁闷', '焦虑', '紧张',
+        '害怕', '慌', '委屈', '崩溃', '累',
+        '想你', '想念', '在乎', '喜欢', '爱',
+        '感动', '失望', '后悔', '心烦'
+    ],
+
+    # 💼 工作 / 职业
+    '工作': [
+        '工作', '上班', '下班', '加班', '值班',
+        '公司', '单位', '部门',
+        '同事', '老板', '领导',
+        '项目', '任务', '需求', '进度', '方案',
+        '会议', '开会', '汇报', '总结',
+        '出差', '请假', '调休',
+        '工资', '薪水', '奖金', '绩效'
+    ],
+
+    # 🛒 购物 / 消费
+    '购物': [
+        '买', '购物', '下单', '付款', '退款',
+        '淘宝', '京东', '拼多多', '闲鱼',
+        '快递', '包裹', '物流', '签收',
+        '衣服', '裤子', '鞋子', '外套',
+        '包', '口红', '化妆品', '护肤品',
+        '便宜', '贵', '划算', '打折', '促销'
+    ],
+
+    # 🏠 日常 / 生活琐事（强烈建议加）
+    '生活': [
+        '睡觉', '起床', '熬夜', '失眠', '困',
+        '天气', '下雨', '下雪', '冷', '热',
+        '回家', '出门', '在家',
+        '洗澡', '洗头', '收拾', '打扫',
+        '手机', '电脑', '网络', '没电'
+    ]
+}
+
+# 情绪关键词与表情
+EMOTION_KEYWORDS = {
+    '开心': {
+        'keywords': ['哈哈', '嘿嘿', '嘻嘻', '哇', '耶', '棒', '赞', '好开心', '开心', '快乐', '高兴'],
+        'emoji': ['/大笑', '/呲牙', '/愉快', '/开心', '/胜利']
+    },
+    '难过': {
+        'keywords': ['呜呜', '呜呜呜', '哭', '难过', '伤心', '委屈', 'QAQ', 'T_T'],
+        'emoji': ['/流泪', '/大哭', '/难过', '/委屈']
+    },
+    '生气': {
+        'keywords': ['生气', '气死', '烦', '讨厌', '无语', '服了'],
+        'emoji': ['/生气', '/愤怒', '/抓狂', '/吐血']
+    },
+    '惊讶': {
+        'keywords': ['哇', '天哪', '我去', '卧槽', '牛', '厉害', '震惊'],
+        'emoji': ['/惊讶', '/惊吓', '/吃惊', '/震惊']
+    },
+    '疑惑': {
+        'keywords': ['？？', '啥', '什么鬼', '为啥', '为什么'],
+        'emoji': ['/疑问', '/思考', '/困惑']
+    },
+    '无奈': {
+        'keywords': ['唉', '算了', '无奈', '没办法'],
+        'emoji': ['/捂脸', '/无奈', '/叹气']
+    }
+}
+
+# 常见中文字体：先 macOS，再各 Linux 发行版的 Noto CJK / 文泉驿 / Droid 字体包
+CJK_FONT_PATHS = [
+    '/System/Library/Fonts/STHeiti Light.ttc',
+    '/System/Library/Fonts/STHeiti Medium.ttc',
+    '/System/Library/Fonts/Supplemental/Arial Unicode.ttf',
+    '/Library/Fonts/Arial Unicode.ttf',
+    '/Library/Fonts/Arial Unicode MS.ttf',
+    '/System/Library/Fonts/PingFang.ttc',
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',
+    '/usr/share/fonts/wenquanyi/wqy-microhei/wqy-microhei.ttc',
+    '/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf',
+]
+
+# matplotlib / jieba / wordcloud / PIL 导入较慢，只在用到它们的阶段按需导入
+_jieba_preload = None
+
+# 字体每个进程只查找、加载一次（子进程的查找结果由 _worker_config 传入）
+_cjk_font_path = False  # False 表示尚未查找，之后为字体路径或 None
+_cjk_fonts = {}  # 字号 -> PIL 字体
+_pyplot_ready = False
+
+
+def _fontconfig_cjk_font():
+    """用 fontconfig 查找支持中文的字体文件；未安装 fontconfig（如 macOS）时返回 None"""
+    import subprocess
+
+    try:
+        matched = subprocess.run(['fc-match', '-f', '%{file}', 'sans-serif:lang=zh-cn'],
+                                 capture_output=True, text=True, timeout=10).stdout.strip()
+        listed = subprocess.run(['fc-list', ':lang=zh-cn', 'file'],
+                                capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    files = sorted(line.rsplit(':', 1)[0].strip() for line in listed.splitlines() if line.strip())
+    # 没有中文字体时 fc-match 会退回到默认字体，只有出现在中文字体列表里才采用
+    if matched in files:
+        return matched
+    return files[0] if files else None
+
+
+def cjk_font_path():
+    """返回可用的中文字体文件路径（FONT_PATH → 常见路径 → fontconfig），找不到时返回 None"""
+    global _cjk_font_path
+    if _cjk_font_path is not False:
+        return _cjk_font_path
+
+    from PIL import ImageFont
+
+    def usable(path):
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            ImageFont.truetype(path, 12)
+        except OSError:
+            return False
+        return True
+
+    candidates = ([FONT_PATH] if FONT_PATH else []) + CJK_FONT_PATHS
+    _cjk_font_path = next((path for path in candidates if usable(path)), None)
+    if _cjk_font_path is None:
+        path = _fontconfig_cjk_font()
+        _cjk_font_path = path if usable(path) else None
+    return _cjk_font_path
+
+
+def _pyplot():
+    """按需导入 matplotlib.pyplot 并设置中文字体（每个进程只注册一次）"""
+    global _pyplot_ready
+    import matplotlib.pyplot as plt
+
+    if not _pyplot_ready:
+        from matplotlib import font_manager
+
+        # Mac 上沿用 Arial Unicode MS；其他系统注册查找到的中文字体
+        families = [f.name for f in font_manager.fontManager.ttflist if f.name == 'Arial Unicode MS'][:1]
+        path = cjk_font_path()
+        if not families and path:
+            font_manager.fontManager.addfont(path)
+            families = [font_manager.FontProperties(fname=path).get_name()]
+        plt.rcParams['font.sans-serif'] = families + list(plt.rcParams['font.sans-serif'])
+        plt.rcParams['axes.unicode_minus'] = False
+        _pyplot_ready = True
+    return plt
+
+
+def preload_jieba():
+    """在后台线程中导入 jieba 并加载词典，与 Excel 解析同时进行"""
+    global _jieba_preload
+    if _jieba_preload is None:
+        def load():
+            import jieba
+            jieba.initialize()
+
+        _jieba_preload = threading.Thread(target=load, name='jieba-preload', daemon=True)
+        _jieba_preload.start()
+
+
+def _wait_jieba_preload():
+    """分词或创建进程池之前等待后台加载结束（避免在加载中途 fork 出持有锁的子进程）"""
+    if _jieba_preload is not None:
+        _jieba_preload.join()
+
+
+class StageTracer:
+    """
+    按阶段记录墙钟时间、CPU 时间和内存峰值，可导出 JSON 跟踪文件，并可为每个阶段单独保存 cProfile 结果。
+    内存峰值默认取进程 RSS 峰值（截至该阶段结束，开销为零）；memory=True 时另用 tracemalloc
+    记录阶段内 Python/numpy 分配的峰值，更精确，但会让纯 Python 循环慢数倍。
+    """
+
+    def __init__(self, profile_dir=None, memory=False):
+        self.profile_dir = profile_dir
+        self.memory = memory
+        self.records = []
+
+    @contextmanager
+    def stage(self, name):
+        import tracemalloc
+        profiler = None
+        if self.profile_dir:
+            import cProfile
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler = cProfile.Profile()
+
+        started_tracing = self.memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.memory:
+            tracemalloc.reset_peak()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            record = {
+                'stage': name,
+                'pid': os.getpid(),
+                'wall_s': round(wall, 4),
+                'cpu_s': round(cpu, 4),
+                'max_rss_mb': _max_rss_mb(),
+            }
+            if self.memory:
+                record['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+                if started_tracing:
+                    tracemalloc.stop()
+            if profiler:
+                record['profile'] = os.path.join(self.profile_dir, re.sub(r'[^\w.-]+', '_', name) + '.prof')
+                profiler.dump_stats(record['profile'])
+            self.records.append(record)
+
+    def print_summary(self):
+        print(f"\n{'=' * 60}")
+        print("⏱️  阶段耗时")
+        print(f"{'=' * 60}")
+        memory_key = 'peak_traced_mb' if self.memory else 'max_rss_mb'
+        memory_label = '分配峰值(MB)' if self.memory else 'RSS峰值(MB)'
+        print(f"{'阶段':<28}{'墙钟(秒)':>10}{'CPU(秒)':>10}{memory_label:>14}")
+        for r in self.records:
+            memory = r.get(memory_key)
+            memory = f"{memory:>14.1f}" if memory is not None else f"{'-':>14}"
+            print(f"{r['stage']:<30}{r['wall_s']:>10.2f}{r['cpu_s']:>10.2f}{memory}")
 
+    def dump(self, path, **meta):
+        """写出 JSON 跟踪文件：{'meta': {...}, 'stages': [...]}，便于多次运行之间对比"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'stages': self.records}, f, ensure_ascii=False, indent=2)
 
-def load_and_clean_data(file_path, year):
-    """加载并清洗数据"""
-    df = pd.read_excel(file_path, header=None)
+
+_tracer = None
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # Linux 上单位是 KB，macOS 上是字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+def enable_tracing(profile_dir=None, memory=False):
+    """开启阶段计时（全局），返回 StageTracer"""
+    global _tracer
+    _tracer = StageTracer(profile_dir, memory)
+    return _tracer
+
+
+def stage(name):
+    """阶段计时上下文；未开启计时时为空操作"""
+    return _tracer.stage(name) if _tracer is not None else nullcontext()
+
+
+def _read_source(file_path):
+    """解析原始导出（Excel，或同样四列布局的 csv；不做年份过滤）"""
+    if file_path.lower().endswith('.csv'):
+        return _normalize_source(pd.read_csv(file_path, header=None))
+    return _normalize_source(pd.read_excel(file_path, header=None))
+
+
+def _normalize_source(df):
+    """统一列名和列类型"""
+    df = df.iloc[:, :4].copy()
     df.columns = ['datetime', 'qq', 'name', 'message']
     df['datetime'] = pd.to_datetime(df['datetime'], format='%Y/%m/%d %H:%M')
-    df = df[df['datetime'].dt.year == year]
+    # 纯数字的昵称/消息会被 Excel 读成数字，统一转成文本，保证列类型稳定
+    for col in ('name', 'message'):
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def _clean_year(df, year):
+    """按年份过滤，并计算日期、小时、星期、月份等派生列"""
+    return _clean_frame(df[df['datetime'].dt.year == year])
+
+
+def _clean_frame(df):
+    """计算日期、小时、星期、月份等派生列，并按时间稳定排序（df 为过滤后得到的新表）"""
     df['date'] = df['datetime'].dt.date
     df['hour'] = df['datetime'].dt.hour
     df['weekday'] = df['datetime'].dt.dayofweek
     df['month'] = df['datetime'].dt.month
-    df = df.sort_values('datetime').reset_index(drop=True)
+    # 稳定排序：同一分钟内的消息保持导出时的先后顺序
+    df = df.sort_values('datetime', kind='stable').reset_index(drop=True)
     return df
 
 
-def basic_statistics(df):
-    """基础统计分析"""
+def _file_sha256(file_path):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _cache_paths(file_path):
+    """缓存文件路径：<文件名>-<绝对路径哈希>.parquet / .json"""
+    abs_path = os.path.abspath(file_path)
+    stem = os.path.splitext(os.path.basename(abs_path))[0]
+    tag = hashlib.sha1(abs_path.encode('utf-8')).hexdigest()[:8]
+    base = os.path.join(CACHE_DIR, f"{stem}-{tag}")
+    return base + '.parquet', base + '.json'
+
+
+def _ensure_cache(file_path):
+    """
+    确保源文件对应的列式缓存存在且有效，返回缓存路径；
+    未安装 pyarrow 或关闭缓存时返回 None。
+    缓存以源文件的 mtime 和 sha256 为键：mtime 未变直接命中，
+    mtime 变化但内容哈希相同也视为命中，否则重建。
+    """
+    if not CACHE_DIR:
+        return None
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None
+
+    cache_path, meta_path = _cache_paths(file_path)
+    stat = os.stat(file_path)
+    meta = None
+    if os.path.exists(cache_path) and os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != CACHE_VERSION:
+            meta = None
+
+    if meta is not None and meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns:
+        return cache_path
+
+    sha256 = _file_sha256(file_path)
+    if meta is not None and meta['sha256'] == sha256:
+        meta['size'], meta['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+    else:
+        print("正在建立列式缓存（仅首次或源文件变化时需要）...")
+        raw = _read_source(file_path)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        writer = None
+        # 每个年份单独写成行组，按年份读取时只需扫描对应行组
+        for year in sorted(raw['datetime'].dt.year.dropna().unique()):
+            part = _clean_year(raw, int(year))
+            part['year'] = int(year)
+            table = pa.Table.from_pandas(part, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+        if writer is None:
+            return None
+        writer.close()
+        os.replace(tmp_path, cache_path)
+        meta = {'version': CACHE_VERSION, 'source': os.path.abspath(file_path),
+                'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return cache_path
+
+
+def _arrow_string_dtype():
+    """有 pyarrow 时返回 Arrow 字符串类型（缺失值仍为 NaN，与 object 列行为一致），否则返回 None"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return None
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return pd.StringDtype('pyarrow', na_value=np.nan)  # 即 pandas 3 默认的 str 类型
+    try:
+        return pd.api.types.pandas_dtype('string[pyarrow_numpy]')  # pandas 2.1+
+    except TypeError:
+        return None
+
+
+def compact_frame(df):
+    """
+    压缩单年数据的内存表示：昵称、QQ 号、日期转为分类（整数编码，类别只含实际出现的值），
+    小时/星期/月份用 int8，消息文本使用 Arrow 字符串（连续缓冲区，无逐条 Python 对象）。
+    各分析函数在其上的结果与 object 列完全一致。
+    """
+    df = df.copy()
+    for col in ('name', 'qq', 'date'):
+        df[col] = df[col].astype('category')
+    for col in ('hour', 'weekday', 'month'):
+        df[col] = df[col].astype(np.int8)
+    string_dtype = _arrow_string_dtype()
+    if string_dtype is not None and df['message'].dtype != string_dtype:
+        df['message'] = df['message'].astype(string_dtype)
+    return df
+
+
+def _top_senders(counts, top_k):
+    """按消息数降序（同数按名称）取前 top_k 名发送者；counts 为 {发送者: 消息数}"""
+    return sorted(counts, key=lambda name: (-counts[name], name))[:top_k]
+
+
+def _others_label(names, top_k):
+    """
+    合并分组的名称：默认为 OTHERS_LABEL；若有真实发送者恰好叫这个名字，
+    改用“其他(N人)”并在仍然重名时追加 *，保证不会和真实发送者混在一起。names 为全部真实发送者。
+    """
+    names = set(names)
+    if OTHERS_LABEL not in names:
+        return OTHERS_LABEL
+    label = f"{OTHERS_LABEL}({len(names) - top_k}人)"
+    while label in names:
+        label += '*'
+    return label
+
+
+def fold_senders(df, top_k):
+    """
+    群聊模式：按消息数保留前 top_k 名发送者，其余合并为一组（名称见 _others_label）。
+    只做一次 value_counts 和分类编码重映射，之后所有按人统计的循环最多 top_k + 1 组。
+    原始发送者保存在 sender 列中，回复、对话轮次和连续发起仍按真实发送者判断“换人说话”。
+    发送者不超过 top_k 人时原样返回。
+    """
+    counts = df['name'].value_counts()
+    if top_k is None or len(counts) <= top_k:
+        return df
+    top = set(_top_senders(counts.to_dict(), top_k))
+    others = _others_label(counts.index, top_k)
+
+    names = df['name'].astype('category')
+    labels = [name if name in top else others for name in names.cat.categories]
+    categories = sorted(set(labels))
+    remap = np.array([categories.index(label) for label in labels], dtype=np.int64)
+    codes = names.cat.codes.to_numpy()
+    folded = np.where(codes >= 0, remap[np.maximum(codes, 0)], -1)
+
+    df = df.copy()
+    df['sender'] = names
+    df['name'] = pd.Categorical.from_codes(folded, categories=categories)
+    return df
+
+
+def load_and_clean_data(file_path, year):
+    """加载并清洗数据（优先读取列式缓存），返回 compact_frame 压缩后的 DataFrame"""
+    cache_path = _ensure_cache(file_path)
+    if cache_path is None:
+        return compact_frame(_clean_year(_read_source(file_path), year))
+
+    import pyarrow.parquet as pq
+    table = pq.read_table(cache_path, filters=[('year', '=', year)])
+    return compact_frame(table.to_pandas().drop(columns='year'))
+
+
+class _BoundedReader(io.RawIOBase):
+    """只读到 end 字节为止的文件包装，读取过程中追加到文件末尾的内容留给下一次续读"""
+
+    def __init__(self, f, end):
+        self.f = f
+        self.remaining = end - f.tell()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.f.readinto(memoryview(b)[:max(0, min(len(b), self.remaining))])
+        self.remaining -= n
+        return n
+
+
+def iter_source_chunks(file_path, chunk_rows=None, offset=0, end=None):
+    """
+    按批次读取原始导出（不做年份过滤），每批最多 chunk_rows 行。
+    xlsx 使用 openpyxl 只读模式逐行读取，csv 使用 pandas 分块读取，内存占用与文件大小无关。
+    offset、end 只对 csv 有效：只读取 [offset, end) 字节（都是某一行的行首，见 _csv_resume_point），
+    end 为 None 时读到文件末尾。
+    """
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    if file_path.lower().endswith('.csv'):
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            end = size if end is None else min(end, size)
+            if offset >= end:
+                return
+            f.seek(offset)
+            reader = io.BufferedReader(_BoundedReader(f, end))
+            for chunk in pd.read_csv(reader, header=None, chunksize=chunk_rows, encoding='utf-8'):
+                yield _normalize_source(chunk)
+        return
+
+    from openpyxl import load_workbook
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        rows = []
+        for row in wb.worksheets[0].iter_rows(values_only=True):
+            rows.append(row[:4])
+            if len(rows) >= chunk_rows:
+                yield _normalize_source(pd.DataFrame(rows))
+                rows = []
+        if rows:
+            yield _normalize_source(pd.DataFrame(rows))
+    finally:
+        wb.close()
+
+
+_RESUME_TAIL_BYTES = 4096
+
+
+def _csv_resume_point(file_path):
+    """
+    csv 增量续读的位置：{'offset': 文件大小, 'tail': 末尾 4KB 的哈希}。
+    文件为空或不以换行结尾（最后一行可能还没写完）时返回 None，下次从头读取。
+    """
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        f.seek(max(0, size - _RESUME_TAIL_BYTES))
+        tail = f.read(size)
+    if not tail.endswith(b'\n'):
+        return None
+    return {'offset': size, 'tail': hashlib.sha1(tail).hexdigest()}
+
+
+def _csv_resume_offset(file_path, point):
+    """文件只是在末尾追加了内容时返回可以续读的字节位置，否则（被替换、截断或修改）返回 0"""
+    if not point:
+        return 0
+    offset = point['offset']
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < offset:
+            return 0
+        f.seek(max(0, offset - _RESUME_TAIL_BYTES))
+        tail = f.read(offset - max(0, offset - _RESUME_TAIL_BYTES))
+    return offset if hashlib.sha1(tail).hexdigest() == point['tail'] else 0
+
+
+def load_years(file_path, years):
+    """一次加载多个年份的数据，返回 {年份: DataFrame}（没有记录的年份不包含在内）"""
+    cache_path = _ensure_cache(file_path)
+    if cache_path is None:
+        raw = _read_source(file_path)
+        parts = {year: _clean_year(raw, year) for year in years}
+        return {year: compact_frame(df) for year, df in parts.items() if len(df) > 0}
+
+    import pyarrow.parquet as pq
+    table = pq.read_table(cache_path, filters=[('year', 'in', list(years))])
+    df = table.to_pandas()
+    return {int(year): compact_frame(part.drop(columns='year').reset_index(drop=True))
+            for year, part in df.groupby('year')}
+
+
+def _period_title(period=None):
+    """报告标题中的时间段：整年为“2025年度”，查询区间直接使用区间标签（见 ChatDataset）；period 默认为 ANALYSIS_YEAR"""
+    if period is None:
+        period = ANALYSIS_YEAR
+    return f"{period}年度" if isinstance(period, int) else str(period)
+
+
+def load_all_data(file_path):
+    """加载全部年份的数据（优先读取列式缓存），按时间排序后返回 compact_frame 压缩后的 DataFrame"""
+    cache_path = _ensure_cache(file_path)
+    if cache_path is None:
+        raw = _read_source(file_path)
+        return compact_frame(_clean_frame(raw[raw['datetime'].notna()]))
+
+    import pyarrow.parquet as pq
+    # 缓存按年份升序写入、年内已排序，整体读取后即按时间有序
+    df = pq.read_table(cache_path).to_pandas().drop(columns='year')
+    if not df['datetime'].is_monotonic_increasing:
+        df = df.sort_values('datetime', kind='stable').reset_index(drop=True)
+    return compact_frame(df)
+
+
+class ChatDataset:
+    """
+    全部聊天记录按时间排序后常驻内存，可按任意时间区间和发送者查询。
+    时间过滤用二分查找（np.searchsorted）定位行号区间，每次查询只接触区间内的行；
+    同一进程中再次 load 同一文件（大小和修改时间未变）时直接复用已加载的数据。
+    """
+
+    _loaded = {}  # 绝对路径 -> ((大小, 修改时间), ChatDataset)
+
+    def __init__(self, df):
+        self.df = df
+        self.times = df['datetime'].to_numpy()
+
+    @classmethod
+    def load(cls, file_path):
+        stat = os.stat(file_path)
+        key, version = os.path.abspath(file_path), (stat.st_size, stat.st_mtime_ns)
+        cached = cls._loaded.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        dataset = cls(load_all_data(file_path))
+        cls._loaded[key] = (version, dataset)
+        return dataset
+
+    def __len__(self):
+        return len(self.df)
+
+    def _position(self, when):
+        return int(np.searchsorted(self.times, pd.Timestamp(when).to_datetime64(), side='left'))
+
+    def query(self, start=None, end=None, senders=None):
+        """
+        返回时间在 [start, end) 内（None 表示不限）、且发送者属于 senders（None 表示全部）的消息，
+        格式与 load_and_clean_data 相同，可直接交给 run_year_report 等分析函数。
+        """
+        lo = 0 if start is None else self._position(start)
+        hi = len(self.times) if end is None else self._position(end)
+        df = self.df.iloc[lo:hi]
+        if senders:
+            df = df[df['name'].isin(senders)]
+        df = df.reset_index(drop=True)
+        # 分类列只保留区间内出现的值，与单独加载这部分数据时一致
+        for col in ('name', 'qq', 'date'):
+            df[col] = df[col].cat.remove_unused_categories()
+        return df
+
+    def year(self, year, senders=None):
+        return self.query(pd.Timestamp(year, 1, 1), pd.Timestamp(year + 1, 1, 1), senders)
+
+    def month(self, year, month, senders=None):
+        start = pd.Timestamp(year, month, 1)
+        return self.query(start, start + pd.offsets.MonthBegin(1), senders)
+
+    def rolling_window(self, days, end=None):
+        """截至 end 当天（默认最后一条消息所在的日期）的最近 days 天，返回左闭右开的 (起, 止)"""
+        end = pd.Timestamp(end if end is not None else self.times[-1]).normalize() + pd.Timedelta(days=1)
+        return end - pd.Timedelta(days=days), end
+
+    def last_days(self, days, end=None, senders=None):
+        start, end = self.rolling_window(days, end)
+        return self.query(start, end, senders)
+
+
+def _print_basic_statistics(date_range, total_messages, total_days, person_stats):
     print(f"\n{'=' * 60}")
-    print(f"📊 {ANALYSIS_YEAR}年度聊天数据分析报告")
+    print(f"📊 {_period_title()}聊天数据分析报告")
     print(f"{'=' * 60}\n")
 
-    total_messages = len(df)
-    total_days = df['date'].nunique()
-    date_range = f"{df['datetime'].min().strftime('%Y-%m-%d')} 至 {df['datetime'].max().strftime('%Y-%m-%d')}"
-
     print(f"📅 统计时间段: {date_range}")
     print(f"💬 总消息数: {total_messages} 条")
     print(f"📆 聊天天数: {total_days} 天")
@@ -55,50 +778,170 @@ def basic_statistics(df):
     print(f"{'=' * 60}")
     print("👥 个人消息统计")
     print(f"{'=' * 60}")
-    person_stats = df.groupby('name').agg({
+    for name, row in person_stats.iterrows():
+        print(f"\n{name}:")
+        print(f"  发送消息: {int(row['消息数'])} 条 ({row['占比']}%)")
+        print(f"  平均长度: {row['平均消息长度']:.1f} 字")
+
+
+def data_overview(df):
+    """统计时间段、总消息数与聊天天数（报告与 HTML 共用的概览数据）"""
+    return {
+        'date_range': f"{df['datetime'].min().strftime('%Y-%m-%d')} 至 {df['datetime'].max().strftime('%Y-%m-%d')}",
+        'total_messages': len(df),
+        'total_days': df['date'].nunique(),
+    }
+
+
+def basic_statistics(df):
+    """基础统计分析"""
+    overview = data_overview(df)
+    total_messages = overview['total_messages']
+    total_days = overview['total_days']
+    date_range = overview['date_range']
+
+    person_stats = df.groupby('name', observed=True).agg({
         'message': 'count',
         'datetime': lambda x: (x.max() - x.min()).days
     }).round(2)
     person_stats.columns = ['消息数', '跨越天数']
     person_stats['占比'] = (person_stats['消息数'] / total_messages * 100).round(2)
-    person_stats['平均消息长度'] = df.groupby('name')['message'].apply(lambda x: x.str.len().mean()).round(2)
-
-    for name, row in person_stats.iterrows():
-        print(f"\n{name}:")
-        print(f"  发送消息: {int(row['消息数'])} 条 ({row['占比']}%)")
-        print(f"  平均长度: {row['平均消息长度']:.1f} 字")
+    person_stats['平均消息长度'] = df.groupby('name', observed=True)['message'].apply(lambda x: x.str.len().mean()).round(2)
 
+    _print_basic_statistics(date_range, total_messages, total_days, person_stats)
     return person_stats
 
 
-def time_analysis(df):
-    """时间分布分析"""
+def _print_time_analysis(hour_dist, weekday_dist, month_dist, daily_count):
     print(f"\n{'=' * 60}")
     print("⏰ 时间分布分析")
     print(f"{'=' * 60}")
 
-    hour_dist = df['hour'].value_counts().sort_index()
     most_active_hour = hour_dist.idxmax()
     print(f"\n最活跃时段: {most_active_hour}:00-{most_active_hour}:59 ({hour_dist.max()} 条消息)")
 
     weekday_names = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
-    weekday_dist = df['weekday'].value_counts().sort_index()
     most_active_day = weekday_names[weekday_dist.idxmax()]
     print(f"最活跃星期: {most_active_day} ({weekday_dist.max()} 条消息)")
 
-    month_dist = df['month'].value_counts().sort_index()
     most_active_month = month_dist.idxmax()
     print(f"最活跃月份: {most_active_month}月 ({month_dist.max()} 条消息)")
 
-    daily_count = df.groupby('date').size()
     most_active_date = daily_count.idxmax()
     print(f"聊得最多的一天: {most_active_date} ({daily_count.max()} 条消息)")
 
+
+def time_analysis(df):
+    """时间分布分析"""
+    hour_dist = df['hour'].value_counts().sort_index()
+    weekday_dist = df['weekday'].value_counts().sort_index()
+    month_dist = df['month'].value_counts().sort_index()
+    daily_count = df.groupby('date', observed=True).size()
+
+    _print_time_analysis(hour_dist, weekday_dist, month_dist, daily_count)
     return hour_dist, weekday_dist, month_dist
 
 
-def interaction_analysis(df):
-    """互动模式分析"""
+def _sorted_quantile(values, starts, counts, q):
+    """在按组排好序的数组上计算每组的分位数（线性插值，与 pandas quantile 一致）"""
+    pos = q * (counts - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, counts - 1)
+    frac = pos - lo
+    low_vals = values[starts + lo]
+    return low_vals + (values[starts + hi] - low_vals) * frac
+
+
+def reply_latency_stats(names, time_diff):
+    """
+    向量化计算每个人的回复时间统计。
+    time_diff 只转换一次为 int64 秒，按 (发送者, 秒数) 排序后，
+    均值、分位数、慢回复占比、最快回复和次数都在整段数组上一次算出。
+    返回的 DataFrame 与原先 groupby.agg 的结构相同（索引为 name，单位：分钟/秒/次）。
+    """
+    seconds = time_diff.to_numpy().astype('timedelta64[s]').astype(np.int64)
+    codes, uniques = pd.factorize(names, sort=True)
+    valid = codes >= 0
+    codes, seconds = codes[valid], seconds[valid]
+
+    order = np.lexsort((seconds, codes))
+    codes, seconds = codes[order], seconds[order]
+    counts = np.bincount(codes, minlength=len(uniques))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    present = counts > 0
+    counts, starts = counts[present], starts[present]
+    index = pd.Index(np.asarray(uniques)[present], name='name')
+
+    def over(threshold_seconds):
+        return np.bincount(codes, weights=seconds > threshold_seconds, minlength=len(uniques))[present]
+
+    return _reply_stats_frame(
+        index, counts,
+        total_seconds=np.bincount(codes, weights=seconds, minlength=len(uniques))[present],
+        quantile=lambda q: _sorted_quantile(seconds, starts, counts, q),
+        over=over,
+        fastest=seconds[starts],
+    )
+
+
+def _reply_stats_frame(index, counts, total_seconds, quantile, over, fastest):
+    """
+    组装回复速度统计表（精确计算与流式直方图共用）。
+    quantile(q) 返回每人的分位数（秒），over(t) 返回每人超过 t 秒的回复次数。
+    """
+    reply_stats = pd.DataFrame({
+        '平均回复时间': total_seconds / counts / 60,
+        '中位数回复时间': quantile(0.5) / 60,
+
+        # ✅ 高分位数：体现“经常拖很久”
+        'P90回复时间': quantile(0.90) / 60,
+        'P95回复时间': quantile(0.95) / 60,
+
+        # ✅ 慢回复占比：体现“总是不及时”
+        '>5分钟占比': over(5 * 60) / counts * 100,
+        '>30分钟占比': over(30 * 60) / counts * 100,
+        '>60分钟占比': over(60 * 60) / counts * 100,
+
+        '最快回复': np.asarray(fastest, dtype=np.float64),
+        '回复次数': np.asarray(counts, dtype=np.int64),
+    }, index=index)
+    return reply_stats.round(2)
+
+
+def _speaker_column(df):
+    """判断“换人说话”所用的列：群聊模式（fold_senders）下为原始发送者 sender，否则为 name"""
+    return 'sender' if 'sender' in df.columns else 'name'
+
+
+def session_table(df):
+    """
+    用整列数组运算统计每次对话的轮次、消息数和时长（只保留至少 2 条消息的对话）。
+    要求 df 已按时间排序并带有 session_break / session_id 列，同一对话的消息是连续的。
+    """
+    n = len(df)
+    if n == 0:
+        return pd.DataFrame(columns=['session_id', 'rounds', 'messages', 'duration'])
+
+    session_break = df['session_break'].to_numpy(dtype=bool)
+    starts = np.flatnonzero(session_break)
+    ends = np.append(starts[1:], n)
+
+    # 轮次 = 对话内发送者发生变化的次数（对话第一条消息也算一次）
+    speaker = df[_speaker_column(df)]
+    name_change = ((speaker != speaker.shift()).to_numpy(dtype=bool) | session_break).astype(np.int64)
+    times = df['datetime'].to_numpy()
+
+    session_df = pd.DataFrame({
+        'session_id': df['session_id'].to_numpy()[starts].astype(np.int64),
+        'rounds': np.add.reduceat(name_change, starts),
+        'messages': (ends - starts).astype(np.int64),
+        'duration': (times[ends - 1] - times[starts]) / np.timedelta64(1, 's') / 60,
+    })
+    return session_df[session_df['messages'] >= 2].reset_index(drop=True)
+
+
+def _print_interaction_analysis(reply_stats, session_df, initiation_stats, max_streak, all_emojis, person_emojis):
     print(f"\n{'=' * 60}")
     print("💬 互动模式深度分析")
     print(f"{'=' * 60}")
@@ -106,33 +949,7 @@ def interaction_analysis(df):
     print(f"\n⚡ 回复速度分析")
     print(f"{'-' * 60}")
 
-    df['time_diff'] = df['datetime'].diff()
-    df['prev_name'] = df['name'].shift(1)
-    reply_df = df[df['name'] != df['prev_name']].copy()
-    reply_df = reply_df[reply_df['time_diff'] <= timedelta(hours=1.5)]
-
-    reply_stats = None
-    if len(reply_df) > 0:
-        SLOW_5MIN = timedelta(minutes=5)
-        SLOW_30MIN = timedelta(minutes=30)
-        SLOW_60MIN = timedelta(minutes=60)
-        reply_stats = reply_df.groupby('name')['time_diff'].agg([
-            ('平均回复时间', lambda x: x.mean().total_seconds() / 60),
-            ('中位数回复时间', lambda x: x.median().total_seconds() / 60),
-
-            # ✅ 高分位数：体现“经常拖很久”
-            ('P90回复时间', lambda x: x.quantile(0.90).total_seconds() / 60),
-            ('P95回复时间', lambda x: x.quantile(0.95).total_seconds() / 60),
-
-            # ✅ 慢回复占比：体现“总是不及时”
-            ('>5分钟占比', lambda x: (x > SLOW_5MIN).mean() * 100),
-            ('>30分钟占比', lambda x: (x > SLOW_30MIN).mean() * 100),
-            ('>60分钟占比', lambda x: (x > SLOW_60MIN).mean() * 100),
-
-            ('最快回复', lambda x: x.min().total_seconds()),
-            ('回复次数', 'count')
-        ]).round(2)
-
+    if reply_stats is not None:
         for name, row in reply_stats.iterrows():
             print(f"\n{name}:")
             print(f"  中位数回复时间: {row['中位数回复时间']:.1f} 分钟")
@@ -149,22 +966,6 @@ def interaction_analysis(df):
     print(f"\n🔄 对话轮次分析")
     print(f"{'-' * 60}")
 
-    df['session_break'] = (df['time_diff'] > timedelta(minutes=30)) | (df['time_diff'].isna())
-    df['session_id'] = df['session_break'].cumsum()
-
-    session_stats = []
-    for session_id, group in df.groupby('session_id'):
-        if len(group) >= 2:
-            name_changes = (group['name'] != group['name'].shift()).sum()
-            session_stats.append({
-                'session_id': session_id,
-                'rounds': name_changes,
-                'messages': len(group),
-                'duration': (group['datetime'].max() - group['datetime'].min()).total_seconds() / 60
-            })
-
-    session_df = pd.DataFrame(session_stats)
-
     if len(session_df) > 0:
         print(f"总对话场次: {len(session_df)} 次")
         print(f"平均每次对话轮次: {session_df['rounds'].mean():.1f} 轮")
@@ -175,20 +976,6 @@ def interaction_analysis(df):
     print(f"\n🎯 主动性分析")
     print(f"{'-' * 60}")
 
-    initiators = (df.sort_values("datetime")
-    .groupby("session_id")
-    .first()["name"])  # 每段对话第一条消息的发送者
-
-    init_counts = initiators.value_counts()
-    init_ratio = (init_counts / init_counts.sum() * 100).round(2)
-
-    initiation_stats = {}
-    for name in df["name"].unique():
-        initiation_stats[name] = {
-            "init_count": int(init_counts.get(name, 0)),
-            "init_ratio": float(init_ratio.get(name, 0.0))
-        }
-
     for name, st in initiation_stats.items():
         print(f"\n{name}:")
         print(f"  发起对话: {st['init_count']} 次")
@@ -196,26 +983,11 @@ def interaction_analysis(df):
 
     topic_leader = max(initiation_stats.items(), key=lambda x: x[1]["init_count"])
     print(f"\n🏆 更常先开口的人: {topic_leader[0]}")
-
-    # 如果你还想看“最长连续由谁发起的 streak”（可选）
-    initiator_streak = (initiators != initiators.shift()).cumsum()
-    streak_len = initiators.groupby(initiator_streak).size()
-    print("最长连续发起 streak:", streak_len.max())
+    print("最长连续发起 streak:", max_streak)
 
     print(f"\n😊 表情使用分析")
     print(f"{'-' * 60}")
 
-    emoji_pattern = r'/[\u4e00-\u9fa5]+'
-    person_emojis = {}
-    for name in df['name'].unique():
-        person_msgs = df[df['name'] == name]['message'].astype(str)
-        emojis = []
-        for msg in person_msgs:
-            emojis.extend(re.findall(emoji_pattern, msg))
-        person_emojis[name] = Counter(emojis)
-
-    all_emojis = sum(person_emojis.values(), Counter())
-
     if all_emojis:
         print(f"\n📊 表情使用总榜 TOP 10:")
         for emoji, count in all_emojis.most_common(10):
@@ -227,156 +999,312 @@ def interaction_analysis(df):
                 for emoji, count in emoji_counter.most_common(5):
                     print(f"  {emoji}: {count} 次")
 
+
+def _initiation_stats(init_counts, names):
+    """根据每人发起对话次数计算发起次数与占比"""
+    init_ratio = (init_counts / init_counts.sum() * 100).round(2)
+    initiation_stats = {}
+    for name in names:
+        initiation_stats[name] = {
+            "init_count": int(init_counts.get(name, 0)),
+            "init_ratio": float(init_ratio.get(name, 0.0))
+        }
+    return initiation_stats
+
+
+EMOJI_PATTERN = re.compile(r'(/[\u4e00-\u9fa5]+)')
+
+
+def _message_texts(messages):
+    """
+    消息列转为文本供拼接、匹配和分词使用；空消息（NaN）按空字符串处理。
+    Arrow 字符串列（以及 pandas 3 的 str 列）上 astype(str) 不会把 NaN 变成文本。
+    """
+    return messages.fillna('').astype(str)
+
+
+def emoji_counters(df):
+    """
+    统计每个人的表情使用次数，返回 ({name: Counter}, 总 Counter)。
+    对整列消息做一次 str.extractall，再按 (发送者, 表情) 分组计数，
+    各人的 Counter 按首次出现顺序填充，总榜线性合并。
+    """
+    person_emojis = {name: Counter() for name in df['name'].unique()}
+
+    messages = _message_texts(df['message']).reset_index(drop=True)
+    matches = messages.str.extractall(EMOJI_PATTERN)[0]
+    if len(matches) > 0:
+        senders = df['name'].to_numpy()[matches.index.get_level_values(0)]
+        pairs = pd.DataFrame({'name': senders, 'emoji': matches.to_numpy()})
+        for (name, emoji), count in pairs.groupby(['name', 'emoji'], sort=False).size().items():
+            person_emojis[name][emoji] = int(count)
+
+    all_emojis = Counter()
+    for counter in person_emojis.values():
+        all_emojis.update(counter)
+    return person_emojis, all_emojis
+
+
+def interaction_analysis(df, session_gap_minutes=None):
+    """互动模式分析"""
+    speaker = _speaker_column(df)
+    df['time_diff'] = df['datetime'].diff()
+    df['prev_name'] = df[speaker].shift(1)
+    reply_df = df[df[speaker] != df['prev_name']].copy()
+    reply_df = reply_df[reply_df['time_diff'] <= timedelta(seconds=_REPLY_MAX_SECONDS)]
+
+    reply_stats = None
+    if len(reply_df) > 0:
+        reply_stats = reply_latency_stats(reply_df['name'], reply_df['time_diff'])
+
+    if session_gap_minutes is None:
+        session_gap_minutes = SESSION_GAP_MINUTES
+    df['session_break'] = (df['time_diff'] > timedelta(minutes=session_gap_minutes)) | (df['time_diff'].isna())
+    df['session_id'] = df['session_break'].cumsum()
+
+    session_df = session_table(df)
+
+    firsts = df.sort_values("datetime", kind='stable').groupby("session_id").first()
+    initiators = firsts["name"]  # 每段对话第一条消息的发送者
+
+    initiation_stats = _initiation_stats(initiators.value_counts(), df["name"].unique())
+
+    # 最长连续由同一个人发起的 streak
+    starters = firsts[speaker]
+    initiator_streak = (starters != starters.shift()).cumsum()
+    streak_len = starters.groupby(initiator_streak).size()
+
+    person_emojis, all_emojis = emoji_counters(df)
+
+    _print_interaction_analysis(reply_stats, session_df, initiation_stats, streak_len.max(),
+                                all_emojis, person_emojis)
     return reply_stats, session_df, initiation_stats, all_emojis
 
 
-def content_deep_analysis(df):
-    """内容深度分析"""
+class KeywordMatcher:
+    """
+    Aho-Corasick 多模式匹配器：一次扫描文本即可统计所有关键词的出现次数。
+    每个关键词按 str.count 的语义计数（从左到右、互不重叠）。
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(keywords))
+        self.index = {kw: i for i, kw in enumerate(self.keywords)}
+        self._lengths = [len(kw) for kw in self.keywords]
+        self._alphabet = set(''.join(self.keywords))
+
+        # 构建 trie
+        goto = [{}]
+        out = [[]]
+        for i, kw in enumerate(self.keywords):
+            state = 0
+            for ch in kw:
+                if ch not in goto[state]:
+                    goto.append({})
+                    out.append([])
+                    goto[state][ch] = len(goto) - 1
+                state = goto[state][ch]
+            out[state].append(i)
+
+        # BFS 构建失败指针，并把失败链上的输出合并到当前状态
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for ch, nxt in goto[state].items():
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+                queue.append(nxt)
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def count(self, text):
+        """返回每个关键词在 text 中的出现次数（列表，下标与 self.keywords 对应）"""
+        goto, fail, out, lengths = self._goto, self._fail, self._out, self._lengths
+        alphabet = self._alphabet
+        counts = [0] * len(self.keywords)
+        next_free = [0] * len(self.keywords)  # 每个关键词下一次允许开始匹配的位置（不重叠）
+        state = 0
+        for pos, ch in enumerate(text):
+            if ch not in alphabet:
+                state = 0
+                continue
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for i in out[state]:
+                if pos - lengths[i] + 1 >= next_free[i]:
+                    counts[i] += 1
+                    next_free[i] = pos + 1
+        return counts
+
+
+def keyword_statistics(df, topic_keywords, emotion_keywords):
+    """
+    单次遍历消息，同时统计话题、情绪关键词和表情。
+    返回 (topic_stats, emotion_stats, person_emotions, person_topics)，
+    计数与逐关键词 str.count 完全一致。
+    """
+    emoji_pattern = r'/[\u4e00-\u9fa5]+'
+    topic_matcher = KeywordMatcher(kw for kws in topic_keywords.values() for kw in kws)
+    emotion_matcher = KeywordMatcher(
+        kw for patterns in emotion_keywords.values() for kw in patterns['keywords'] + patterns['emoji']
+    )
+
+    names = df['name'].unique()
+    person_topics = {name: dict.fromkeys(topic_keywords, 0) for name in names}
+    person_emotions = {name: dict.fromkeys(emotion_keywords, 0) for name in names}
+    topic_totals = dict.fromkeys(topic_keywords, 0)
+
+    # dropna=False：发送者为空的消息同样计入话题总数
+    for name, msgs in df.groupby('name', sort=False, dropna=False, observed=True)['message']:
+        # 话题在清洗后的文本上统计，情绪在原始文本上统计（与原逻辑一致）
+        person_text = ' '.join(_message_texts(msgs))
+        person_text_clean = re.sub(emoji_pattern, '', person_text)
+        person_text_clean = re.sub(r'\[图片\]|\[表情\]|\[引用\]', '', person_text_clean)
+
+        topic_counts = topic_matcher.count(person_text_clean)
+        for topic, keywords in topic_keywords.items():
+            count = sum(topic_counts[topic_matcher.index[kw]] for kw in keywords)
+            topic_totals[topic] += count
+            if name in person_topics:
+                person_topics[name][topic] = count
+
+        if name not in person_emotions:
+            continue
+        emotion_counts = emotion_matcher.count(person_text)
+        for emotion, patterns in emotion_keywords.items():
+            person_emotions[name][emotion] = sum(
+                emotion_counts[emotion_matcher.index[kw]] for kw in patterns['keywords'] + patterns['emoji']
+            )
+
+    topic_stats = {topic: count for topic, count in topic_totals.items() if count > 0}
+
+    emotion_stats = {emotion: sum(person_emotions[name][emotion] for name in names)
+                     for emotion in emotion_keywords}
+
+    return topic_stats, emotion_stats, person_emotions, person_topics
+
+
+class TokenCache:
+    """按消息文本哈希持久化 jieba 分词结果（SQLite），重复运行和重叠的年份不会重复分词"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tokens (hash TEXT PRIMARY KEY, tokens TEXT)")
+
+    @staticmethod
+    def key(text):
+        # 分词结果依赖 jieba 版本（词典），一并计入键
+        import jieba
+        return hashlib.sha1(f"{jieba.__version__}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT hash, tokens FROM tokens WHERE hash IN ({','.join('?' * len(batch))})", batch
+            )
+            found.update((h, json.loads(t)) for h, t in rows)
+        return found
+
+    def put_many(self, items):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO tokens (hash, tokens) VALUES (?, ?)",
+                ((h, json.dumps(tokens, ensure_ascii=False)) for h, tokens in items)
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def _clean_message_text(text):
+    """去掉表情代码和 [图片] 等占位符，供分词使用"""
+    text = re.sub(r'/[\u4e00-\u9fa5]+', '', text)
+    return re.sub(r'\[图片\]|\[表情\]|\[引用\]', '', text)
+
+
+def _cut_batch(texts):
+    import jieba
+    return [jieba.lcut(text) for text in texts]
+
+
+def tokenize_messages(messages, min_parallel=5000):
+    """
+    逐条消息分词，返回 [(tokens, 出现次数), ...]，按消息首次出现的顺序排列。
+    相同文本只分词一次；已缓存的消息直接读取，其余的在进程池中并行分词后写回缓存。
+    消息之间以空格分隔时 jieba 不会跨消息成词，因此结果与整体拼接后分词一致。
+    """
+    _wait_jieba_preload()
+    import jieba
+
+    text_counts = Counter(_clean_message_text(text) for text in _message_texts(messages))
+    texts = list(text_counts)
+    keys = [TokenCache.key(text) for text in texts]
+
+    cache = None
+    if CACHE_DIR:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        cache = TokenCache(os.path.join(CACHE_DIR, 'jieba_tokens.sqlite'))
+    try:
+        tokens_by_key = cache.get_many(keys) if cache else {}
+        missing = [(key, text) for key, text in zip(keys, texts) if key not in tokens_by_key]
+
+        if missing:
+            missing_texts = [text for _, text in missing]
+            workers = TOKENIZE_WORKERS or os.cpu_count() or 1
+            if len(missing_texts) < min_parallel or workers == 1:
+                results = _cut_batch(missing_texts)
+            else:
+                from concurrent.futures import ProcessPoolExecutor
+                size = max(1000, len(missing_texts) // (workers * 4) + 1)
+                batches = [missing_texts[i:i + size] for i in range(0, len(missing_texts), size)]
+                with ProcessPoolExecutor(max_workers=workers, initializer=jieba.initialize) as pool:
+                    results = [tokens for batch in pool.map(_cut_batch, batches) for tokens in batch]
+
+            new_items = [(key, tokens) for (key, _), tokens in zip(missing, results)]
+            tokens_by_key.update(new_items)
+            if cache:
+                cache.put_many(new_items)
+    finally:
+        if cache:
+            cache.close()
+
+    return [(tokens_by_key[key], text_counts[text]) for key, text in zip(keys, texts)]
+
+
+def count_words(messages):
+    """逐条消息分词并统计高频词（过滤停用词、单字和纯数字）"""
+    word_counter = Counter()
+    for tokens, n in tokenize_messages(messages):
+        for w in tokens:
+            if len(w) > 1 and w not in STOPWORDS and not w.isdigit() and w.strip():
+                word_counter[w] += n
+    return word_counter
+
+
+def _print_content_analysis(word_counter, topic_stats, emotion_stats, person_emotions):
     print(f"\n{'=' * 60}")
     print("🔍 内容深度分析")
     print(f"{'=' * 60}")
 
-    # 准备文本数据
-    all_text = ' '.join(df['message'].astype(str))
-    emoji_pattern = r'/[\u4e00-\u9fa5]+'
-    all_text_clean = re.sub(emoji_pattern, '', all_text)
-    all_text_clean = re.sub(r'\[图片\]|\[表情\]|\[引用\]', '', all_text_clean)
-
-    words = jieba.cut(all_text_clean)
-    stopwords = {
-        '的', '了', '是', '我', '你', '在', '有', '和', '就', '不', '人', '都', '一', '一个',
-        '上', '也', '很', '到', '说', '要', '去', '吗', '啊', '呢', '吧', '哦', '嘛',
-        '哈', '哈哈', '这', '那', '什么', '怎么', '为什么', '这样', '那样', '没有', '可以',
-        '图片', 'nan', '引用', '表情', '然后', '但是', '还是', '如果', '因为', '所以',
-        '已经', '还有', '或者', '而且', '不过', '只是', '应该', '可能', '觉得', '好像',
-        '感觉', '自己', '他们', '我们', '你们', '出来', '起来', '下来', '过来'
-    }
-    word_list = [w for w in words if len(w) > 1 and w not in stopwords and not w.isdigit() and w.strip()]
-    word_counter = Counter(word_list)
-
     # 1. 高频词统计
     print(f"\n📝 高频词 TOP 20:")
     for word, count in word_counter.most_common(20):
         print(f"  {word}: {count} 次")
 
-    # 2. 游戏话题统计
-
-    game_keywords = {
-        '原神': ['原神', '须弥', '提瓦特', '派蒙', '旅行者'],
-        '王者荣耀': ['王者', '荣耀', '峡谷', '五杀', '超神', '打野', '中路', '上路', '下路', '辅助'],
-        '英雄联盟': ['lol', 'LOL', '英雄联盟', '召唤师峡谷', '峡谷'],
-        '和平精英': ['和平精英', '吃鸡', '落地成盒', '空投'],
-        '我的世界': ['我的世界', 'mc', 'MC', '史蒂夫', '苦力怕'],
-        'GTA': ['gta', 'GTA', '圣安地列斯', '罪恶都市'],
-        '塞尔达': ['塞尔达', '旷野之息', '王国之泪'],
-        '宝可梦': ['宝可梦', '精灵宝可梦', '口袋妖怪', '皮卡丘'],
-        '明日方舟': ['明日方舟', '方舟', '博士', '刀客塔'],
-        '崩坏': ['崩坏', '星穹铁道', '崩铁']
-    }
-
-    # 3. 话题分类统计
+    # 2. 话题分类统计
     print(f"\n📚 话题分类统计")
     print(f"{'-' * 60}")
 
-    topic_keywords = {
-        # 📚 学习 / 学业
-        '学习': [
-            '学习', '作业', '考试', '复习', '背书', '刷题', '题目', '错题',
-            '老师', '课程', '上课', '下课', '学校', '教室', '图书馆',
-            '作业多', '写作业', '考试周', '期中', '期末', '挂科',
-            '论文', '报告', '开题', '答辩', '实验', '数据', '文献',
-            '绩点', '成绩', '排名', '选课'
-        ],
-
-        # 🎮 游戏
-        '游戏': list(set(
-            [kw for keywords in game_keywords.values() for kw in keywords] + [
-                '打游戏', '玩游戏', '开黑', '上分', '掉分', '匹配', '排位',
-                '段位', '胜率', '连胜', '连败', '队友', '坑', '挂机',
-                '版本', '更新', '补丁', '服务器', '国服', '国际服'
-            ]
-        )),
-
-        # 🍜 饮食 / 吃喝
-        '饮食': [
-            '吃', '喝', '饭', '菜', '做饭', '点菜', '点外卖',
-            '早餐', '午餐', '晚餐', '宵夜', '夜宵',
-            '零食', '水果', '甜点',
-            '火锅', '烧烤', '麻辣烫', '炸鸡', '烤肉', '拉面', '面条',
-            '奶茶', '咖啡', '可乐', '饮料', '酒',
-            '外卖', '饿', '好吃', '难吃', '撑了'
-        ],
-
-        # 🎬 娱乐 / 消遣
-        '娱乐': [
-            '电影', '电视剧', '剧', '综艺', '动漫', '番', '番剧',
-            '视频', '直播', 'up主', '博主', '主播',
-            'b站', 'B站', '抖音', '快手', '微博', '小红书',
-            '音乐', '歌', '听歌', '单曲', '专辑',
-            '演唱会', '音乐会'
-        ],
-
-        # 🏃 运动 / 身体活动
-        '运动': [
-            '运动', '锻炼', '健身', '健身房',
-            '跑步', '慢跑', '夜跑',
-            '篮球', '足球', '羽毛球', '乒乓球', '排球',
-            '游泳', '骑车', '骑行', '爬山', '徒步',
-            '拉伸', '力量', '有氧',
-            '减肥', '瘦', '胖', '体重', '肌肉', '酸'
-        ],
-
-        # ❤️ 情感 / 心理状态
-        '情感': [
-            '开心', '高兴', '快乐', '幸福', '满足',
-            '难过', '伤心', '失落', '低落', 'emo',
-            '生气', '烦', '烦躁', '郁闷', '焦虑', '紧张',
-            '害怕', '慌', '委屈', '崩溃', '累',
-            '想你', '想念', '在乎', '喜欢', '爱',
-            '感动', '失望', '后悔', '心烦'
-        ],
-
-        # 💼 工作 / 职业
-        '工作': [
-            '工作', '上班', '下班', '加班', '值班',
-            '公司', '单位', '部门',
-            '同事', '老板', '领导',
-            '项目', '任务', '需求', '进度', '方案',
-            '会议', '开会', '汇报', '总结',
-            '出差', '请假', '调休',
-            '工资', '薪水', '奖金', '绩效'
-        ],
-
-        # 🛒 购物 / 消费
-        '购物': [
-            '买', '购物', '下单', '付款', '退款',
-            '淘宝', '京东', '拼多多', '闲鱼',
-            '快递', '包裹', '物流', '签收',
-            '衣服', '裤子', '鞋子', '外套',
-            '包', '口红', '化妆品', '护肤品',
-            '便宜', '贵', '划算', '打折', '促销'
-        ],
-
-        # 🏠 日常 / 生活琐事（强烈建议加）
-        '生活': [
-            '睡觉', '起床', '熬夜', '失眠', '困',
-            '天气', '下雨', '下雪', '冷', '热',
-            '回家', '出门', '在家',
-            '洗澡', '洗头', '收拾', '打扫',
-            '手机', '电脑', '网络', '没电'
-        ]
-    }
-
-    topic_stats = {}
-    for topic, keywords in topic_keywords.items():
-        count = 0
-        for keyword in keywords:
-            count += all_text_clean.count(keyword)
-        if count > 0:
-            topic_stats[topic] = count
-
-    topic_stats = dict(sorted(topic_stats.items(), key=lambda x: x[1], reverse=True))
-
     if topic_stats:
         total_topic_mentions = sum(topic_stats.values())
         print(f"话题关键词总计: {total_topic_mentions} 次\n")
@@ -386,60 +1314,10 @@ def content_deep_analysis(df):
             bar = '█' * bar_length
             print(f"  {topic:6s}: {bar} {count:5d} 次 ({percentage:5.1f}%)")
 
-    # 4. 情绪分析
+    # 3. 情绪分析
     print(f"\n😄 情绪分析")
     print(f"{'-' * 60}")
 
-    emotion_keywords = {
-        '开心': {
-            'keywords': ['哈哈', '嘿嘿', '嘻嘻', '哇', '耶', '棒', '赞', '好开心', '开心', '快乐', '高兴'],
-            'emoji': ['/大笑', '/呲牙', '/愉快', '/开心', '/胜利']
-        },
-        '难过': {
-            'keywords': ['呜呜', '呜呜呜', '哭', '难过', '伤心', '委屈', 'QAQ', 'T_T'],
-            'emoji': ['/流泪', '/大哭', '/难过', '/委屈']
-        },
-        '生气': {
-            'keywords': ['生气', '气死', '烦', '讨厌', '无语', '服了'],
-            'emoji': ['/生气', '/愤怒', '/抓狂', '/吐血']
-        },
-        '惊讶': {
-            'keywords': ['哇', '天哪', '我去', '卧槽', '牛', '厉害', '震惊'],
-            'emoji': ['/惊讶', '/惊吓', '/吃惊', '/震惊']
-        },
-        '疑惑': {
-            'keywords': ['？？', '啥', '什么鬼', '为啥', '为什么'],
-            'emoji': ['/疑问', '/思考', '/困惑']
-        },
-        '无奈': {
-            'keywords': ['唉', '算了', '无奈', '没办法'],
-            'emoji': ['/捂脸', '/无奈', '/叹气']
-        }
-    }
-
-    emotion_stats = {}
-    person_emotions = {name: {} for name in df['name'].unique()}
-
-    for emotion, patterns in emotion_keywords.items():
-        total_count = 0
-
-        for name in df['name'].unique():
-            person_text = ' '.join(df[df['name'] == name]['message'].astype(str))
-            count = 0
-
-            for keyword in patterns['keywords']:
-                count += person_text.count(keyword)
-
-            for emoji in patterns['emoji']:
-                count += person_text.count(emoji)
-
-            person_emotions[name][emotion] = count
-            total_count += count
-
-        emotion_stats[emotion] = total_count
-
-    emotion_stats = dict(sorted(emotion_stats.items(), key=lambda x: x[1], reverse=True))
-
     print("整体情绪分布:")
     total_emotions = sum(emotion_stats.values())
     if total_emotions > 0:
@@ -448,40 +1326,738 @@ def content_deep_analysis(df):
             print(f"  {emotion}: {count} 次 ({percentage:.1f}%)")
 
     print("\n个人情绪偏好:")
-    for name in df['name'].unique():
-        person_emotion_sorted = sorted(person_emotions[name].items(), key=lambda x: x[1], reverse=True)
+    for name, emotions in person_emotions.items():
+        person_emotion_sorted = sorted(emotions.items(), key=lambda x: x[1], reverse=True)
         if person_emotion_sorted[0][1] > 0:
             top_emotion = person_emotion_sorted[0][0]
             print(f"  {name}: 最常表达 [{top_emotion}] 情绪 ({person_emotion_sorted[0][1]} 次)")
 
+
+def content_deep_analysis(df):
+    """内容深度分析"""
+    word_counter = count_words(df['message'])
+
+    topic_stats, emotion_stats, person_emotions, _ = keyword_statistics(df, TOPIC_KEYWORDS, EMOTION_KEYWORDS)
+    topic_stats = dict(sorted(topic_stats.items(), key=lambda x: x[1], reverse=True))
+    emotion_stats = dict(sorted(emotion_stats.items(), key=lambda x: x[1], reverse=True))
+
+    _print_content_analysis(word_counter, topic_stats, emotion_stats, person_emotions)
     return word_counter, None, topic_stats, emotion_stats, person_emotions
 
 
-def generate_wordcloud(word_counter):
-    """生成词云图"""
-    if not word_counter:
+class KLLSketch:
+    """
+    KLL 分位数草图：每层 compactor 满了就排序并随机保留奇数或偶数位置的一半，进入上一层（权重翻倍）。
+    空间约 O(k)，可合并；分位数的秩误差约 2.446 / k^0.9433（99% 置信度，k=200 时约 ±1.65%）。
+    """
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def rank_error(self):
+        return 2.446 / self.k ** 0.9433
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.n += len(values)
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self._compress()
+
+    def merge(self, other):
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate((self.levels[level], items))
+        self.n += other.n
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) >= self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                odd = len(items) % 2  # 奇数个时最小的一个留在本层
+                offset = int(self._rng.integers(2))
+                self.levels[level + 1] = np.concatenate((self.levels[level + 1], items[odd + offset::2]))
+                self.levels[level] = items[:odd]
+            level += 1
+
+    def quantile(self, q):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        idx = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+        return values[order][min(idx, len(values) - 1)]
+
+
+class ReplyHistogram:
+    """
+    单人回复时间的精确直方图（秒）：只保存出现过的秒数（升序）及其次数，
+    占用与不同秒数的个数成正比（最多 _REPLY_MAX_SECONDS + 1 项），回复很少的发送者几乎不占内存。
+    """
+
+    def __init__(self):
+        self.seconds = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def update(self, seconds, counts=None):
+        if counts is None:
+            seconds, counts = np.unique(seconds, return_counts=True)
+        values, inverse = np.unique(np.concatenate((self.seconds, seconds)), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate((self.counts, counts)),
+                                  minlength=len(values)).astype(np.int64)
+        self.seconds = values
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    @property
+    def total(self):
+        return int((self.seconds * self.counts).sum())
+
+    @property
+    def fastest(self):
+        return int(self.seconds[0])
+
+    def over(self, t):
+        """超过 t 秒的回复次数"""
+        return int(self.counts[np.searchsorted(self.seconds, t, side='right'):].sum())
+
+    def order_stat(self, k):
+        """排序后第 k 个（从 0 开始）回复时间"""
+        return int(self.seconds[np.searchsorted(np.cumsum(self.counts), k, side='right')])
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def __add__(self, other):
+        merged = self.copy()
+        merged.update(other.seconds, other.counts)
+        return merged
+
+
+class ReplySketch:
+    """单人回复时间的近似累加器：次数、总和、最快和慢回复计数精确，分位数来自 KLLSketch"""
+
+    THRESHOLDS = (5 * 60, 30 * 60, 60 * 60)
+
+    def __init__(self, k=200):
+        self.kll = KLLSketch(k)
+        self.count = 0
+        self.total = 0
+        self.fastest = None
+        self.over = dict.fromkeys(self.THRESHOLDS, 0)
+
+    def update(self, seconds):
+        self.kll.update(seconds)
+        self.count += len(seconds)
+        self.total += int(seconds.sum())
+        fastest = int(seconds.min())
+        self.fastest = fastest if self.fastest is None else min(self.fastest, fastest)
+        for t in self.THRESHOLDS:
+            self.over[t] += int((seconds > t).sum())
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def __add__(self, other):
+        merged = self.copy()
+        merged.kll.merge(other.kll)
+        merged.count += other.count
+        merged.total += other.total
+        merged.fastest = min(merged.fastest, other.fastest)
+        for t in self.THRESHOLDS:
+            merged.over[t] += other.over[t]
+        return merged
+
+
+class CountMinSketch:
+    """
+    Count-Min 草图：depth 行 × width 列计数器，估计值只会偏大，
+    且以 1 - delta 的概率偏差不超过 epsilon × N（N 为插入总次数）。
+    键用 blake2b 哈希，与进程和 PYTHONHASHSEED 无关，可以写入增量快照后继续累加。
+    """
+
+    def __init__(self, epsilon=0.001, delta=0.01):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.width = int(np.ceil(np.e / epsilon))
+        self.depth = int(np.ceil(np.log(1 / delta)))
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+        self.total = 0
+
+    def _columns(self, keys):
+        digests = b''.join(hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest() for key in keys)
+        h = np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+        # 双重哈希：第 i 行的列号为 (h1 + i * h2) mod width
+        rows = np.arange(self.depth, dtype=np.uint64)
+        return ((h[:, :1] + rows * h[:, 1:]) % np.uint64(self.width)).astype(np.int64)
+
+    def add(self, keys, counts):
+        cols = self._columns(keys)
+        counts = np.asarray(counts, dtype=np.int64)
+        rows = np.broadcast_to(np.arange(self.depth), cols.shape)
+        np.add.at(self.table, (rows, cols), np.broadcast_to(counts[:, None], cols.shape))
+        self.total += int(counts.sum())
+
+    def estimate(self, keys):
+        return self.table[np.arange(self.depth), self._columns(keys)].min(axis=1)
+
+    @property
+    def error(self):
+        """当前的误差上限 epsilon × N"""
+        return self.epsilon * self.total
+
+
+class HeavyHitters:
+    """Count-Min + top-K：只保留估计频次最高的 capacity 个键，top 为 {键: 估计频次} 的 Counter"""
+
+    def __init__(self, capacity, epsilon=0.001, delta=0.01):
+        self.capacity = capacity
+        self.sketch = CountMinSketch(epsilon, delta)
+        self.top = Counter()
+
+    def update(self, counts):
+        """合并一批 {键: 次数}"""
+        if not counts:
+            return
+        keys = list(counts)
+        self.sketch.add(keys, np.fromiter(counts.values(), np.int64, len(keys)))
+        self.top = self.select(self.top, keys)
+
+    def select(self, top, keys, prefix=''):
+        """
+        在原候选 top 与本批出现的 keys 中按当前估计值取前 capacity 个。
+        prefix 用于多张候选表共用一个草图（草图中的键为 prefix + key）。
+        """
+        candidates = list(dict.fromkeys([*top, *keys]))
+        est = self.sketch.estimate([prefix + key for key in candidates])
+        keep = np.argsort(-est, kind='stable')[:self.capacity]
+        return Counter({candidates[i]: int(est[i]) for i in keep})
+
+
+class StreamingAnalyzer:
+    """
+    流式分析器：逐批 update() 消息，只维护可合并的累加器
+    （小时/星期/月份直方图、每人计数、回复时间直方图、表情与词频计数、对话统计），
+    不保存消息本身。占用随以下几项增长，而不是随消息条数增长：
+    发送者人数（每人的计数、稀疏回复直方图、表情和情绪计数）、不同词语数、天数，
+    以及对话场次——每场对话保存 4 个数，用于精确的轮次/时长中位数和分布图（约 32 字节/场）。
+    上一条消息的发送者和时间、进行中的对话等跨批次状态保存在实例中。
+    要求数据按时间顺序到达，结果与内存模式一致（发送者为空的消息不计入个人统计）。
+    """
+
+    def __init__(self, session_gap_minutes=None):
+        if session_gap_minutes is None:
+            session_gap_minutes = SESSION_GAP_MINUTES
+        self.session_gap = timedelta(minutes=session_gap_minutes)
+
+        self.total_messages = 0
+        self.first_dt = None
+        self.last_dt = None
+        self.high_water_rows = 0  # 时间恰好等于 last_dt 的已处理消息数，用于增量去重
+        self.date_counts = Counter()
+        self.hour_hist = np.zeros(24, dtype=np.int64)
+        self.weekday_hist = np.zeros(7, dtype=np.int64)
+        self.month_hist = np.zeros(13, dtype=np.int64)
+
+        # 每人：消息行数、有效消息数、首末时间、消息长度总和/条数（按首次出现顺序）
+        self.persons = {}
+        # 每人回复时间直方图（秒，0 ~ 1.5 小时，ReplyHistogram），第一次回复时才创建
+        self.reply_hists = {}
+
+        # 跨批次状态
+        self.prev_dt = None
+        self.prev_name = None
+        self.session_count = 0
+        self.open_session = None
+
+        # 已结束的对话（至少 2 条消息），用紧凑的数组保存
+        self.sessions = {'session_id': array('q'), 'rounds': array('q'), 'messages': array('q'),
+                         'duration': array('d')}
+        self.init_counts = Counter()
+        self.streak_name = None
+        self.streak_len = 0
+        self.max_streak = 0
+
+        self.person_emojis = {}
+        self.word_counter = Counter()
+        self.topic_totals = dict.fromkeys(TOPIC_KEYWORDS, 0)
+        self.person_emotions = {}
+
+    def update(self, chunk):
+        """合并一批已清洗（带派生列、按时间排序）的消息"""
+        if len(chunk) == 0:
+            return
+        times = chunk['datetime']
+        if self.last_dt is not None and times.iloc[0] < self.last_dt:
+            raise ValueError("流式模式要求聊天记录按时间顺序排列")
+
+        self.total_messages += len(chunk)
+        self.first_dt = times.iloc[0] if self.first_dt is None else self.first_dt
+        at_last = int((times == times.iloc[-1]).sum())
+        self.high_water_rows = self.high_water_rows + at_last if times.iloc[-1] == self.last_dt else at_last
+        self.last_dt = times.iloc[-1]
+        self.date_counts.update(chunk['date'].value_counts().to_dict())
+        self.hour_hist += np.bincount(chunk['hour'], minlength=24)
+        self.weekday_hist += np.bincount(chunk['weekday'], minlength=7)
+        self.month_hist += np.bincount(chunk['month'], minlength=13)
+
+        self._update_persons(chunk)
+
+        # 与上一批最后一条消息衔接
+        prev_times = times.shift(1)
+        prev_names = chunk['name'].shift(1)
+        if self.prev_dt is not None:
+            prev_times.iloc[0] = self.prev_dt
+            prev_names.iloc[0] = self.prev_name
+        time_diff = times - prev_times
+        name_changed = chunk['name'] != prev_names
+
+        self._update_replies(chunk['name'], time_diff, name_changed)
+        self._update_sessions(chunk, time_diff, name_changed)
+        self.prev_dt = times.iloc[-1]
+        self.prev_name = chunk['name'].iloc[-1]
+
+        person_emojis, _ = emoji_counters(chunk)
+        self._update_emojis({name: counter for name, counter in person_emojis.items() if not pd.isna(name)})
+        self._update_words(count_words(chunk['message']))
+
+        topic_stats, _, person_emotions, _ = keyword_statistics(chunk, TOPIC_KEYWORDS, EMOTION_KEYWORDS)
+        for topic, count in topic_stats.items():
+            self.topic_totals[topic] += count
+        for name, emotions in person_emotions.items():
+            if pd.isna(name):
+                continue
+            acc = self.person_emotions.setdefault(name, dict.fromkeys(EMOTION_KEYWORDS, 0))
+            for emotion, count in emotions.items():
+                acc[emotion] += count
+
+    def ingest(self, raw_chunks, year, appended=False):
+        """
+        逐批清洗并合并原始数据，只处理比高水位（last_dt）更新的消息，返回新增消息数。
+        从头重读时，与高水位同一时间的消息按已处理条数跳过，因此同一分钟内追加的消息也不会丢失或重复；
+        appended=True 表示 raw_chunks 只包含快照之后追加的行（csv 续读），这些行都是新的，不再跳过。
+        """
+        high_water = self.last_dt
+        skip = 0 if appended else self.high_water_rows
+        added = 0
+        for raw in raw_chunks:
+            if high_water is not None:
+                raw = raw[raw['datetime'] >= high_water]
+            chunk = _clean_year(raw, year)
+            if high_water is not None and skip and len(chunk):
+                at_high_water = np.flatnonzero((chunk['datetime'] == high_water).to_numpy())[:skip]
+                skip -= len(at_high_water)
+                chunk = chunk.drop(index=at_high_water).reset_index(drop=True)
+            self.update(chunk)
+            added += len(chunk)
+        return added
+
+    def _update_emojis(self, person_emojis):
+        for name, counter in person_emojis.items():
+            self.person_emojis.setdefault(name, Counter()).update(counter)
+
+    def _update_words(self, counts):
+        self.word_counter.update(counts)
+
+    def _update_persons(self, chunk):
+        frame = pd.DataFrame({
+            'name': chunk['name'],
+            'message': chunk['message'],
+            'datetime': chunk['datetime'],
+            'length': chunk['message'].str.len(),
+        })
+        grouped = frame.groupby('name', sort=False).agg(
+            rows=('datetime', 'size'),
+            messages=('message', 'count'),
+            first=('datetime', 'min'),
+            last=('datetime', 'max'),
+            length_sum=('length', 'sum'),
+            length_count=('length', 'count'),
+        )
+        for name, row in grouped.iterrows():
+            acc = self.persons.get(name)
+            if acc is None:
+                self.persons[name] = row.to_dict()
+                continue
+            for key in ('rows', 'messages', 'length_sum', 'length_count'):
+                acc[key] += row[key]
+            acc['last'] = row['last']
+
+    def _update_replies(self, names, time_diff, name_changed):
+        mask = (name_changed & (time_diff <= timedelta(seconds=_REPLY_MAX_SECONDS))).to_numpy(dtype=bool)
+        if not mask.any():
+            return
+        seconds = time_diff[mask].to_numpy().astype('timedelta64[s]').astype(np.int64)
+        for name, secs in pd.Series(seconds, index=names[mask].to_numpy()).groupby(level=0):
+            self.reply_hists.setdefault(name, self._new_reply_accumulator()).update(secs.to_numpy())
+
+    def _new_reply_accumulator(self):
+        """单个发送者的回复时间累加器（子类可替换为草图）"""
+        return ReplyHistogram()
+
+    def _update_sessions(self, chunk, time_diff, name_changed):
+        n = len(chunk)
+        session_break = ((time_diff > self.session_gap) | time_diff.isna()).to_numpy(dtype=bool)
+        name_change = (name_changed.to_numpy(dtype=bool) | session_break).astype(np.int64)
+
+        # 按对话切成片段；若本批第一条消息没有断开，第一个片段延续上一批未结束的对话
+        seg_starts = np.flatnonzero(session_break)
+        continues = len(seg_starts) == 0 or seg_starts[0] != 0
+        if continues:
+            seg_starts = np.concatenate(([0], seg_starts))
+        seg_ends = np.append(seg_starts[1:], n)
+        seg_messages = seg_ends - seg_starts
+        seg_rounds = np.add.reduceat(name_change, seg_starts)
+        times = chunk['datetime'].to_numpy()
+        seg_ids = np.repeat(np.arange(len(seg_starts)), seg_messages)
+        seg_initiators = chunk['name'].groupby(seg_ids).first().reindex(range(len(seg_starts)))
+
+        segments = []
+        for i in range(len(seg_starts)):
+            segments.append({
+                'messages': int(seg_messages[i]),
+                'rounds': int(seg_rounds[i]),
+                'start': times[seg_starts[i]],
+                'last': times[seg_ends[i] - 1],
+                'initiator': seg_initiators.iloc[i],
+            })
+
+        if continues and self.open_session is not None:
+            first = segments.pop(0)
+            self.open_session['messages'] += first['messages']
+            self.open_session['rounds'] += first['rounds']
+            self.open_session['last'] = first['last']
+            if pd.isna(self.open_session['initiator']):
+                self.open_session['initiator'] = first['initiator']
+
+        for segment in segments:
+            if self.open_session is not None:
+                self._close_session(self.open_session)
+            self.session_count += 1
+            segment['session_id'] = self.session_count
+            self.open_session = segment
+
+    def _close_session(self, session):
+        if session['messages'] >= 2:
+            self.sessions['session_id'].append(session['session_id'])
+            self.sessions['rounds'].append(session['rounds'])
+            self.sessions['messages'].append(session['messages'])
+            self.sessions['duration'].append((session['last'] - session['start']) / np.timedelta64(1, 's') / 60)
+
+        initiator = session['initiator']
+        if not pd.isna(initiator):
+            self.init_counts[initiator] += 1
+        if not pd.isna(initiator) and initiator == self.streak_name:
+            self.streak_len += 1
+        else:
+            self.streak_name, self.streak_len = initiator, 1
+        self.max_streak = max(self.max_streak, self.streak_len)
+
+    def _session_results(self):
+        """把进行中的对话视为已结束后的对话统计（不修改累加器，之后仍可继续 update）"""
+        sessions = {key: array(values.typecode, values) for key, values in self.sessions.items()}
+        init_counts = Counter(self.init_counts)
+        max_streak = self.max_streak
+        session = self.open_session
+        if session is not None:
+            if session['messages'] >= 2:
+                sessions['session_id'].append(session['session_id'])
+                sessions['rounds'].append(session['rounds'])
+                sessions['messages'].append(session['messages'])
+                sessions['duration'].append((session['last'] - session['start']) / np.timedelta64(1, 's') / 60)
+            initiator = session['initiator']
+            if not pd.isna(initiator):
+                init_counts[initiator] += 1
+            streak = self.streak_len + 1 if not pd.isna(initiator) and initiator == self.streak_name else 1
+            max_streak = max(max_streak, streak)
+
+        session_df = pd.DataFrame({
+            'session_id': np.asarray(sessions['session_id'], dtype=np.int64),
+            'rounds': np.asarray(sessions['rounds'], dtype=np.int64),
+            'messages': np.asarray(sessions['messages'], dtype=np.int64),
+            'duration': np.asarray(sessions['duration'], dtype=np.float64),
+        })
+        return session_df, init_counts, max_streak
+
+    def _reply_stats(self):
+        names = sorted(name for name, hist in self.reply_hists.items() if hist.count > 0)
+        if not names:
+            return None
+        hists = [self.reply_hists[name] for name in names]
+        counts = np.array([hist.count for hist in hists])
+
+        def order_stat(k):
+            # 每人排序后第 k 个（从 0 开始）回复时间
+            return np.array([hist.order_stat(kk) for hist, kk in zip(hists, k)])
+
+        def quantile(q):
+            pos = q * (counts - 1)
+            lo = np.floor(pos).astype(np.int64)
+            hi = np.minimum(lo + 1, counts - 1)
+            low_vals = order_stat(lo)
+            return low_vals + (order_stat(hi) - low_vals) * (pos - lo)
+
+        return _reply_stats_frame(
+            pd.Index(names, name='name'), counts,
+            total_seconds=np.array([hist.total for hist in hists], dtype=np.float64),
+            quantile=quantile,
+            over=lambda t: np.array([hist.over(t) for hist in hists]),
+            fastest=[hist.fastest for hist in hists],
+        )
+
+    def _folded(self, top_k):
+        """
+        群聊模式：返回 (合并后的浅拷贝, 发送者 -> 分组名 的映射函数)。
+        top_k 之外发送者的计数、回复直方图、表情和情绪累加器直接相加，合并为一组（名称见 _others_label）；
+        人数不超过 top_k 时返回 (self, None)。累加器本身不变，之后仍可继续 update。
+        """
+        if top_k is None or len(self.persons) <= top_k:
+            return self, None
+        top = set(_top_senders({name: acc['rows'] for name, acc in self.persons.items()}, top_k))
+        others = _others_label(self.persons, top_k)
+
+        def label(name):
+            return name if name in top else others
+
+        folded = copy.copy(self)
+        folded.persons = {}
+        for name, acc in self.persons.items():
+            merged = folded.persons.get(label(name))
+            if merged is None:
+                folded.persons[label(name)] = dict(acc)
+                continue
+            for key in ('rows', 'messages', 'length_sum', 'length_count'):
+                merged[key] += acc[key]
+            merged['first'] = min(merged['first'], acc['first'])
+            merged['last'] = max(merged['last'], acc['last'])
+
+        folded.reply_hists = {}
+        for name, hist in self.reply_hists.items():
+            key = label(name)
+            folded.reply_hists[key] = folded.reply_hists[key] + hist if key in folded.reply_hists else hist.copy()
+
+        folded.person_emojis = {}
+        for name, counter in self.person_emojis.items():
+            folded.person_emojis.setdefault(label(name), Counter()).update(counter)
+
+        folded.person_emotions = {}
+        for name, emotions in self.person_emotions.items():
+            acc = folded.person_emotions.setdefault(label(name), dict.fromkeys(EMOTION_KEYWORDS, 0))
+            for emotion, count in emotions.items():
+                acc[emotion] += count
+        return folded, label
+
+    def results(self, top_k=None):
+        """
+        汇总并打印报告，返回值与内存模式各分析函数的返回值对应。
+        top_k 为群聊模式的保留人数（见 fold_senders），合并只作用于本次输出。
+        """
+        src, label = self._folded(top_k)
+        names = list(src.persons)
+
+        # 基础统计
+        total_days = len(self.date_counts)
+        date_range = f"{self.first_dt.strftime('%Y-%m-%d')} 至 {self.last_dt.strftime('%Y-%m-%d')}"
+        person_stats = pd.DataFrame(
+            [[acc['messages'], (acc['last'] - acc['first']).days] for acc in
+             (src.persons[name] for name in sorted(names))],
+            index=pd.Index(sorted(names), name='name'), columns=['消息数', '跨越天数'],
+        )
+        person_stats['占比'] = (person_stats['消息数'] / self.total_messages * 100).round(2)
+        person_stats['平均消息长度'] = pd.Series(
+            {name: src.persons[name]['length_sum'] / src.persons[name]['length_count']
+             if src.persons[name]['length_count'] else np.nan for name in sorted(names)}
+        ).round(2)
+        _print_basic_statistics(date_range, self.total_messages, total_days, person_stats)
+
+        # 时间分布
+        def dist(hist, name):
+            idx = np.flatnonzero(hist)
+            return pd.Series(hist[idx], index=pd.Index(idx, name=name), name='count')
+
+        hour_dist = dist(self.hour_hist, 'hour')
+        weekday_dist = dist(self.weekday_hist, 'weekday')
+        month_dist = dist(self.month_hist, 'month')
+        daily_count = pd.Series(self.date_counts).sort_index()
+        _print_time_analysis(hour_dist, weekday_dist, month_dist, daily_count)
+
+        # 互动
+        reply_stats = src._reply_stats()
+        session_df, init_counts, max_streak = self._session_results()
+        if label is not None:
+            folded_counts = Counter()
+            for name, count in init_counts.items():
+                folded_counts[label(name)] += count
+            init_counts = folded_counts
+        initiation_stats = _initiation_stats(pd.Series(init_counts, dtype=np.int64), names)
+        person_emojis = {name: src.person_emojis.get(name, Counter()) for name in names}
+        all_emojis = sum(person_emojis.values(), Counter())
+        _print_interaction_analysis(reply_stats, session_df, initiation_stats, max_streak,
+                                    all_emojis, person_emojis)
+
+        # 内容
+        topic_stats = {topic: count for topic, count in self.topic_totals.items() if count > 0}
+        topic_stats = dict(sorted(topic_stats.items(), key=lambda x: x[1], reverse=True))
+        person_emotions = {name: src.person_emotions.get(name, dict.fromkeys(EMOTION_KEYWORDS, 0))
+                           for name in names}
+        emotion_stats = {emotion: sum(person_emotions[name][emotion] for name in names)
+                         for emotion in EMOTION_KEYWORDS}
+        emotion_stats = dict(sorted(emotion_stats.items(), key=lambda x: x[1], reverse=True))
+        _print_content_analysis(self.word_counter, topic_stats, emotion_stats, person_emotions)
+
+        person_counts = pd.Series({name: src.persons[name]['rows'] for name in names},
+                                  name='count').sort_values(ascending=False, kind='stable')
+        return {
+            'overview': {'date_range': date_range, 'total_messages': self.total_messages,
+                         'total_days': total_days},
+            'person_stats': person_stats,
+            'person_counts': person_counts,
+            'hour_dist': hour_dist,
+            'weekday_dist': weekday_dist,
+            'month_dist': month_dist,
+            'reply_stats': reply_stats,
+            'session_df': session_df,
+            'initiation_stats': initiation_stats,
+            'all_emojis': all_emojis,
+            'word_counter': self.word_counter,
+            'topic_stats': topic_stats,
+            'emotion_stats': emotion_stats,
+            'person_emotions': person_emotions,
+        }
+
+
+class ApproxStreamingAnalyzer(StreamingAnalyzer):
+    """
+    近似流式分析器：回复时间分位数改用 KLL 草图，词频和每人表情改用 Count-Min + top-K，
+    内存与词表大小、回复次数无关；次数、均值、最快回复和慢回复占比仍然精确。
+    报告末尾会写明误差上限，返回值中的 error_bounds 为同样的内容。
+    """
+
+    WORD_CAPACITY = 500  # 保留的高频词候选数（报告 TOP 20、词云 100 词）
+    EMOJI_CAPACITY = 20  # 每人保留的表情候选数（报告 TOP 5）
+
+    def __init__(self, session_gap_minutes=None, epsilon=None, delta=None, k=None):
+        super().__init__(session_gap_minutes)
+        self.epsilon = SKETCH_EPSILON if epsilon is None else epsilon
+        self.delta = SKETCH_DELTA if delta is None else delta
+        self.k = SKETCH_K if k is None else k
+        self.words = HeavyHitters(self.WORD_CAPACITY, self.epsilon, self.delta)
+        # 草图中的键为 “发送者\0表情”，每人一张候选表共用同一个草图
+        self.emojis = HeavyHitters(self.EMOJI_CAPACITY, self.epsilon, self.delta)
+
+    def _update_emojis(self, person_emojis):
+        keys, counts = [], []
+        for name, counter in person_emojis.items():
+            for emoji, count in counter.items():
+                keys.append(f"{name}\0{emoji}")
+                counts.append(count)
+        if not keys:
+            return
+        self.emojis.sketch.add(keys, counts)
+        for name, counter in person_emojis.items():
+            self.person_emojis[name] = self.emojis.select(self.person_emojis.get(name, Counter()),
+                                                         list(counter), f"{name}\0")
+
+    def _update_words(self, counts):
+        self.words.update(counts)
+        self.word_counter = self.words.top
+
+    def _new_reply_accumulator(self):
+        return ReplySketch(self.k)
+
+    def _reply_stats(self):
+        names = sorted(name for name, acc in self.reply_hists.items() if acc.count > 0)
+        if not names:
+            return None
+        accs = [self.reply_hists[name] for name in names]
+        return _reply_stats_frame(
+            pd.Index(names, name='name'), np.array([acc.count for acc in accs]),
+            total_seconds=np.array([acc.total for acc in accs], dtype=np.float64),
+            quantile=lambda q: np.array([acc.kll.quantile(q) for acc in accs]),
+            over=lambda t: np.array([acc.over[t] for acc in accs]),
+            fastest=[acc.fastest for acc in accs],
+        )
+
+    def error_bounds(self):
+        return {
+            'confidence': 1 - self.delta,
+            'reply_quantile_rank_error': KLLSketch(self.k).rank_error,
+            'word_error': self.words.sketch.error,
+            'word_total': self.words.sketch.total,
+            'emoji_error': self.emojis.sketch.error,
+            'emoji_total': self.emojis.sketch.total,
+        }
+
+    def results(self, top_k=None):
+        res = super().results(top_k)
+        bounds = self.error_bounds()
+        print(f"\n{'=' * 60}")
+        print("📐 近似模式误差说明")
+        print(f"{'=' * 60}")
+        print(f"回复时间中位数/P90/P95: KLL 草图（k={self.k}），秩误差约 ±{bounds['reply_quantile_rank_error']:.2%}"
+              f"（99% 置信度）；次数、平均、最快和慢回复占比为精确值")
+        print(f"高频词次数: Count-Min 估计值，只会偏大，偏差 ≤ {bounds['word_error']:.0f} 次"
+              f"（ε={self.epsilon} × {bounds['word_total']} 个词，置信度 {bounds['confidence']:.0%}）")
+        print(f"每人表情次数: 同上，偏差 ≤ {bounds['emoji_error']:.0f} 次"
+              f"（ε={self.epsilon} × {bounds['emoji_total']} 个表情）；"
+              f"总榜为各人候选表（每人 {self.EMOJI_CAPACITY} 个）之和，靠后的表情可能偏小")
+        res['error_bounds'] = bounds
+        return res
+
+
+WORDCLOUD_MAX_WORDS = 100
+WORDCLOUD_VERSION = 1  # 词云参数或样式变化时加一，使旧的缓存图片失效
+
+
+def _wordcloud_cache_path(word_counter, font_path, period):
+    """
+    词云缓存图片路径：以年份、字体和前 WORDCLOUD_MAX_WORDS 个词的频次为键，
+    排名和次数都没变时直接复用上次的图片。关闭缓存（CACHE_DIR 为 None）时返回 None。
+    """
+    if not CACHE_DIR:
         return None
+    # 与 WordCloud.generate_from_frequencies 相同的取词方式：按频次降序稳定排序后取前 N 个
+    top = sorted(word_counter.items(), key=lambda item: item[1], reverse=True)[:WORDCLOUD_MAX_WORDS]
+    key = json.dumps([WORDCLOUD_VERSION, period, font_path, top], ensure_ascii=False)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"wordcloud-{period}-{digest}.png")
 
-    # Mac系统常见中文字体路径列表
-    font_paths = [
-        '/System/Library/Fonts/STHeiti Light.ttc',
-        '/System/Library/Fonts/STHeiti Medium.ttc',
-        '/System/Library/Fonts/Supplemental/Arial Unicode.ttf',
-        '/Library/Fonts/Arial Unicode.ttf',
-        '/System/Library/Fonts/PingFang.ttc',
-    ]
 
-    # 尝试找到可用的字体
-    font_path = None
-    for path in font_paths:
-        import os
-        if os.path.exists(path):
-            font_path = path
-            break
+def generate_wordcloud(word_counter, period=None):
+    """生成词云图（词频排名不变时复用缓存的图片）；period 为年份或查询标签，默认为 ANALYSIS_YEAR"""
+    if not word_counter:
+        return None
+    if period is None:
+        period = ANALYSIS_YEAR
 
+    font_path = cjk_font_path()
     if font_path is None:
         print("⚠️  未找到中文字体，词云可能无法显示中文")
-        font_path = None  # 使用默认字体
+
+    filename = f'wordcloud_{period}.png'
+    cache_path = _wordcloud_cache_path(word_counter, font_path, period)
+    if cache_path and os.path.exists(cache_path):
+        shutil.copyfile(cache_path, filename)
+        print(f"☁️  词云图已保存（词频排名未变，沿用缓存）")
+        return
+
+    from wordcloud import WordCloud
+    plt = _pyplot()
 
     try:
         wordcloud = WordCloud(
@@ -490,7 +2066,7 @@ def generate_wordcloud(word_counter):
             height=600,
             background_color='white',
             colormap='viridis',
-            max_words=100,
+            max_words=WORDCLOUD_MAX_WORDS,
             relative_scaling=0.5,
             min_font_size=10
         ).generate_from_frequencies(word_counter)
@@ -498,27 +2074,51 @@ def generate_wordcloud(word_counter):
         plt.figure(figsize=(15, 7.5))
         plt.imshow(wordcloud, interpolation='bilinear')
         plt.axis('off')
-        plt.title(f'{ANALYSIS_YEAR}年度聊天词云', fontsize=20, fontweight='bold', pad=20)
+        plt.title(f'{_period_title(period)}聊天词云', fontsize=20, fontweight='bold', pad=20)
         plt.tight_layout(pad=0)
-        plt.savefig(f'wordcloud_{ANALYSIS_YEAR}.png', dpi=300, bbox_inches='tight', facecolor='white')
+        plt.savefig(filename, dpi=300, bbox_inches='tight', facecolor='white')
         print(f"☁️  词云图已保存")
         plt.close()
+
+        if cache_path:
+            # 同一年份只保留最新的一张缓存图片
+            stale_prefix = f"wordcloud-{period}-"
+            for name in os.listdir(CACHE_DIR):
+                if name.startswith(stale_prefix) and name.endswith('.png'):
+                    os.remove(os.path.join(CACHE_DIR, name))
+            tmp_path = cache_path + '.tmp'
+            shutil.copyfile(filename, tmp_path)
+            os.replace(tmp_path, cache_path)
     except Exception as e:
         print(f"⚠️  词云生成失败: {e}")
         print("    继续生成其他报告...")
 
 
-def create_visualizations(df, hour_dist, weekday_dist, month_dist, reply_stats, session_df, continuous_stats):
-    """生成可视化图表"""
+def _sender_colors(n):
+    """发送者配色：前两人沿用原来的红/青，人多（群聊模式）时依次取 tab20 调色板"""
+    colors = ['#FF6B6B', '#4ECDC4']
+    if n > len(colors):
+        from matplotlib import colormaps
+        from matplotlib.colors import to_hex
+        palette = colormaps['tab20']
+        colors += [to_hex(palette(i % palette.N)) for i in range(n - len(colors))]
+    return colors[:n]
+
+
+def create_visualizations(person_counts, hour_dist, weekday_dist, month_dist, reply_stats, session_df, continuous_stats,
+                          period=None):
+    """生成可视化图表；period 为年份或查询标签，默认为 ANALYSIS_YEAR"""
+    if period is None:
+        period = ANALYSIS_YEAR
+    plt = _pyplot()
     fig = plt.figure(figsize=(18, 12))
     import matplotlib.gridspec as gridspec
     gs = gridspec.GridSpec(3, 3, figure=fig, hspace=0.3, wspace=0.3)
 
-    fig.suptitle(f'{ANALYSIS_YEAR}年度聊天数据可视化报告', fontsize=18, fontweight='bold')
+    fig.suptitle(f'{_period_title(period)}聊天数据可视化报告', fontsize=18, fontweight='bold')
 
     ax1 = fig.add_subplot(gs[0, 0])
-    person_counts = df['name'].value_counts()
-    colors = ['#FF6B6B', '#4ECDC4']
+    colors = _sender_colors(len(person_counts))
     ax1.pie(person_counts.values, labels=person_counts.index, autopct='%1.1f%%',
             startangle=90, colors=colors)
     ax1.set_title('消息数量占比', fontweight='bold')
@@ -557,7 +2157,7 @@ def create_visualizations(df, hour_dist, weekday_dist, month_dist, reply_stats,
         ax5 = fig.add_subplot(gs[1, 2])
         names = reply_stats.index
         avg_times = reply_stats['平均回复时间']
-        bars = ax5.barh(names, avg_times, color=['#FF6B6B', '#4ECDC4'])
+        bars = ax5.barh(names, avg_times, color=_sender_colors(len(names)))
         ax5.set_xlabel('平均回复时间 (分钟)')
         ax5.set_title('回复速度对比', fontweight='bold')
         ax5.grid(axis='x', alpha=0.3)
@@ -579,10 +2179,12 @@ def create_visualizations(df, hour_dist, weekday_dist, month_dist, reply_stats,
         ax7 = fig.add_subplot(gs[2, 1])
         names = list(continuous_stats.keys())
         init_counts = [continuous_stats[name]['init_count'] for name in names]  # 注意：你上面 return 的 dict 变量名如果改了，这里也跟着改
-        bars = ax7.bar(names, init_counts, color=['#FF6B6B', '#4ECDC4'], alpha=0.7)
+        bars = ax7.bar(names, init_counts, color=_sender_colors(len(names)), alpha=0.7)
         ax7.set_ylabel('发起次数')
         ax7.set_title('话题主导性对比', fontweight='bold')
         ax7.grid(axis='y', alpha=0.3)
+        if len(names) > 4:
+            ax7.tick_params(axis='x', labelrotation=45)
         for bar, val in zip(bars, init_counts):
             height = bar.get_height()
             ax7.text(bar.get_x() + bar.get_width() / 2., height,
@@ -592,147 +2194,68 @@ def create_visualizations(df, hour_dist, weekday_dist, month_dist, reply_stats,
         ax8 = fig.add_subplot(gs[2, 2])
         duration_data = session_df[session_df['duration'] <= 120]['duration']
         ax8.hist(duration_data, bins=30, color='#F39C12', alpha=0.7, edgecolor='black')
-        ax8.set_xlabel('对话时长 (分钟)')
-        ax8.set_ylabel('频次')
-        ax8.set_title('单次对话时长分布', fontweight='bold')
-        ax8.axvline(duration_data.mean(), color='red', linestyle='--',
-                    linewidth=2, label=f'平均: {duration_data.mean():.1f}分')
-        ax8.legend()
-        ax8.grid(axis='y', alpha=0.3)
-
-    plt.savefig(f'chat_analysis_{ANALYSIS_YEAR}.png', dpi=300, bbox_inches='tight')
-    print(f"📊 数据图表已保存")
-    plt.close()
-
-
-def generate_html_report(df, person_stats, game_stats, topic_stats, emotion_stats, person_emotions, word_counter):
-    """生成HTML报告"""
-
-    total_messages = len(df)
-    total_days = df['date'].nunique()
-    date_range = f"{df['datetime'].min().strftime('%Y-%m-%d')} 至 {df['datetime'].max().strftime('%Y-%m-%d')}"
-
-    # 生成词频表格
-    word_table_rows = ""
-    for i, (word, count) in enumerate(word_counter.most_common(20), 1):
-        word_table_rows += f"<tr><td>{i}</td><td>{word}</td><td>{count}</td></tr>\n"
-
-    # 生成游戏统计
-    game_rows = ""
-    if game_stats:
-        total_game = sum(game_stats.values())
-        for game, count in game_stats.items():
-            percentage = count / total_game * 100
-            game_rows += f"<tr><td>{game}</td><td>{count}</td><td>{percentage:.1f}%</td></tr>\n"
-    else:
-        game_rows = '<tr><td colspan="3" style="text-align:center; color:#999;">未检测到游戏相关话题</td></tr>'
-
-    # 生成话题统计
-    topic_rows = ""
-    if topic_stats:
-        total_topic = sum(topic_stats.values())
-        for topic, count in topic_stats.items():
-            percentage = count / total_topic * 100
-            bar_width = percentage
-            topic_rows += f"""
-            <tr>
-                <td>{topic}</td>
-                <td>{count}</td>
-                <td>
-                    <div class="progress-bar">
-                        <div class="progress-fill" style="width: {bar_width}%"></div>
-                        <span class="progress-text">{percentage:.1f}%</span>
-                    </div>
-                </td>
-            </tr>"""
-
-    # 生成情绪统计
-    emotion_rows = ""
-    if emotion_stats:
-        total_emotion = sum(emotion_stats.values())
-        emotion_colors = {
-            '开心': '#FFD93D', '难过': '#6BCB77', '生气': '#FF6B6B',
-            '惊讶': '#4D96FF', '疑惑': '#9D84B7', '无奈': '#95B8D1'
-        }
-        for emotion, count in emotion_stats.items():
-            percentage = count / total_emotion * 100
-            color = emotion_colors.get(emotion, '#999')
-            emotion_rows += f"""
-            <tr>
-                <td><span class="emotion-tag" style="background-color: {color}">{emotion}</span></td>
-                <td>{count}</td>
-                <td>{percentage:.1f}%</td>
-            </tr>"""
+        ax8.set_xlabel('对话时长 (分钟)')
+        ax8.set_ylabel('频次')
+        ax8.set_title('单次对话时长分布', fontweight='bold')
+        ax8.axvline(duration_data.mean(), color='red', linestyle='--',
+                    linewidth=2, label=f'平均: {duration_data.mean():.1f}分')
+        ax8.legend()
+        ax8.grid(axis='y', alpha=0.3)
 
-    # 个人统计卡片
-    person_cards = ""
-    for name, row in person_stats.iterrows():
-        person_cards += f"""
-        <div class="person-card">
-            <h3>{name}</h3>
-            <div class="stat-item">
-                <span class="stat-label">发送消息</span>
-                <span class="stat-value">{int(row['消息数'])} 条</span>
-            </div>
-            <div class="stat-item">
-                <span class="stat-label">占比</span>
-                <span class="stat-value">{row['占比']}%</span>
-            </div>
-            <div class="stat-item">
-                <span class="stat-label">平均长度</span>
-                <span class="stat-value">{row['平均消息长度']:.1f} 字</span>
-            </div>
-        </div>"""
+    plt.savefig(f'chat_analysis_{period}.png', dpi=300, bbox_inches='tight')
+    print(f"📊 数据图表已保存")
+    plt.close()
 
-    # 完整HTML内容
-    html_content = f"""<!DOCTYPE html>
+
+# HTML 报告模板：{{槽位}} 在写入时替换为字符串或逐段生成的字符串序列，模板只在导入时切分一次
+_HTML_REPORT_TEMPLATE = """<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{ANALYSIS_YEAR}年度聊天分析报告</title>
+    <title>{{period}}聊天分析报告</title>
     <style>
-        * {{
+        * {
             margin: 0;
             padding: 0;
             box-sizing: border-box;
-        }}
-        body {{
+        }
+        body {
             font-family: 'PingFang SC', -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
             padding: 20px;
             line-height: 1.6;
-        }}
-        .container {{
+        }
+        .container {
             max-width: 1200px;
             margin: 0 auto;
             background: white;
             border-radius: 20px;
             box-shadow: 0 20px 60px rgba(0,0,0,0.3);
             overflow: hidden;
-        }}
-        .header {{
+        }
+        .header {
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
             color: white;
             padding: 50px 40px;
             text-align: center;
-        }}
-        .header h1 {{
+        }
+        .header h1 {
             font-size: 2.5em;
             margin-bottom: 10px;
             font-weight: 700;
-        }}
-        .header p {{
+        }
+        .header p {
             font-size: 1.2em;
             opacity: 0.9;
-        }}
-        .content {{
+        }
+        .content {
             padding: 40px;
-        }}
-        .section {{
+        }
+        .section {
             margin-bottom: 50px;
-        }}
-        .section-title {{
+        }
+        .section-title {
             font-size: 1.8em;
             color: #333;
             margin-bottom: 25px;
@@ -740,111 +2263,111 @@ def generate_html_report(df, person_stats, game_stats, topic_stats, emotion_stat
             border-bottom: 3px solid #667eea;
             display: flex;
             align-items: center;
-        }}
-        .section-title::before {{
+        }
+        .section-title::before {
             content: '';
             width: 5px;
             height: 30px;
             background: #667eea;
             margin-right: 15px;
             border-radius: 3px;
-        }}
-        .stats-grid {{
+        }
+        .stats-grid {
             display: grid;
             grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
             gap: 20px;
             margin-bottom: 30px;
-        }}
-        .stat-card {{
+        }
+        .stat-card {
             background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
             padding: 25px;
             border-radius: 15px;
             box-shadow: 0 5px 15px rgba(0,0,0,0.1);
             transition: transform 0.3s;
-        }}
-        .stat-card:hover {{
+        }
+        .stat-card:hover {
             transform: translateY(-5px);
-        }}
-        .stat-card h3 {{
+        }
+        .stat-card h3 {
             font-size: 0.9em;
             color: #666;
             margin-bottom: 10px;
-        }}
-        .stat-card .value {{
+        }
+        .stat-card .value {
             font-size: 2em;
             color: #667eea;
             font-weight: bold;
-        }}
-        .person-grid {{
+        }
+        .person-grid {
             display: grid;
             grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
             gap: 20px;
-        }}
-        .person-card {{
+        }
+        .person-card {
             background: white;
             border: 2px solid #e0e0e0;
             border-radius: 15px;
             padding: 25px;
             box-shadow: 0 5px 15px rgba(0,0,0,0.08);
-        }}
-        .person-card h3 {{
+        }
+        .person-card h3 {
             color: #667eea;
             font-size: 1.5em;
             margin-bottom: 20px;
-        }}
-        .stat-item {{
+        }
+        .stat-item {
             display: flex;
             justify-content: space-between;
             padding: 10px 0;
             border-bottom: 1px solid #f0f0f0;
-        }}
-        .stat-item:last-child {{
+        }
+        .stat-item:last-child {
             border-bottom: none;
-        }}
-        .stat-label {{
+        }
+        .stat-label {
             color: #666;
-        }}
-        .stat-value {{
+        }
+        .stat-value {
             color: #333;
             font-weight: bold;
-        }}
-        table {{
+        }
+        table {
             width: 100%;
             border-collapse: collapse;
             background: white;
             border-radius: 10px;
             overflow: hidden;
             box-shadow: 0 5px 15px rgba(0,0,0,0.08);
-        }}
-        th, td {{
+        }
+        th, td {
             padding: 15px;
             text-align: left;
-        }}
-        th {{
+        }
+        th {
             background: #667eea;
             color: white;
             font-weight: 600;
-        }}
-        tr:nth-child(even) {{
+        }
+        tr:nth-child(even) {
             background: #f8f9fa;
-        }}
-        tr:hover {{
+        }
+        tr:hover {
             background: #e8f4f8;
-        }}
-        .progress-bar {{
+        }
+        .progress-bar {
             width: 100%;
             height: 25px;
             background: #e0e0e0;
             border-radius: 12px;
             overflow: hidden;
             position: relative;
-        }}
-        .progress-fill {{
+        }
+        .progress-fill {
             height: 100%;
             background: linear-gradient(90deg, #667eea 0%, #764ba2 100%);
             transition: width 0.5s ease;
-        }}
-        .progress-text {{
+        }
+        .progress-text {
             position: absolute;
             right: 10px;
             top: 50%;
@@ -852,39 +2375,59 @@ def generate_html_report(df, person_stats, game_stats, topic_stats, emotion_stat
             color: #333;
             font-weight: bold;
             font-size: 0.9em;
-        }}
-        .emotion-tag {{
+        }
+        .emotion-tag {
             display: inline-block;
             padding: 5px 15px;
             border-radius: 20px;
             color: white;
             font-weight: bold;
-        }}
-        .image-container {{
+        }
+        .image-container {
             text-align: center;
             margin: 30px 0;
             background: #f8f9fa;
             padding: 20px;
             border-radius: 15px;
-        }}
-        .image-container img {{
+        }
+        .image-container img {
             max-width: 100%;
             border-radius: 10px;
             box-shadow: 0 5px 20px rgba(0,0,0,0.15);
-        }}
-        .footer {{
+        }
+        .pager {
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            gap: 15px;
+            margin-top: 15px;
+            color: #666;
+        }
+        .pager button {
+            border: none;
+            background: #667eea;
+            color: white;
+            padding: 6px 16px;
+            border-radius: 15px;
+            cursor: pointer;
+        }
+        .pager button:disabled {
+            background: #c3cfe2;
+            cursor: default;
+        }
+        .footer {
             background: #f8f9fa;
             padding: 30px;
             text-align: center;
             color: #666;
             font-size: 0.9em;
-        }}
+        }
     </style>
 </head>
 <body>
     <div class="container">
         <div class="header">
-            <h1>📊 {ANALYSIS_YEAR}年度聊天分析报告</h1>
+            <h1>📊 {{period}}聊天分析报告</h1>
             <p>深度解析你们的聊天数据</p>
         </div>
 
@@ -895,19 +2438,19 @@ def generate_html_report(df, person_stats, game_stats, topic_stats, emotion_stat
                 <div class="stats-grid">
                     <div class="stat-card">
                         <h3>统计时间段</h3>
-                        <div class="value" style="font-size: 1.2em;">{date_range}</div>
+                        <div class="value" style="font-size: 1.2em;">{{date_range}}</div>
                     </div>
                     <div class="stat-card">
                         <h3>总消息数</h3>
-                        <div class="value">{total_messages:,}</div>
+                        <div class="value">{{total_messages}}</div>
                     </div>
                     <div class="stat-card">
                         <h3>聊天天数</h3>
-                        <div class="value">{total_days}</div>
+                        <div class="value">{{total_days}}</div>
                     </div>
                     <div class="stat-card">
                         <h3>日均消息</h3>
-                        <div class="value">{total_messages / total_days:.1f}</div>
+                        <div class="value">{{daily_messages}}</div>
                     </div>
                 </div>
             </div>
@@ -916,32 +2459,22 @@ def generate_html_report(df, person_stats, game_stats, topic_stats, emotion_stat
             <div class="section">
                 <h2 class="section-title">👥 个人数据</h2>
                 <div class="person-grid">
-                    {person_cards}
+                    {{person_cards}}
                 </div>
+                {{person_table}}
             </div>
 
             <!-- 高频词 -->
             <div class="section">
-                <h2 class="section-title">💬 高频词 TOP 20</h2>
-                <table>
-                    <thead>
-                        <tr>
-                            <th>排名</th>
-                            <th>词语</th>
-                            <th>出现次数</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                        {word_table_rows}
-                    </tbody>
-                </table>
+                <h2 class="section-title">💬 高频词</h2>
+                {{word_table}}
             </div>
 
             <!-- 词云图 -->
             <div class="section">
                 <h2 class="section-title">☁️ 词云图</h2>
                 <div class="image-container">
-                    <img src="wordcloud_{ANALYSIS_YEAR}.png" alt="词云图">
+                    {{wordcloud_img}}
                 </div>
             </div>
 
@@ -957,7 +2490,7 @@ def generate_html_report(df, person_stats, game_stats, topic_stats, emotion_stat
                         </tr>
                     </thead>
                     <tbody>
-                        {game_rows}
+                        {{game_rows}}
                     </tbody>
                 </table>
             </div>
@@ -974,7 +2507,7 @@ def generate_html_report(df, person_stats, game_stats, topic_stats, emotion_stat
                         </tr>
                     </thead>
                     <tbody>
-                        {topic_rows}
+                        {{topic_rows}}
                     </tbody>
                 </table>
             </div>
@@ -991,7 +2524,7 @@ def generate_html_report(df, person_stats, game_stats, topic_stats, emotion_stat
                         </tr>
                     </thead>
                     <tbody>
-                        {emotion_rows}
+                        {{emotion_rows}}
                     </tbody>
                 </table>
             </div>
@@ -1000,46 +2533,347 @@ def generate_html_report(df, person_stats, game_stats, topic_stats, emotion_stat
             <div class="section">
                 <h2 class="section-title">📊 数据可视化</h2>
                 <div class="image-container">
-                    <img src="chat_analysis_{ANALYSIS_YEAR}.png" alt="数据可视化图表">
+                    {{chart_img}}
                 </div>
             </div>
         </div>
 
         <div class="footer">
-            <p>🎉 报告生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
+            <p>🎉 报告生成时间: {{generated_at}}</p>
             <p>💝 珍惜每一次对话，记录美好时光</p>
         </div>
     </div>
+    <script>
+        // 分页表格：第一页直接写在 HTML 中，其余页在翻页时从内嵌的 JSON 数据生成
+        document.querySelectorAll('table[data-pages]').forEach(function (table) {
+            var rows = JSON.parse(document.getElementById(table.dataset.pages).textContent);
+            var size = parseInt(table.dataset.pageSize, 10);
+            var total = Math.max(1, Math.ceil(rows.length / size));
+            var pager = table.nextElementSibling;
+            var label = pager.querySelector('span');
+            var buttons = pager.querySelectorAll('button');
+            var page = 0;
+            function show(p) {
+                page = Math.min(Math.max(p, 0), total - 1);
+                var body = document.createElement('tbody');
+                rows.slice(page * size, (page + 1) * size).forEach(function (row) {
+                    var tr = body.insertRow();
+                    row.forEach(function (cell) { tr.insertCell().textContent = cell; });
+                });
+                table.replaceChild(body, table.tBodies[0]);
+                label.textContent = '第 ' + (page + 1) + ' / ' + total + ' 页';
+                buttons[0].disabled = page === 0;
+                buttons[1].disabled = page === total - 1;
+            }
+            buttons[0].onclick = function () { show(page - 1); };
+            buttons[1].onclick = function () { show(page + 1); };
+            pager.hidden = total === 1;
+            show(0);
+        });
+    </script>
 </body>
 </html>"""
 
-    filename = f'chat_report_{ANALYSIS_YEAR}.html'
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+_HTML_SLOT = re.compile(r'\{\{(\w+)\}\}')
+# 切分结果为 [文本, 槽位名, 文本, 槽位名, ..., 文本]
+_HTML_REPORT_PARTS = _HTML_SLOT.split(_HTML_REPORT_TEMPLATE)
+
+HTML_PERSON_CARDS = 12  # 个人数据卡片最多显示的人数，其余发送者只出现在分页表格中
+_BASE64_BLOCK = 3 * 256 * 1024  # 3 的倍数，分块编码后直接拼接仍是合法的 base64
+
+
+def write_html_template(path, parts, slots):
+    """
+    按切分好的模板逐段写入文件。slots 的值可以是字符串，也可以是逐段生成字符串的可迭代对象；
+    生成器在写到对应位置时才开始计算，整份报告不需要在内存中拼接。
+    先写临时文件再替换，中途失败不会留下半份报告。
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for i, part in enumerate(parts):
+            if i % 2 == 0:
+                f.write(part)
+                continue
+            value = slots[part]
+            if isinstance(value, str):
+                f.write(value)
+            else:
+                f.writelines(value)
+    os.replace(tmp_path, path)
+
+
+def _html_paged_table(table_id, headers, rows, page_size):
+    """
+    分页表格：第一页直接输出为表格行（不依赖脚本也能看到），全部行以 JSON 内嵌在页面中，
+    翻页时由页尾脚本生成。rows 可以是生成器，内存中只保留第一页和一批待写出的行。
+    """
+    rows = ([str(cell) for cell in row] for row in rows)
+    yield f'<table data-pages="{table_id}-data" data-page-size="{page_size}">\n<thead><tr>'
+    yield ''.join(f'<th>{escape(header)}</th>' for header in headers) + '</tr></thead>\n<tbody>\n'
+    first_page = list(islice(rows, page_size))
+    for cells in first_page:
+        yield '<tr>' + ''.join(f'<td>{escape(cell)}</td>' for cell in cells) + '</tr>\n'
+    yield ('</tbody>\n</table>\n<div class="pager" hidden><button type="button">上一页</button>'
+           '<span></span><button type="button">下一页</button></div>\n')
+
+    # JSON 中的 “<” 转义为 \u003c，避免内容里的 </script> 提前结束脚本块
+    yield f'<script type="application/json" id="{table_id}-data">['
+    rows = chain(first_page, rows)
+    separator = ''
+    while True:
+        batch = list(islice(rows, 1000))
+        if not batch:
+            break
+        yield separator + ','.join(json.dumps(cells, ensure_ascii=False) for cells in batch).replace('<', '\\u003c')
+        separator = ','
+    yield ']</script>\n'
+
+
+def _html_image(path, alt):
+    """把 PNG 以 base64 内嵌到页面中（分块读取、编码并写出）；图片不存在时退回为按文件名引用"""
+    if not os.path.exists(path):
+        yield f'<img src="{escape(path)}" alt="{alt}">'
+        return
+    yield '<img src="data:image/png;base64,'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_BASE64_BLOCK), b''):
+            yield base64.b64encode(block).decode('ascii')
+    yield f'" alt="{alt}">'
+
+
+def generate_html_report(overview, person_stats, game_stats, topic_stats, emotion_stats, person_emotions, word_counter,
+                         page_size=None, period=None):
+    """
+    生成HTML报告（overview 为 data_overview 返回的概览字典，period 为年份或查询标签，默认为 ANALYSIS_YEAR）。
+    各部分在写入文件时依次生成；词频表（最多 HTML_WORD_ROWS 个词）和发送者表分页显示（每页 page_size 行，默认 HTML_PAGE_SIZE），
+    词云和数据图表以 base64 内嵌，报告可以单独分享，因此需要在这两张图生成之后调用。
+    """
+    if page_size is None:
+        page_size = HTML_PAGE_SIZE
+    if period is None:
+        period = ANALYSIS_YEAR
+
+    total_messages = overview['total_messages']
+    total_days = overview['total_days']
+
+    # 生成游戏统计
+    def game_rows():
+        if not game_stats:
+            yield '<tr><td colspan="3" style="text-align:center; color:#999;">未检测到游戏相关话题</td></tr>'
+            return
+        total_game = sum(game_stats.values())
+        for game, count in game_stats.items():
+            percentage = count / total_game * 100
+            yield f"<tr><td>{game}</td><td>{count}</td><td>{percentage:.1f}%</td></tr>\n"
+
+    # 生成话题统计
+    def topic_rows():
+        if not topic_stats:
+            return
+        total_topic = sum(topic_stats.values())
+        for topic, count in topic_stats.items():
+            percentage = count / total_topic * 100
+            bar_width = percentage
+            yield f"""
+            <tr>
+                <td>{topic}</td>
+                <td>{count}</td>
+                <td>
+                    <div class="progress-bar">
+                        <div class="progress-fill" style="width: {bar_width}%"></div>
+                        <span class="progress-text">{percentage:.1f}%</span>
+                    </div>
+                </td>
+            </tr>"""
+
+    # 生成情绪统计
+    def emotion_rows():
+        if not emotion_stats:
+            return
+        total_emotion = sum(emotion_stats.values())
+        emotion_colors = {
+            '开心': '#FFD93D', '难过': '#6BCB77', '生气': '#FF6B6B',
+            '惊讶': '#4D96FF', '疑惑': '#9D84B7', '无奈': '#95B8D1'
+        }
+        for emotion, count in emotion_stats.items():
+            percentage = count / total_emotion * 100
+            color = emotion_colors.get(emotion, '#999')
+            yield f"""
+            <tr>
+                <td><span class="emotion-tag" style="background-color: {color}">{emotion}</span></td>
+                <td>{count}</td>
+                <td>{percentage:.1f}%</td>
+            </tr>"""
+
+    # 个人统计卡片（人多时只显示前 HTML_PERSON_CARDS 人）
+    def person_cards():
+        for name, row in islice(person_stats.iterrows(), HTML_PERSON_CARDS):
+            yield f"""
+        <div class="person-card">
+            <h3>{escape(str(name))}</h3>
+            <div class="stat-item">
+                <span class="stat-label">发送消息</span>
+                <span class="stat-value">{int(row['消息数'])} 条</span>
+            </div>
+            <div class="stat-item">
+                <span class="stat-label">占比</span>
+                <span class="stat-value">{row['占比']}%</span>
+            </div>
+            <div class="stat-item">
+                <span class="stat-label">平均长度</span>
+                <span class="stat-value">{row['平均消息长度']:.1f} 字</span>
+            </div>
+        </div>"""
+
+    # 全部发送者的分页表格（群聊模式下发送者多于卡片数时才需要）
+    def person_table():
+        if len(person_stats) <= HTML_PERSON_CARDS:
+            return
+        yield f'<p style="margin: 25px 0 15px; color: #666;">全部 {len(person_stats)} 位发送者</p>\n'
+        rows = ((name, int(row['消息数']), f"{row['占比']}%", f"{row['平均消息长度']:.1f}")
+                for name, row in person_stats.iterrows())
+        yield from _html_paged_table('person-table', ['发送者', '消息数', '占比', '平均长度'], rows, page_size)
+
+    # 词频表：most_common(n) 用堆取前 n 个，不对整个词表排序，页面大小与词表大小无关
+    def word_table():
+        if not word_counter:
+            yield '<p style="color: #999;">没有可统计的词语</p>'
+            return
+        top_words = word_counter.most_common(HTML_WORD_ROWS)
+        shown = '' if len(top_words) == len(word_counter) else f'，显示出现次数最多的 {len(top_words):,} 个'
+        yield f'<p style="margin-bottom: 15px; color: #666;">共 {len(word_counter):,} 个词，按出现次数排序{shown}</p>\n'
+        rows = ((i, word, count) for i, (word, count) in enumerate(top_words, 1))
+        yield from _html_paged_table('word-table', ['排名', '词语', '出现次数'], rows, page_size)
+
+    slots = {
+        'period': _period_title(period),
+        'date_range': overview['date_range'],
+        'total_messages': f"{total_messages:,}",
+        'total_days': str(total_days),
+        'daily_messages': f"{total_messages / total_days:.1f}",
+        'person_cards': person_cards(),
+        'person_table': person_table(),
+        'word_table': word_table(),
+        'wordcloud_img': _html_image(f'wordcloud_{period}.png', '词云图'),
+        'game_rows': game_rows(),
+        'topic_rows': topic_rows(),
+        'emotion_rows': emotion_rows(),
+        'chart_img': _html_image(f'chat_analysis_{period}.png', '数据可视化图表'),
+        'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    write_html_template(f'chat_report_{period}.html', _HTML_REPORT_PARTS, slots)
 
     print(f"🎨 HTML报告已生成")
 
 def _pick_cjk_font(font_size: int):
     """
-    尽量选择支持中文的字体。Mac 优先 PingFang，其次 Arial Unicode。
+    加载支持中文的字体（路径见 cjk_font_path，同一字号在进程内只加载一次）。
     找不到就退化到默认字体（可能不支持中文，会变方块）。
     """
-    candidate_paths = [
-        "/System/Library/Fonts/PingFang.ttc",
-        "/System/Library/Fonts/STHeiti Medium.ttc",
-        "/Library/Fonts/Arial Unicode.ttf",
-        "/Library/Fonts/Arial Unicode MS.ttf",
-    ]
-    for p in candidate_paths:
-        if os.path.exists(p):
-            try:
-                return ImageFont.truetype(p, font_size)
-            except Exception:
-                pass
+    font = _cjk_fonts.get(font_size)
+    if font is not None:
+        return font
+
+    from PIL import ImageFont
+
+    path = cjk_font_path()
     try:
-        return ImageFont.truetype("Arial Unicode MS", font_size)
+        font = ImageFont.truetype(path or "Arial Unicode MS", font_size)
     except Exception:
-        return ImageFont.load_default()
+        font = ImageFont.load_default()
+    _cjk_fonts[font_size] = font
+    return font
+
+
+class _GlyphCache:
+    """按字符缓存 advance 宽度和字形蒙版，同一字体、字号在进程内共享"""
+
+    _instances = {}
+
+    def __init__(self, font):
+        self.font = font
+        self.widths = {}
+        self.masks = {}
+
+    @classmethod
+    def for_font(cls, font):
+        path = getattr(font, 'path', None)
+        key = (path, getattr(font, 'size', None)) if path else id(font)
+        cache = cls._instances.get(key)
+        # 没有路径的字体按对象 id 区分，id 可能被复用，需确认是同一个对象
+        if cache is None or (not path and cache.font is not font):
+            cache = cls._instances[key] = cls(font)
+        return cache
+
+    def width(self, ch):
+        w = self.widths.get(ch)
+        if w is None:
+            w = self.widths[ch] = self.font.getlength(ch)
+        return w
+
+    def mask(self, ch):
+        """返回 (蒙版, 左侧偏移)；空白字符返回 (None, 0)"""
+        entry = self.masks.get(ch)
+        if entry is None:
+            left, _, right, bottom = self.font.getbbox(ch)
+            if ch.isspace() or right <= left or bottom <= 0:
+                entry = (None, 0)
+            else:
+                from PIL import Image, ImageDraw
+
+                pad = max(0, -left)
+                mask = Image.new("L", (right + pad, bottom), 0)
+                ImageDraw.Draw(mask).text((pad, 0), ch, font=self.font, fill=255)
+                entry = (mask, pad)
+            self.masks[ch] = entry
+        return entry
+
+
+def _wrap_line(line, char_width, max_width):
+    """按像素宽度换行：累加字符宽度后二分查找断点，每行只需 O(n log n)"""
+    cumulative = list(accumulate(char_width(ch) for ch in line))
+    pieces = []
+    start, offset = 0, 0.0
+    while start < len(line):
+        end = bisect_right(cumulative, offset + max_width, lo=start)
+        if end == start:
+            end = start + 1  # 单个字符就超宽时也至少放一个字符
+        pieces.append(line[start:end])
+        offset = cumulative[end - 1]
+        start = end
+    return pieces
+
+
+class _PNGStreamWriter:
+    """逐行写入 PNG（RGB 或灰度），压缩数据边生成边落盘，不需要整张位图常驻内存"""
+
+    def __init__(self, path, width, height, mode="RGB"):
+        self.f = open(path, 'wb')
+        self.width = width
+        self.channels = 3 if mode == "RGB" else 1
+        self.compressor = zlib.compressobj()
+        self.f.write(b'\x89PNG\r\n\x1a\n')
+        color_type = 2 if mode == "RGB" else 0
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+
+    def _chunk(self, tag, data):
+        self.f.write(struct.pack('>I', len(data)))
+        self.f.write(tag)
+        self.f.write(data)
+        self.f.write(struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    def write_rows(self, raw, rows):
+        """写入 rows 行原始像素数据（每行前加过滤类型 0）"""
+        stride = self.width * self.channels
+        data = b''.join(b'\x00' + raw[i * stride:(i + 1) * stride] for i in range(rows))
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self._chunk(b'IDAT', compressed)
+
+    def close(self):
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+        self.f.close()
 
 
 def save_text_report_as_png(
@@ -1051,16 +2885,19 @@ def save_text_report_as_png(
     line_spacing: float = 1.35,
     bg_color=(255, 255, 255),
     text_color=(0, 0, 0),
+    tile_lines: int = 200,
 ):
     """
     将控制台文本报告渲染成一张“长图PNG”
-    - 自动换行（按像素宽度）
+    - 自动换行（按像素宽度，字符宽度缓存 + 二分查找断点）
     - 自动计算高度
+    - 字形蒙版按字符缓存后逐字粘贴
+    - 按 tile_lines 行一块分块渲染并流式写入 PNG，不分配整张大图
     """
-    font = _pick_cjk_font(font_size)
-    tmp_img = Image.new("RGB", (width, 100), bg_color)
-    draw = ImageDraw.Draw(tmp_img)
+    from PIL import Image
 
+    font = _pick_cjk_font(font_size)
+    glyphs = _GlyphCache.for_font(font)
     max_text_width = width - 2 * margin
 
     # 逐段处理：保留空行、分隔线等
@@ -1069,18 +2906,7 @@ def save_text_report_as_png(
         if raw_line.strip() == "":
             lines.append("")  # 空行保留
             continue
-
-        # 按像素宽度进行自动换行
-        cur = ""
-        for ch in raw_line:
-            test = cur + ch
-            if draw.textlength(test, font=font) <= max_text_width:
-                cur = test
-            else:
-                lines.append(cur)
-                cur = ch
-        if cur:
-            lines.append(cur)
+        lines.extend(_wrap_line(raw_line, glyphs.width, max_text_width))
 
     # 行高
     ascent, descent = font.getmetrics()
@@ -1088,67 +2914,525 @@ def save_text_report_as_png(
     line_h = int(base_line_h * line_spacing)
 
     height = margin * 2 + line_h * len(lines)
-    img = Image.new("RGB", (width, height), bg_color)
-    draw = ImageDraw.Draw(img)
+    # 黑白等灰阶配色直接输出灰度 PNG，压缩数据量只有 RGB 的三分之一
+    mode = "L" if len(set(bg_color)) == 1 and len(set(text_color)) == 1 else "RGB"
+    if mode == "L":
+        bg_color, text_color = bg_color[0], text_color[0]
+    writer = _PNGStreamWriter(out_path, width, height, mode)
+    try:
+        blank_row = bytes([bg_color] if mode == "L" else bg_color) * width
+        writer.write_rows(blank_row * margin, margin)
+        for start in range(0, len(lines), tile_lines):
+            tile_lines_text = lines[start:start + tile_lines]
+            tile = Image.new(mode, (width, line_h * len(tile_lines_text)), bg_color)
+            for i, line in enumerate(tile_lines_text):
+                # 逐字贴上缓存的字形蒙版，比每行调用 draw.text 重新栅格化快得多
+                x = float(margin)
+                for ch in line:
+                    mask, pad = glyphs.mask(ch)
+                    if mask is not None:
+                        tile.paste(text_color, (int(round(x)) - pad, i * line_h), mask)
+                    x += glyphs.width(ch)
+            writer.write_rows(tile.tobytes(), tile.height)
+        writer.write_rows(blank_row * margin, margin)
+    finally:
+        writer.close()
+    print(f"🖼️ 长图PNG已生成: {out_path}")
 
-    y = margin
-    for line in lines:
-        draw.text((margin, y), line, font=font, fill=text_color)
-        y += line_h
 
-    img.save(out_path)
-    print(f"🖼️ 长图PNG已生成: {out_path}")
+# 子进程需要与父进程一致的配置项（可能在运行时被修改，如 message_bench 关闭缓存）以及已查找到的字体
+_WORKER_CONFIG_NAMES = ('CACHE_DIR', 'SESSION_GAP_MINUTES', 'TOKENIZE_WORKERS', 'GROUP_TOP_K', 'HTML_PAGE_SIZE',
+                        'HTML_WORD_ROWS', 'FONT_PATH', 'HTML_PERSON_CARDS', 'WORDCLOUD_MAX_WORDS', '_cjk_font_path')
 
 
+def _worker_config():
+    """打包传给子进程的配置（先查找字体，子进程不必各自再查找一遍）"""
+    cjk_font_path()
+    return {name: globals()[name] for name in _WORKER_CONFIG_NAMES}
 
-def main():
-    """主函数"""
-    try:
-        print(f"正在加载 {ANALYSIS_YEAR} 年的聊天记录...")
-        df = load_and_clean_data(FILE_PATH, ANALYSIS_YEAR)
 
-        if len(df) == 0:
-            print(f"❌ 未找到 {ANALYSIS_YEAR} 年的聊天记录！")
-            return
+def _init_worker_config(config):
+    """
+    进程池初始化：恢复父进程的配置。spawn 启动方式（macOS 默认）的子进程会重新导入本模块，
+    不会继承父进程在运行时设置的全局变量；阶段计时不继承，由任务参数单独开启。
+    """
+    global _tracer
+    globals().update(config)
+    _tracer = None
+
+
+def _init_render_worker(config):
+    """渲染进程初始化：恢复父进程的配置，并在导入 pyplot 之前选定无界面的 Agg 后端"""
+    import matplotlib
+    matplotlib.use('Agg')
+    _init_worker_config(config)
+
+
+def _render_artifact(name, year, func, args, tracing=False, profile_dir=None, memory=False):
+    """
+    在（子）进程中渲染单个产物，返回 (产物名, 耗时秒数, 阶段记录)。
+    year 为年份或查询标签，渲染函数通过参数接收，这里只用于阶段名。
+    开启计时时阶段记录由子进程自己的 StageTracer 生成，否则为 None。
+    """
+    tracer = StageTracer(profile_dir, memory) if tracing else None
+    start = time.perf_counter()
+    with tracer.stage(f"{year}/render:{name}") if tracer else nullcontext():
+        func(*args)
+    return name, time.perf_counter() - start, tracer.records[0] if tracer else None
+
+
+def _render_summary_png(report_text, out_path):
+    save_text_report_as_png(
+        report_text=report_text,
+        out_path=out_path,
+        width=1400,
+        font_size=24,
+        margin=50
+    )
+
 
-        buf = io.StringIO()
-        with redirect_stdout(buf):
+def render_artifacts(year, report_text, res, html=False, workers=None):
+    """
+    渲染阶段：输入只包含统计结果（纯数据），把总结长图、词云、数据图表分发到多个进程中同时渲染，
+    总耗时取决于最慢的一个产物；可选的 HTML 报告内嵌词云和图表，在它们完成之后再生成。
+    res 为 StreamingAnalyzer.results() 格式的结果字典。
+    返回 {产物名: 耗时秒数}。
+    """
+    if workers is None:
+        workers = RENDER_WORKERS
+
+    tasks = [
+        ('总结长图', _render_summary_png, (report_text, f"chat_summary_{year}.png")),
+        ('词云图', generate_wordcloud, (res['word_counter'], year)),
+        ('数据图表', create_visualizations, (res['person_counts'], res['hour_dist'], res['weekday_dist'],
+                                          res['month_dist'], res['reply_stats'], res['session_df'],
+                                          res['initiation_stats'], year)),
+    ]
+    final_tasks = []
+    if html:
+        final_tasks.append(('HTML报告', generate_html_report, (res['overview'], res['person_stats'], None,
+                                                             res['topic_stats'], res['emotion_stats'],
+                                                             res['person_emotions'], res['word_counter'],
+                                                             None, year)))
+
+    trace_args = (True, _tracer.profile_dir, _tracer.memory) if _tracer else ()
+    start = time.perf_counter()
+    if workers == 1:
+        results = [_render_artifact(name, year, func, args, *trace_args) for name, func, args in tasks + final_tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers or len(tasks), initializer=_init_render_worker,
+                                 initargs=(_worker_config(),)) as pool:
+            futures = [pool.submit(_render_artifact, name, year, func, args, *trace_args) for name, func, args in tasks]
+            results = [future.result() for future in futures]
+            results += [pool.submit(_render_artifact, name, year, func, args, *trace_args).result()
+                        for name, func, args in final_tasks]
+    wall = time.perf_counter() - start
+
+    timings = {name: seconds for name, seconds, _ in results}
+    if _tracer is not None:
+        _tracer.records.extend(record for _, _, record in results)
+
+    print(f"\n⏱️  渲染耗时:")
+    for name, seconds in timings.items():
+        print(f"  {name}: {seconds:.2f} 秒")
+    print(f"  总计（墙钟）: {wall:.2f} 秒")
+    return timings
+
+
+def run_year_report(df, year, session_gap_minutes=None, html=False, render_workers=None, render=True,
+                    top_k=None):
+    """
+    对单个年份的数据执行全部分析并（并行）生成长图、词云、图表及可选的 HTML 报告，
+    返回用于跨年对比的摘要字典。year 也可以是查询区间的标签字符串（见 run_queries），用于标题和文件名。render=False 时只在控制台输出文字报告，不导入任何绘图库。
+    top_k 为群聊模式的保留人数（默认 GROUP_TOP_K），其余发送者合并为一组（名称见 _others_label）。
+    """
+    global ANALYSIS_YEAR
+    ANALYSIS_YEAR = year
+    if top_k is None:
+        top_k = GROUP_TOP_K
+    df = fold_senders(df, top_k)
+    if 'sender' in df.columns:
+        senders = df['sender'].unique()
+        print(f"👥 群聊模式: 共 {len(senders)} 人发言，保留消息最多的 {top_k} 人，"
+              f"其余合并为“{_others_label(senders, top_k)}”")
+
+    buf = io.StringIO()
+    with redirect_stdout(buf):
+        with stage(f"{year}/basic_statistics"):
             person_stats = basic_statistics(df)
+        with stage(f"{year}/time_analysis"):
             hour_dist, weekday_dist, month_dist = time_analysis(df)
-            reply_stats, session_df, continuous_stats, emoji_counter = interaction_analysis(df)
+        with stage(f"{year}/interaction_analysis"):
+            reply_stats, session_df, continuous_stats, emoji_counter = interaction_analysis(df, session_gap_minutes)
+        with stage(f"{year}/content_deep_analysis"):
             word_counter, game_stats, topic_stats, emotion_stats, person_emotions = content_deep_analysis(df)
 
-        report_text = buf.getvalue()
-
-        # 生成“总结长图”
-        summary_png = f"chat_summary_{ANALYSIS_YEAR}.png"
-        save_text_report_as_png(
-            report_text=report_text,
-            out_path=summary_png,
-            width=1400,
-            font_size=24,
-            margin=50
-        )
+    report_text = buf.getvalue()
 
-        # 你原来的可视化图、词云仍然可以保留
+    if not render:
+        print(report_text, end='')
+    else:
+        # 长图、词云、图表（以及可选的 HTML）并行渲染
         print(f"\n{'=' * 60}")
         print("🎨 正在生成可视化内容...")
-        generate_wordcloud(word_counter)
-        create_visualizations(df, hour_dist, weekday_dist, month_dist, reply_stats, session_df, continuous_stats)
+        render_artifacts(year, report_text, {
+            'overview': data_overview(df),
+            'person_stats': person_stats,
+            'person_counts': df['name'].value_counts(),
+            'hour_dist': hour_dist,
+            'weekday_dist': weekday_dist,
+            'month_dist': month_dist,
+            'reply_stats': reply_stats,
+            'session_df': session_df,
+            'initiation_stats': continuous_stats,
+            'word_counter': word_counter,
+            'topic_stats': topic_stats,
+            'emotion_stats': emotion_stats,
+            'person_emotions': person_emotions,
+        }, html=html, workers=render_workers)
+
+    summary = {
+        '年份': year,
+        '总消息数': len(df),
+        '聊天天数': df['date'].nunique(),
+        '日均消息': round(len(df) / df['date'].nunique(), 1),
+        '最活跃时段': int(hour_dist.idxmax()),
+        '对话场次': len(session_df),
+        '高频词': word_counter.most_common(1)[0][0] if word_counter else '',
+        '最常见情绪': next(iter(emotion_stats), ''),
+    }
+    for name, row in person_stats.iterrows():
+        summary[f'{name}消息数'] = int(row['消息数'])
+    if reply_stats is not None:
+        for name, row in reply_stats.iterrows():
+            summary[f'{name}中位数回复(分钟)'] = row['中位数回复时间']
+    return summary
 
-        # ====== 2) 不要HTML就注释掉 ======
-        # generate_html_report(df, person_stats, game_stats, topic_stats, emotion_stats, person_emotions, word_counter)
+
+def _state_path(file_path, year):
+    cache_path, _ = _cache_paths(file_path)
+    return cache_path.replace('.parquet', f'-state-{year}.pkl')
+
+
+def _load_state(state_path, year, session_gap_minutes, sketch=None):
+    """
+    读取增量快照，返回 (分析器, csv 续读位置)；
+    版本、年份、对话间隔或近似模式参数不一致时返回 (None, None)（需全量重建）
+    """
+    if not os.path.exists(state_path):
+        return None, None
+    import pickle
+    with open(state_path, 'rb') as f:
+        state = pickle.load(f)
+    if (state.get('version') != STATE_VERSION or state.get('year') != year
+            or state.get('session_gap_minutes') != session_gap_minutes or state.get('sketch') != sketch):
+        return None, None
+    return state['analyzer'], state.get('source')
+
+
+def _save_state(state_path, year, session_gap_minutes, analyzer, sketch=None, source=None):
+    import pickle
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'version': STATE_VERSION, 'year': year,
+                     'session_gap_minutes': session_gap_minutes, 'sketch': sketch, 'analyzer': analyzer,
+                     'source': source}, f)
+    os.replace(tmp_path, state_path)
+
+
+def run_stream_report(file_path, year, session_gap_minutes=None, chunk_rows=None, incremental=False,
+                      html=False, render_workers=None, render=True, top_k=None, sketch=None):
+    """
+    流式模式：分批读取源文件，内存占用与文件大小无关，生成与 run_year_report 相同的报告。
+    incremental=True 时从上次保存的快照继续，只合并比快照高水位更新的消息：
+    csv 只在末尾追加过内容时从上次读到的字节位置续读，读取和统计都只处理新增的行；
+    xlsx 无法从中间开始解析，每次仍要用 openpyxl 完整读取一遍，只有统计这一步是增量的。
+    sketch 为近似模式参数 {'epsilon', 'delta', 'k'}（见 ApproxStreamingAnalyzer），None 表示精确统计。
+    """
+    global ANALYSIS_YEAR
+    ANALYSIS_YEAR = year
+    if session_gap_minutes is None:
+        session_gap_minutes = SESSION_GAP_MINUTES
+
+    analyzer = None
+    offset = 0
+    is_csv = file_path.lower().endswith('.csv')
+    state_path = _state_path(file_path, year) if incremental and CACHE_DIR else None
+    if state_path:
+        analyzer, source = _load_state(state_path, year, session_gap_minutes, sketch)
+        if analyzer is not None:
+            print(f"已读取增量快照（截至 {analyzer.last_dt}，共 {analyzer.total_messages} 条消息）")
+            if is_csv:
+                offset = _csv_resume_offset(file_path, source)
+                if offset:
+                    print(f"csv 从第 {offset} 字节处续读")
+            else:
+                print("xlsx 需要完整读取一遍，仅统计新增的消息")
+        # 在读取之前记录续读位置，本次只读到这里：读取过程中追加的行完整地留给下一次续读
+        source = _csv_resume_point(file_path) if is_csv else None
+    if analyzer is None:
+        if sketch is None:
+            analyzer = StreamingAnalyzer(session_gap_minutes)
+        else:
+            analyzer = ApproxStreamingAnalyzer(session_gap_minutes, **sketch)
+
+    with stage(f"{year}/stream_ingest"):
+        end = source['offset'] if state_path and source else None
+        added = analyzer.ingest(iter_source_chunks(file_path, chunk_rows, offset, end), year, appended=offset > 0)
+    if state_path:
+        print(f"本次新增 {added} 条消息")
+        if analyzer.total_messages:
+            _save_state(state_path, year, session_gap_minutes, analyzer, sketch, source)
+
+    if analyzer.total_messages == 0:
+        print(f"❌ 未找到 {year} 年的聊天记录！")
+        return None
+
+    buf = io.StringIO()
+    if top_k is None:
+        top_k = GROUP_TOP_K
+    if top_k is not None and len(analyzer.persons) > top_k:
+        print(f"👥 群聊模式: 共 {len(analyzer.persons)} 人发言，保留消息最多的 {top_k} 人，"
+              f"其余合并为“{_others_label(analyzer.persons, top_k)}”")
+    with redirect_stdout(buf), stage(f"{year}/stream_results"):
+        res = analyzer.results(top_k)
+
+    if not render:
+        print(buf.getvalue(), end='')
+        return res
+
+    print(f"\n{'=' * 60}")
+    print("🎨 正在生成可视化内容...")
+    render_artifacts(year, buf.getvalue(), res, html=html, workers=render_workers)
+    return res
+
+
+def _parse_years(text):
+    """解析年份参数：'2022-2026' 或 '2022,2024,2026'"""
+    years = []
+    for part in text.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-', 1)
+            years.extend(range(int(start), int(end) + 1))
+        elif part:
+            years.append(int(part))
+    return sorted(set(years))
+
+
+def _traced_year_report(profile_dir, memory, *args):
+    """批量模式的子进程入口：在子进程内开启计时，连同阶段记录一起返回"""
+    tracer = enable_tracing(profile_dir, memory)
+    return run_year_report(*args), tracer.records
+
+
+def run_batch(file_path, years, workers=None, session_gap_minutes=None, html=False, render=True, top_k=None):
+    """
+    多年份批量模式：只加载一次数据，按年份拆分后在进程池中并行生成各年报告，
+    最后输出跨年对比表 chat_compare_<起>-<止>.csv。
+    各年份已在不同进程中运行，年份内部的分词和产物渲染都改为在本进程内依次执行，避免进程数翻倍。
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    print(f"正在加载 {years[0]}-{years[-1]} 年的聊天记录...")
+    with stage("load_years"):
+        parts = load_years(file_path, years)
+    for year in years:
+        if year not in parts:
+            print(f"⚠️  未找到 {year} 年的聊天记录，已跳过")
+    if not parts:
+        print("❌ 指定年份内没有任何聊天记录！")
+        return
+
+    _wait_jieba_preload()
+    config = dict(_worker_config(), TOKENIZE_WORKERS=1)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker_config, initargs=(config,)) as pool:
+        if _tracer is None:
+            futures = {year: pool.submit(run_year_report, df, year, session_gap_minutes, html, 1, render, top_k)
+                       for year, df in sorted(parts.items())}
+            summaries = [futures[year].result() for year in sorted(futures)]
+        else:
+            futures = {year: pool.submit(_traced_year_report, _tracer.profile_dir, _tracer.memory,
+                                         df, year, session_gap_minutes, html, 1, render, top_k)
+                       for year, df in sorted(parts.items())}
+            summaries = []
+            for year in sorted(futures):
+                summary, records = futures[year].result()
+                summaries.append(summary)
+                _tracer.records.extend(records)
+
+    compare_path = f"chat_compare_{years[0]}-{years[-1]}.csv"
+    _write_compare(summaries, compare_path, "📅 跨年对比")
+
+    print(f"\n{'=' * 60}")
+    print("✅ 所有年份的分析报告生成完成！")
+    print(f"{'=' * 60}")
+    print("\n生成的文件:")
+    if not render:
+        print(f"  📅 {compare_path} - 跨年对比表")
+        return
+    for year in sorted(parts):
+        print(f"  {year}: chat_summary_{year}.png / chat_analysis_{year}.png / wordcloud_{year}.png")
+    print(f"  📅 {compare_path} - 跨年对比表")
+
+
+def _write_compare(summaries, compare_path, title, index='年份'):
+    """把各次报告的摘要写成对比表 csv，并在控制台输出"""
+    compare_df = pd.DataFrame(summaries).rename(columns={'年份': index}).set_index(index)
+    compare_df.to_csv(compare_path, encoding='utf-8-sig')
+
+    print(f"\n{'=' * 60}")
+    print(title)
+    print(f"{'=' * 60}")
+    print(compare_df.T.to_string())
+
+
+def _safe_label(text):
+    """把查询标签中不能出现在文件名里的字符替换为下划线"""
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', text)
+
+
+def _parse_date(text):
+    try:
+        return pd.Timestamp(datetime.strptime(text, '%Y-%m-%d'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式应为 YYYY-MM-DD: {text}")
+
+
+def _parse_range(text):
+    """--range：'2025-01-01:2025-03-31'（包含结束日期），返回 (标签, 起, 止)；止为开区间"""
+    start, sep, end = text.partition(':')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"区间格式应为 起始日期:结束日期: {text}")
+    start, end = _parse_date(start), _parse_date(end)
+    if end < start:
+        raise argparse.ArgumentTypeError(f"结束日期早于起始日期: {text}")
+    return f"{start:%Y-%m-%d}_{end:%Y-%m-%d}", start, end + pd.Timedelta(days=1)
+
+
+def _parse_month(text):
+    """--month：'2025-03'"""
+    try:
+        start = pd.Timestamp(datetime.strptime(text, '%Y-%m'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"月份格式应为 YYYY-MM: {text}")
+    return f"{start:%Y-%m}", start, start + pd.offsets.MonthBegin(1)
+
+
+def _parse_rolling(text):
+    """--rolling：'30'（截至最后一条消息）或 '30@2025-06-30'，返回 (天数, 截止日期或 None)"""
+    days, _, end = text.partition('@')
+    if not days.isdigit() or int(days) <= 0:
+        raise argparse.ArgumentTypeError(f"天数应为正整数: {text}")
+    return int(days), _parse_date(end) if end else None
+
+
+def run_queries(dataset, windows, senders=None, session_gap_minutes=None, html=False, render_workers=None,
+                render=True, top_k=None):
+    """
+    查询模式：在已加载的 ChatDataset 上对每个时间区间依次二分切片并生成报告，
+    senders 不为空时只保留这些发送者的消息。windows 为 [(标签, 起, 止)]，区间左闭右开。
+    多个区间时额外输出对比表 chat_compare_queries.csv。返回实际生成报告的标签列表。
+    """
+    suffix = f"_{'+'.join(senders)}" if senders else ''
+
+    labels, summaries = [], []
+    for label, start, end in windows:
+        label = _safe_label(f"{label}{suffix}")
+        with stage(f"{label}/query"):
+            df = dataset.query(start, end, senders)
+        if len(df) == 0:
+            print(f"⚠️  {label} 没有符合条件的聊天记录，已跳过")
+            continue
+        print(f"\n🔎 {label}: {len(df)} 条消息")
+        summaries.append(run_year_report(df, label, session_gap_minutes, html, render_workers, render, top_k))
+        labels.append(label)
+
+    if len(summaries) > 1:
+        _write_compare(summaries, "chat_compare_queries.csv", "🔎 区间对比", index='区间')
+    return labels
+
+
+def _query_windows(args, dataset):
+    """由命令行参数得到查询区间列表 [(标签, 起, 止)]；只指定 --sender 时查询 --year 整年"""
+    windows = list(args.range or []) + list(args.month or [])
+    for days, end in args.rolling or []:
+        start, end = dataset.rolling_window(days, end)
+        windows.append((f"{start:%Y-%m-%d}_{end - pd.Timedelta(days=1):%Y-%m-%d}", start, end))
+    if not windows:
+        windows.append((str(args.year), pd.Timestamp(args.year, 1, 1), pd.Timestamp(args.year + 1, 1, 1)))
+    return windows
+
+
+def _run_cli(args, render):
+    """按命令行参数执行单年、区间查询、流式或批量分析"""
+    try:
+        if args.range or args.month or args.rolling or args.sender:
+            print("正在加载全部聊天记录...")
+            with stage("load_dataset"):
+                dataset = ChatDataset.load(args.file)
+            if len(dataset) == 0:
+                print("❌ 没有任何聊天记录！")
+                return
+            labels = run_queries(dataset, _query_windows(args, dataset), args.sender, args.session_gap, args.html, args.render_workers,
+                                 render, args.top_k)
+            if not labels:
+                print("❌ 指定区间内没有任何聊天记录！")
+                return
+            print(f"\n{'=' * 60}")
+            print("✅ 所有分析报告生成完成！")
+            print(f"{'=' * 60}")
+            if render:
+                print("\n生成的文件:")
+                for label in labels:
+                    print(f"  {label}: chat_summary_{label}.png / chat_analysis_{label}.png / wordcloud_{label}.png"
+                          + (f" / chat_report_{label}.html" if args.html else ""))
+            if len(labels) > 1:
+                print("  🔎 chat_compare_queries.csv - 区间对比表")
+            return
+
+        if args.years:
+            run_batch(args.file, _parse_years(args.years), args.workers, args.session_gap, args.html, render,
+                      args.top_k)
+            return
+
+        year = args.year
+        print(f"正在加载 {year} 年的聊天记录...")
+        if args.stream or args.incremental or args.approx:
+            sketch = None
+            if args.approx:
+                sketch = {'epsilon': args.sketch_epsilon, 'delta': args.sketch_delta, 'k': args.sketch_k}
+            if args.rebuild and os.path.exists(_state_path(args.file, year)):
+                os.remove(_state_path(args.file, year))
+            if run_stream_report(args.file, year, args.session_gap, args.chunk_rows, args.incremental,
+                                 args.html, args.render_workers, render, args.top_k, sketch) is None:
+                return
+        else:
+            with stage("load_and_clean_data"):
+                df = load_and_clean_data(args.file, year)
+
+            if len(df) == 0:
+                print(f"❌ 未找到 {year} 年的聊天记录！")
+                return
+
+            run_year_report(df, year, args.session_gap, args.html, args.render_workers, render, args.top_k)
 
         print(f"\n{'=' * 60}")
         print("✅ 所有分析报告生成完成！")
         print(f"{'=' * 60}")
+        if not render:
+            return
         print("\n生成的文件:")
-        print(f"  🖼️ chat_summary_{ANALYSIS_YEAR}.png - 总结长图（纯图片）")
-        print(f"  📊 chat_analysis_{ANALYSIS_YEAR}.png - 数据图表")
-        print(f"  ☁️  wordcloud_{ANALYSIS_YEAR}.png - 词云图")
+        print(f"  🖼️ chat_summary_{year}.png - 总结长图（纯图片）")
+        print(f"  📊 chat_analysis_{year}.png - 数据图表")
+        print(f"  ☁️  wordcloud_{year}.png - 词云图")
+        if args.html:
+            print(f"  🌐 chat_report_{year}.html - HTML 报告")
 
     except FileNotFoundError:
-        print(f"❌ 错误: 找不到文件 {FILE_PATH}")
+        print(f"❌ 错误: 找不到文件 {args.file}")
         print("请检查文件路径是否正确！")
     except Exception as e:
         print(f"❌ 发生错误: {str(e)}")
@@ -1156,5 +3440,76 @@ def main():
         traceback.print_exc()
 
 
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="聊天记录年度分析")
+    parser.add_argument("--file", default=FILE_PATH, help=f"聊天记录 Excel 文件路径（默认 {FILE_PATH}）")
+    parser.add_argument("--year", type=int, default=ANALYSIS_YEAR, help=f"分析年份（默认 {ANALYSIS_YEAR}）")
+    parser.add_argument("--years", help="批量模式：年份范围，如 2022-2026 或 2022,2024")
+    parser.add_argument("--workers", type=int, default=None, help="批量模式的进程数（默认 CPU 核数）")
+    parser.add_argument("--range", action="append", type=_parse_range, metavar="START:END",
+                        help="查询模式：日期区间（含结束日期），如 2025-01-01:2025-03-31，可重复指定")
+    parser.add_argument("--month", action="append", type=_parse_month, metavar="YYYY-MM",
+                        help="查询模式：指定月份，如 2025-03，可重复指定")
+    parser.add_argument("--rolling", action="append", type=_parse_rolling, metavar="DAYS[@YYYY-MM-DD]",
+                        help="查询模式：最近 N 天（默认截至最后一条消息，可用 @日期 指定截止日），可重复指定")
+    parser.add_argument("--sender", action="append", metavar="NAME",
+                        help="查询模式：只保留指定发送者的消息，可重复指定；未指定区间时查询 --year 整年")
+    parser.add_argument("--stream", action="store_true", help="流式模式：分批读取，适合超出内存的大文件")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量模式（隐含 --stream）：只分析上次运行之后新增的消息；"
+                             "csv 从上次读到的位置续读，xlsx 仍需完整解析一遍")
+    parser.add_argument("--approx", action="store_true",
+                        help="近似模式（隐含 --stream）：分位数、词频和表情用草图估计，报告中注明误差上限")
+    parser.add_argument("--sketch-epsilon", type=float, default=SKETCH_EPSILON,
+                        help=f"近似模式的计数误差上限（占总次数的比例，默认 {SKETCH_EPSILON}）")
+    parser.add_argument("--sketch-delta", type=float, default=SKETCH_DELTA,
+                        help=f"近似模式超出误差上限的概率（默认 {SKETCH_DELTA}）")
+    parser.add_argument("--sketch-k", type=int, default=SKETCH_K,
+                        help=f"近似模式分位数草图大小（默认 {SKETCH_K}）")
+    parser.add_argument("--rebuild", action="store_true", help="增量模式下丢弃旧快照，重新全量统计")
+    parser.add_argument("--chunk-rows", type=int, default=STREAM_CHUNK_ROWS,
+                        help=f"流式模式每批行数（默认 {STREAM_CHUNK_ROWS}）")
+    parser.add_argument("--session-gap", type=float, default=SESSION_GAP_MINUTES,
+                        help=f"对话切分间隔（分钟，默认 {SESSION_GAP_MINUTES}）")
+    parser.add_argument("--top-k", type=int, default=GROUP_TOP_K,
+                        help="群聊模式：只保留消息数最多的 K 人的明细，其余合并为“其他”"
+                             "（有人恰好叫“其他”时改为“其他(N人)”）")
+    parser.add_argument("--html", action="store_true", help="同时生成 HTML 报告")
+    parser.add_argument("--stats-only", action="store_true",
+                        help="只在控制台输出统计报告，不生成图片（不导入绘图库，启动更快）")
+    parser.add_argument("--render-workers", type=int, default=RENDER_WORKERS,
+                        help="并行渲染的进程数（默认每个产物一个进程，1 表示依次渲染）")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="记录各阶段的墙钟/CPU 时间与内存峰值，并写出 JSON 跟踪文件")
+    parser.add_argument("--profile-dir", metavar="DIR",
+                        help="为每个阶段保存一份 cProfile 结果（<阶段>.prof，隐含开启阶段计时）")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="阶段计时额外用 tracemalloc 统计分配峰值（较慢，隐含开启阶段计时）")
+    args = parser.parse_args()
+
+    render = not args.stats_only
+    if args.html and not render:
+        parser.error("--html 与 --stats-only 不能同时使用")
+    if (args.range or args.month or args.rolling or args.sender) and (
+            args.years or args.stream or args.incremental or args.approx):
+        parser.error("查询参数（--range/--month/--rolling/--sender）不能与 --years 或流式模式同时使用")
+
+    # jieba 词典在后台加载，与 Excel 解析重叠
+    preload_jieba()
+
+    tracing = args.trace or args.profile_dir or args.trace_memory
+    tracer = enable_tracing(args.profile_dir, args.trace_memory) if tracing else None
+    try:
+        _run_cli(args, render)
+    finally:
+        if tracer is not None and tracer.records:
+            tracer.print_summary()
+            if args.trace:
+                tracer.dump(args.trace, argv=sys.argv[1:], python=sys.version.split()[0],
+                            finished=datetime.now().isoformat(timespec='seconds'))
+                print(f"\n📝 阶段跟踪已写入 {args.trace}")
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
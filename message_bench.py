@@ -0,0 +1,374 @@
+"""
+message.py 的性能基准脚本
+
+用法:
+  python message_bench.py startup                 # 启动（导入）耗时：按需导入 vs 全部预先导入
+  python message_bench.py startup --file mes.xlsx # 另外比较 --stats-only 与完整运行的端到端耗时
+  python message_bench.py generate 100k fake.csv  # 生成合成聊天记录（xlsx 最多 1048576 行，更大请用 csv）
+  python message_bench.py run --scales 10k,1M,10M --out bench.json
+  python message_bench.py run --scales 10k,1M --baseline bench.json  # 与上次结果对比
+  python message_bench.py check                   # 增量模式自检（csv 追加的消息与快照最后一条同一分钟）
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# message.py 改为按需导入之前，模块顶部会一次性导入的重量级依赖
+HEAVY_MODULES = ["matplotlib.pyplot", "jieba", "wordcloud", "PIL.Image"]
+
+# 合成聊天用的常见词（话题、情绪关键词从 message.py 中补充）
+FILLER_WORDS = [
+    '今天', '明天', '晚上', '早上', '吃饭', '睡觉', '上班', '下班', '真的', '好的', '知道', '一起',
+    '出去', '外卖', '快递', '周末', '哈哈哈', '嗯嗯', '好吧', '等下', '马上', '回家', '有点', '怎么',
+    '我', '你', '他', '在', '不', '是', '也', '就', '还', '想', '去', '看', '说', '做', '买', '玩',
+    '了', '吗', '呢', '啊', '吧', '好', '太', '这个', '那个', '什么', '没有', '可以', '感觉', '觉得',
+]
+PLACEHOLDERS = ['[图片]', '[表情]', '[语音]']
+
+
+def _time_command(cmd, repeat, cwd=HERE):
+    """在新的解释器进程中执行命令 repeat 次，返回每次的墙钟耗时（秒）"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _import_time(module):
+    """
+    用 -X importtime 测量单个模块在 message 已导入之后的额外导入耗时（秒）。
+    每个模块在独立的解释器中测量，避免共同依赖被算到先导入的模块头上。
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import message; import {module}"],
+                          cwd=HERE, capture_output=True, text=True, check=True)
+    seconds = 0.0
+    for line in proc.stderr.splitlines():
+        # 格式: import time: self [us] | cumulative | imported package
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if name.strip() == module and cumulative.strip().isdigit():
+                seconds = int(cumulative) / 1e6
+    return seconds
+
+
+def _parse_count(text):
+    """'10k' / '1M' / '2500' -> 整数"""
+    text = text.strip().lower()
+    scale = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def _vocabulary():
+    import message
+    words = set(FILLER_WORDS)
+    for keywords in message.TOPIC_KEYWORDS.values():
+        words.update(keywords)
+    for spec in message.EMOTION_KEYWORDS.values():
+        words.update(spec['keywords'])
+    emojis = {emoji for spec in message.EMOTION_KEYWORDS.values() for emoji in spec['emoji']}
+    # 排序保证同一 seed 生成的数据可复现（部分关键词表由 set 构造，顺序不固定）
+    return sorted(words), sorted(emojis)
+
+
+def generate_chat(n_messages, n_senders=2, emoji_density=0.2, text_length=10, burstiness=0.85,
+                  unique_ratio=0.2, year=2025, seed=0):
+    """
+    生成与 QQ 导出相同四列布局（时间/QQ号/昵称/消息，无表头）的合成聊天记录 DataFrame。
+
+    n_senders      发送者人数，活跃度按排名递减
+    emoji_density  每条消息平均附带的 /表情 个数
+    text_length    每条消息的平均字数
+    burstiness     落在连续对话内（间隔以秒计）的消息比例，其余为对话之间以小时计的长间隔
+    unique_ratio   不同文本占消息总数的比例（真实聊天中短句大量重复）
+    """
+    rng = np.random.default_rng(seed)
+    words, emojis = _vocabulary()
+
+    # 文本池：按平均词长换算每条消息的词数，表情追加在句尾
+    n_unique = max(1, min(n_messages, int(n_messages * unique_ratio)))
+    mean_word_len = sum(map(len, words)) / len(words)
+    word_counts = np.maximum(1, rng.poisson(text_length / mean_word_len, n_unique))
+    word_idx = rng.integers(0, len(words), int(word_counts.sum())).tolist()
+    emoji_counts = rng.poisson(emoji_density, n_unique).tolist()
+    emoji_idx = iter(rng.integers(0, len(emojis), int(sum(emoji_counts))).tolist())
+    placeholder = rng.random(n_unique) < 0.05
+    pool = []
+    pos = 0
+    for count, n_emoji, is_placeholder in zip(word_counts.tolist(), emoji_counts, placeholder.tolist()):
+        text = ''.join(words[i] for i in word_idx[pos:pos + count])
+        pos += count
+        if is_placeholder:
+            text = PLACEHOLDERS[count % len(PLACEHOLDERS)]
+        pool.append(text + ''.join(emojis[next(emoji_idx)] for _ in range(n_emoji)))
+    # 靠前的文本被抽中的概率更高，模拟“哈哈”“好的”这类高频短句
+    messages = np.array(pool, dtype=object)[(n_unique * rng.random(n_messages) ** 3).astype(np.int64)]
+
+    # 时间：对话内间隔 ~ 指数分布(30 秒)，对话之间 ~ 指数分布(6 小时)，再按比例铺满一整年
+    in_burst = rng.random(n_messages) < burstiness
+    gaps = np.where(in_burst, rng.exponential(30, n_messages), rng.exponential(6 * 3600, n_messages))
+    seconds = np.cumsum(gaps)
+    seconds = (seconds / seconds[-1] * (365 * 86400 - 60)).astype(np.int64)
+    times = pd.Series(np.datetime64(f'{year}-01-01T00:00:00', 's') + seconds.astype('timedelta64[s]'))
+
+    # 发送者：一半概率延续上一条的发送者（连发），否则按活跃度重新抽取
+    weights = 1 / np.arange(1, n_senders + 1) ** 0.8
+    draws = rng.choice(n_senders, n_messages, p=weights / weights.sum())
+    keep = rng.random(n_messages) < 0.5
+    keep[0] = False
+    senders = draws[np.maximum.accumulate(np.where(keep, 0, np.arange(n_messages)))]
+    names = np.array([f'用户{i + 1:02d}' for i in range(n_senders)], dtype=object)
+    qqs = 10000 + np.arange(n_senders, dtype=np.int64) * 7919
+
+    return pd.DataFrame({
+        0: times.dt.strftime('%Y/%m/%d %H:%M'),
+        1: qqs[senders],
+        2: names[senders],
+        3: messages,
+    })
+
+
+def _generator_kwargs(args):
+    return dict(n_senders=args.senders, emoji_density=args.emoji_density, text_length=args.text_length,
+                burstiness=args.burstiness, unique_ratio=args.unique_ratio, year=args.year, seed=args.seed)
+
+
+def bench_generate(args):
+    n = _parse_count(args.messages)
+    if not args.out.lower().endswith('.csv') and n > 1_048_576:
+        sys.exit("❌ xlsx 最多 1048576 行，请改用 .csv 输出")
+    df = generate_chat(n, **_generator_kwargs(args))
+    if args.out.lower().endswith('.csv'):
+        df.to_csv(args.out, header=False, index=False)
+    else:
+        df.to_excel(args.out, header=False, index=False)
+    print(f"✅ 已生成 {n} 条消息 -> {args.out}")
+
+
+BENCH_STAGES = ['parse', 'basic_statistics', 'time_analysis', 'interaction_analysis',
+                'content_deep_analysis', 'streaming']
+
+
+def _run_stages(message, raw, year, tracer):
+    """在 tracer 下依次运行各分析函数（输出丢弃）"""
+    with redirect_stdout(io.StringIO()):
+        with tracer.stage('parse'):
+            df = message.compact_frame(message._clean_year(message._normalize_source(raw), year))
+        with tracer.stage('basic_statistics'):
+            message.basic_statistics(df)
+        with tracer.stage('time_analysis'):
+            message.time_analysis(df)
+        with tracer.stage('interaction_analysis'):
+            message.interaction_analysis(df)
+        with tracer.stage('content_deep_analysis'):
+            message.content_deep_analysis(df)
+        with tracer.stage('streaming'):
+            size = message.STREAM_CHUNK_ROWS
+            analyzer = message.StreamingAnalyzer()
+            analyzer.ingest((message._normalize_source(raw.iloc[i:i + size]) for i in range(0, len(raw), size)), year)
+            analyzer.results()
+
+
+def bench_run(args):
+    import message
+    if not args.with_cache:
+        # 关闭分词缓存，否则重复运行时 content_deep_analysis 只是在读缓存
+        message.CACHE_DIR = None
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    for label in args.scales.split(','):
+        n = _parse_count(label)
+        print(f"\n{'=' * 60}")
+        print(f"📦 规模 {label}（{n} 条消息）")
+        print(f"{'=' * 60}")
+        start = time.perf_counter()
+        raw = generate_chat(n, **_generator_kwargs(args))
+        print(f"数据生成: {time.perf_counter() - start:.1f} 秒")
+
+        timing = message.StageTracer()
+        _run_stages(message, raw, args.year, timing)
+        records = {r['stage']: r for r in timing.records}
+        if args.memory:
+            # 单独跑一遍 tracemalloc，避免它的开销混进耗时
+            memory = message.StageTracer(memory=True)
+            _run_stages(message, raw, args.year, memory)
+            for r in memory.records:
+                records[r['stage']]['peak_traced_mb'] = r['peak_traced_mb']
+        del raw
+
+        print(f"{'阶段':<24}{'耗时(秒)':>10}{'吞吐(条/秒)':>14}{'RSS峰值(MB)':>13}"
+              + (f"{'分配峰值(MB)':>14}" if args.memory else '') + (f"{'对比基线':>10}" if baseline else ''))
+        for name in BENCH_STAGES:
+            r = records[name]
+            r['throughput'] = round(n / r['wall_s']) if r['wall_s'] else None
+            line = f"{name:<26}{r['wall_s']:>10.3f}{r['throughput'] or 0:>16,}{r['max_rss_mb'] or 0:>13.1f}"
+            if args.memory:
+                line += f"{r['peak_traced_mb']:>14.1f}"
+            if baseline:
+                old = {b['stage']: b for b in baseline.get(label, [])}.get(name)
+                line += f"{r['wall_s'] / old['wall_s']:>9.2f}x" if old and old['wall_s'] else f"{'-':>10}"
+            print(line)
+        results[label] = [records[name] for name in BENCH_STAGES]
+
+    if args.out:
+        meta = dict(vars(args), python=platform.python_version(), cpu_count=os.cpu_count(),
+                    pandas=pd.__version__, finished=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        meta.pop('func', None)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"\n📝 结果已写入 {args.out}")
+
+
+def bench_startup(args):
+    print("=" * 60)
+    print("🚀 启动耗时基准")
+    print("=" * 60)
+
+    lazy_cmd = [sys.executable, "-c", "import message"]
+    eager_cmd = [sys.executable, "-c", "import message, " + ", ".join(HEAVY_MODULES)]
+    # 预热一次，避免首次运行时的磁盘缓存、.pyc 编译影响结果
+    _time_command(lazy_cmd, 1)
+    _time_command(eager_cmd, 1)
+
+    lazy = statistics.median(_time_command(lazy_cmd, args.repeat))
+    eager = statistics.median(_time_command(eager_cmd, args.repeat))
+    print(f"\n导入 message（按需导入）: {lazy:.3f} 秒")
+    print(f"导入 message + 全部绘图/分词库（原先的顶部导入）: {eager:.3f} 秒")
+    print(f"节省: {eager - lazy:.3f} 秒（{(1 - lazy / eager) * 100:.1f}%）")
+
+    print("\n各重量级依赖的额外导入耗时（message 已导入后）:")
+    for name in HEAVY_MODULES:
+        print(f"  {name}: {_import_time(name):.3f} 秒")
+
+    jieba_cmd = [sys.executable, "-c", "import jieba; jieba.initialize()"]
+    jieba_load = statistics.median(_time_command(jieba_cmd, args.repeat))
+    print(f"  jieba 导入 + 词典加载: {jieba_load:.3f} 秒（运行时在后台线程中与 Excel 解析重叠）")
+
+    if args.file:
+        file_path = os.path.abspath(args.file)
+        base = [sys.executable, os.path.join(HERE, "message.py"), "--file", file_path, "--year", str(args.year)]
+        print(f"\n端到端（{os.path.basename(file_path)}，{args.year} 年，已有缓存）:")
+        _time_command(base + ["--stats-only"], 1, cwd=args.workdir)
+        stats_only = statistics.median(_time_command(base + ["--stats-only"], args.repeat, cwd=args.workdir))
+        print(f"  --stats-only: {stats_only:.3f} 秒")
+        if not args.skip_full:
+            full = statistics.median(_time_command(base, args.repeat, cwd=args.workdir))
+            print(f"  完整运行（含渲染）: {full:.3f} 秒")
+
+
+def _stream_report_text(message, file_path, year, incremental):
+    """运行 run_stream_report（不渲染），返回文字报告部分"""
+    buf = io.StringIO()
+    with redirect_stdout(buf):
+        message.run_stream_report(file_path, year, incremental=incremental, render=False)
+    text = buf.getvalue()
+    return text.split('本次新增', 1)[-1].split('\n', 1)[-1] if incremental else text
+
+
+def check_incremental(args):
+    """
+    在同一分钟内的两条消息之间切开合成数据：先增量分析前半段，再把后半段追加到 csv 末尾续读，
+    结果应与一次性分析完整文件相同。返回发现的问题列表。
+    """
+    import message
+    raw = generate_chat(args.messages, **_generator_kwargs(args))
+    same_minute = np.flatnonzero((raw[0].iloc[1:].to_numpy() == raw[0].iloc[:-1].to_numpy()))
+    split = int(same_minute[len(same_minute) // 2]) + 1
+
+    problems = []
+    old_cache_dir = message.CACHE_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        message.CACHE_DIR = os.path.join(tmp, 'cache')
+        path = os.path.join(tmp, 'chat.csv')
+        try:
+            raw.iloc[:split].to_csv(path, header=False, index=False)
+            _stream_report_text(message, path, args.year, True)
+            raw.iloc[split:].to_csv(path, mode='a', header=False, index=False)
+            incremental = _stream_report_text(message, path, args.year, True)
+            again = _stream_report_text(message, path, args.year, True)
+            full = _stream_report_text(message, path, args.year, False)
+        finally:
+            message.CACHE_DIR = old_cache_dir
+    if incremental != full:
+        problems.append(f"在第 {split} 条（与上一条同为 {raw[0].iloc[split]}）处追加后，增量结果与全量结果不一致")
+    if again != full:
+        problems.append("没有新增消息时再次增量运行，结果发生了变化")
+    return problems
+
+
+def bench_check(args):
+    problems = check_incremental(args)
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        sys.exit(1)
+    print("✅ 增量续读自检通过")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="message.py 性能基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("startup", help="测量启动（导入）耗时")
+    p.add_argument("--repeat", type=int, default=5, help="每项重复次数，取中位数（默认 5）")
+    p.add_argument("--file", help="可选：聊天记录文件，用于测量端到端耗时")
+    p.add_argument("--year", type=int, default=2026, help="端到端测试的年份（默认 2026）")
+    p.add_argument("--workdir", default=os.getcwd(), help="端到端测试的工作目录（输出图片写在这里）")
+    p.add_argument("--skip-full", action="store_true", help="端到端测试只跑 --stats-only")
+    p.set_defaults(func=bench_startup)
+
+    def add_generator_args(p):
+        p.add_argument("--senders", type=int, default=2, help="发送者人数（默认 2）")
+        p.add_argument("--emoji-density", type=float, default=0.2, help="每条消息平均表情数（默认 0.2）")
+        p.add_argument("--text-length", type=float, default=10, help="每条消息平均字数（默认 10）")
+        p.add_argument("--burstiness", type=float, default=0.85,
+                       help="连续对话内消息的比例，越大越“扎堆”（默认 0.85）")
+        p.add_argument("--unique-ratio", type=float, default=0.2, help="不同文本占比（默认 0.2）")
+        p.add_argument("--year", type=int, default=2025, help="数据所在年份（默认 2025）")
+        p.add_argument("--seed", type=int, default=0, help="随机种子（默认 0）")
+
+    p = sub.add_parser("generate", help="生成合成聊天记录文件")
+    p.add_argument("messages", help="消息条数，如 10k、1M")
+    p.add_argument("out", help="输出文件（.xlsx 或 .csv）")
+    add_generator_args(p)
+    p.set_defaults(func=bench_generate)
+
+    p = sub.add_parser("run", help="在不同规模的合成数据上测量各分析函数")
+    p.add_argument("--scales", default="10k,1M,10M", help="逗号分隔的规模（默认 10k,1M,10M）")
+    p.add_argument("--memory", action="store_true", help="另跑一遍 tracemalloc 统计各阶段分配峰值（较慢）")
+    p.add_argument("--with-cache", action="store_true", help="保留 message.py 的分词缓存（默认关闭）")
+    p.add_argument("--out", help="把结果写成 JSON，作为以后对比的基线")
+    p.add_argument("--baseline", help="与之前 --out 写出的 JSON 对比耗时")
+    add_generator_args(p)
+    p.set_defaults(func=bench_run)
+
+    p = sub.add_parser("check", help="增量模式自检：同一分钟内追加的消息不能丢失或重复")
+    p.add_argument("--messages", type=_parse_count, default=20_000, help="合成消息条数（默认 20000）")
+    add_generator_args(p)
+    p.set_defaults(func=bench_check)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()